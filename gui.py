@@ -5,6 +5,9 @@ import tkinter as tk
 from tkinter import ttk, PhotoImage
 from tkinter.scrolledtext import ScrolledText
 from m16_driver import M16
+from link_plot import LinkPlot
+from m16_discovery import discover_modems
+from m16_supervisor import SupervisedM16
 
 import logging
 logger = logging.getLogger(__name__)
@@ -16,7 +19,10 @@ class M16GUI(tk.Tk):
         self.title("M16 Modem Controller")
         self.geometry("600x900")
         self.modem = None  # Instance of M16
+        self.connect_thread = None  # Background thread configuring the modem
+        self.cancel_connect = None  # Event used to cancel a connection in progress
         self.diag_window = None  # Diagnostic window reference
+        self.diag_modem = None  # Modem the diagnostic window listens to
         self.filename = None
         self.create_widgets()
 
@@ -34,7 +40,7 @@ class M16GUI(tk.Tk):
         ttk.Label(conn_frame, text="Port:").grid(
             row=0, column=0, padx=5, pady=5, sticky="w"
         )
-        self.port_entry = ttk.Entry(conn_frame, width=12)
+        self.port_entry = ttk.Combobox(conn_frame, width=12)
         self.port_entry.insert(0, "COM3")
         self.port_entry.grid(row=0, column=1, padx=5, pady=5, sticky="w")
 
@@ -48,6 +54,20 @@ class M16GUI(tk.Tk):
         )
         self.status_label.grid(row=0, column=3, padx=5, pady=5)        
 
+        # Progress of the configuration steps while connecting
+        self.connect_progress = ttk.Progressbar(conn_frame, mode="determinate", length=200)
+        self.connect_progress.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky="we")
+        self.cancel_button = ttk.Button(
+            conn_frame, text="Cancel", command=self.cancel_connection, width=12, state="disabled"
+        )
+        self.cancel_button.grid(row=1, column=3, padx=5, pady=5)
+
+        # Search the serial ports for modems
+        self.scan_button = ttk.Button(
+            conn_frame, text="Find Modem", command=self.scan_ports, width=12
+        )
+        self.scan_button.grid(row=1, column=0, padx=5, pady=5)
+
         # Create a subframe for the logo in column 0 of conn_frame using grid
         logo_frame = ttk.Frame(conn_frame)
         logo_frame.grid(row=0, column=0, padx=5, pady=5, sticky="nw")
@@ -212,21 +232,183 @@ class M16GUI(tk.Tk):
         state_text = f"Channel: {ch}   Level: {lv}   Mode: {mode}"
         self.after(0, lambda: self.state_label.config(text=state_text))            
 
+    def scan_ports(self) -> None:
+        """
+        Search all serial ports for modems in a background thread and list the ones found in the port field.
+        """
+        if self.modem is not None or (self.connect_thread is not None and self.connect_thread.is_alive()):
+            self.log_message("Disconnect from the modem before searching for modems.")
+            return
+        self.scan_button.config(state="disabled")
+        self.log_message("Searching for modems...")
+
+        def task():
+            try:
+                modems = discover_modems()
+            except Exception as e:
+                self.log_message(f"Error searching for modems: {e}")
+                modems = []
+            for modem in modems:
+                self.log_message(f"Found modem on {modem['port']}: CHIP_ID {modem['CHIP_ID']}, "
+                                 f"channel {modem['channel']}, level {modem['level']}")
+            if not modems:
+                self.log_message("No modems found.")
+            self.after(0, lambda: self.show_scan_result([modem["port"] for modem in modems]))
+
+        logger.debug(f"Starting thread scan_ports")
+        threading.Thread(target=task, daemon=True).start()
+
+    def show_scan_result(self, ports: list) -> None:
+        """
+        List the ports with a modem in the port field and select the first one.
+
+        Parameters:
+            ports (list): Ports where a modem was found.
+        """
+        self.scan_button.config(state="normal")
+        self.port_entry.config(values=ports)
+        if ports:
+            self.port_entry.set(ports[0])
+
     def connect_modem(self) -> None:
         """
-        Connect to the modem and update the modem states shown in the GUI app.
+        Start connecting to the modem in a background thread so the window stays responsive
+        while the modem is configured.
         """
+        if self.connect_thread is not None and self.connect_thread.is_alive():
+            return
         port = self.port_entry.get().strip()
+        if not port:
+            self.log_message("Please enter a port.")
+            return
+
+        self.disconnect_modem()
+        self.cancel_connect = threading.Event()
+        self.connect_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.connect_progress.config(value=0)
+        self.status_label.config(text="Connecting...", foreground="orange")
+        self.log_message(f"Connecting to {port}...")
+
+        logger.debug(f"Starting thread connect_task")
+        self.connect_thread = threading.Thread(
+            target=self.connect_task, args=(port, self.cancel_connect), daemon=True
+        )
+        self.connect_thread.start()
+
+    def connect_task(self, port: str, cancel: threading.Event) -> None:
+        """
+        Open the port and configure the modem, reporting each step to the GUI.
+
+        Parameters:
+            port (str): The port the modem is connected to.
+            cancel (threading.Event): Set by the Cancel button to stop the configuration.
+        """
+        modem = None
+        try:
+            logger.debug(f"Starting init modem")
+            modem = SupervisedM16(port, channel=None, level=None, diagnostic=None,
+                                  on_connection_change=self.show_connection_change)
+            completed = modem.configure(
+                channel=1, level=4, diagnostic=False,
+                progress=lambda step, total, text: self.after(
+                    0, lambda: self.show_connect_progress(step, total, text)
+                ),
+                cancel=cancel,
+            )
+            logger.debug(f"Done init modem")
+        except Exception as e:
+            if modem is not None:
+                modem.close()
+            error = str(e)
+            self.log_message(f"Could not connect to {port}: {error}")
+            self.after(0, lambda: self.finish_connect(None, "Connection Failed"))
+            return
+
+        if not completed:
+            modem.close()
+            self.log_message(f"Connection to {port} cancelled")
+            self.after(0, lambda: self.finish_connect(None, "Not Connected"))
+            return
 
-        logger.debug(f"Starting init modem")
-        self.modem = M16(port, channel=1, level=4, diagnostic=False)
-        logger.debug(f"Done init modem")
         self.log_message(f"Connected to {port}")
-        self.after(0, lambda: self.status_label.config(text="Connected", foreground="green"))
+        self.after(0, lambda: self.finish_connect(modem, "Connected"))
+
+    def show_connect_progress(self, step: int, total: int, text: str) -> None:
+        """
+        Show the configuration step currently being applied.
+
+        Parameters:
+            step (int): Index of the current step.
+            total (int): Total number of steps.
+            text (str): Description of the current step.
+        """
+        self.connect_progress.config(maximum=max(total, 1), value=step)
+        if self.cancel_connect is None or not self.cancel_connect.is_set():
+            self.status_label.config(text=text, foreground="orange")
+
+    def finish_connect(self, modem: M16 | None, status: str) -> None:
+        """
+        Restore the connection controls after a connection attempt and start monitoring the modem on success.
+
+        Parameters:
+            modem (M16 | None): The connected modem, or None if the attempt failed or was cancelled.
+            status (str): Text for the status label.
+        """
+        self.connect_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
+        self.cancel_connect = None
+        if modem is None:
+            self.connect_progress.config(value=0)
+            self.status_label.config(text=status, foreground="red")
+            return
+
+        self.modem = modem
+        # The monitor thread reads the port, the driver gets reports from it instead of reading itself
+        self.modem.background_reader = True
+        self.status_label.config(text=status, foreground="green")
         self.update_state_display()
         logger.debug(f"Starting thread: monitor_received_packets")
         threading.Thread(target=self.monitor_received_packets, daemon=True).start()
 
+    def show_connection_change(self, connected: bool) -> None:
+        """
+        Show when the connection to the modem is lost and restored, e.g. when the USB cable is unplugged.
+
+        Parameters:
+            connected (bool): True when the connection is restored, False when it is lost.
+        """
+        if connected:
+            self.log_message("Connection to the modem restored.")
+            self.after(0, lambda: self.status_label.config(text="Connected", foreground="green"))
+        else:
+            self.log_message("Connection to the modem lost, reconnecting...")
+            self.after(0, lambda: self.status_label.config(text="Reconnecting...", foreground="orange"))
+
+    def cancel_connection(self) -> None:
+        """
+        Cancel the connection in progress, the modem stops after the current configuration step.
+        """
+        if self.cancel_connect is not None:
+            self.cancel_connect.set()
+            self.cancel_button.config(state="disabled")
+            self.status_label.config(text="Cancelling...", foreground="orange")
+
+    def disconnect_modem(self) -> None:
+        """
+        Close the current modem connection, stopping the monitor thread.
+        """
+        if self.modem is None:
+            return
+        self.close_diagnostic_window()
+        modem = self.modem
+        self.modem = None
+        try:
+            modem.close()
+        except Exception as e:
+            self.log_message(f"Error closing modem: {e}")
+        self.status_label.config(text="Not Connected", foreground="red")
+        self.update_state_display()
 
     def set_channel(self) -> None:
         """
@@ -296,9 +478,7 @@ class M16GUI(tk.Tk):
                 if self.modem.diagnostic:
                     self.after(0, self.open_diagnostic_window)
                 else:
-                    if self.diag_window is not None:
-                        self.after(0, self.diag_window.destroy)
-                        self.diag_window = None
+                    self.after(0, self.close_diagnostic_window)
             except Exception as e:
                 self.log_message(f"Error toggling mode: {e}")
 
@@ -308,24 +488,36 @@ class M16GUI(tk.Tk):
     def open_diagnostic_window(self) -> None:
         """
         Open the diagnostic window and continously print diagnostic reports as they are recieved.
+        The window listens to what the monitor thread reads, it does not read the port itself.
         """
-        if self.diag_window is not None:
+        if self.diag_window is not None or self.modem is None:
             return
         self.diag_window = tk.Toplevel(self)
         self.diag_window.title("Diagnostic Reports")
         self.diag_window.protocol("WM_DELETE_WINDOW", self.on_diag_window_closed)
-        self.diag_text = ScrolledText(self.diag_window, state="disabled", height=20)
+        self.link_plot = LinkPlot(self.diag_window)
+        self.link_plot.pack(padx=5, pady=5, fill="both", expand=True)
+        self.diag_text = ScrolledText(self.diag_window, state="disabled", height=10)
         self.diag_text.pack(padx=5, pady=5, fill="both", expand=True)
-        logger.debug(f"Starting thread diganostic window")
-        threading.Thread(target=self.monitor_received_packets, daemon=True).start()
+        self.diag_modem = self.modem
+        self.diag_modem.add_listener(self.on_diag_packet)
 
-    def on_diag_window_closed(self) -> None:
+    def close_diagnostic_window(self) -> None:
         """
-        Close and change the modem mode when the diagnostic window is closed.
+        Close the diagnostic window and stop listening to the modem.
         """
+        if self.diag_modem is not None:
+            self.diag_modem.remove_listener(self.on_diag_packet)
+            self.diag_modem = None
         if self.diag_window is not None:
             self.diag_window.destroy()
             self.diag_window = None
+
+    def on_diag_window_closed(self) -> None:
+        """
+        Close and change the modem mode when the diagnostic window is closed.
+        """
+        self.close_diagnostic_window()
         # Toggle modem back to transparent if still in diagnostic mode.
         if self.modem and self.modem.diagnostic:
             self.toggle_mode()
@@ -336,8 +528,14 @@ class M16GUI(tk.Tk):
         If the returned buffer is exactly 2 bytes, decode them as ASCII
         and log "Received bytes: ..." Otherwise, process it as a diagnostic report.
         """
-        while self.modem:
-            packet = self.modem.read_packet()
+        modem = self.modem
+        while modem is not None and self.modem is modem:
+            try:
+                packet = modem.read_packet()
+            except Exception as e:
+                if self.modem is modem:
+                    self.log_message(f"Error reading from modem: {e}")
+                break
             if packet:
                 # Handle recieved 2 bytes 
                 if len(packet) == 2:
@@ -348,12 +546,12 @@ class M16GUI(tk.Tk):
                     self.after(0, lambda: self.log_message("Received bytes: " + text))
                 # Handle everything else as a potential report
                 else:
-                    report = self.modem.decode_packet(packet)
+                    report = modem.decode_packet(packet)
                     if report:
-                        self.modem.update_state_from_report(report)
-                        ch_disp = self.modem.channel
-                        lv_disp = self.modem.level
-                        diag = self.modem.diagnostic
+                        modem.update_state_from_report(report)
+                        ch_disp = modem.channel
+                        lv_disp = modem.level
+                        diag = modem.diagnostic
                         mode_disp = "Diagnostic" if diag == 1 else "Transparent" if diag is not None else "Unknown"
                         if self.focus_get() != self.channel_spin:
                             self.after(0, lambda: self.channel_spin.set(ch_disp))
@@ -362,10 +560,10 @@ class M16GUI(tk.Tk):
                         self.after(0, lambda: self.mode_label.config(text=f"Mode: {mode_disp}"))
                         self.update_state_display()
                         report_str = json.dumps(
-                            report, indent=4, default=self.modem._default_converter
+                            report, indent=4, default=modem._default_converter
                         )
-                        # Do not print to output log if in diagnostic
-                        if self.modem.diagnostic != True:
+                        # Do not print to output log if in diagnostic, the diagnostic window shows the reports
+                        if modem.diagnostic != True:
                             self.log_message("Report received:")
                             self.log_message(report_str)
 
@@ -373,12 +571,27 @@ class M16GUI(tk.Tk):
                             if self.filename is not None:
                                 self.log_message(f"Report Saved to {self.filename}")
                                 with open(self.filename, "w") as f:
-                                    json.dump(report, f, indent=4, default=self.modem._default_converter)
-
-                        self.after(0, lambda: self.append_diag_text(report_str))
+                                    json.dump(report, f, indent=4, default=modem._default_converter)
             else:
                 time.sleep(0.1)
 
+    def on_diag_packet(self, packet: bytes) -> None:
+        """
+        Listener for everything read from the modem while the diagnostic window is open, called by the thread
+        that read it. Reports are shown and plotted in the window.
+
+        Parameters:
+            packet (bytes): The received bytes.
+        """
+        modem = self.diag_modem
+        report = modem.decode_packet(packet) if modem is not None else None
+        if report is None:
+            return
+        report_str = json.dumps(report, indent=4, default=modem._default_converter)
+        received = time.monotonic()
+        self.after(0, lambda: self.append_diag_text(report_str))
+        self.after(0, lambda: self.plot_diag_report(report, received))
+
     def append_diag_text(self, text: str):
         """
         Add the text to the diagnostic, ensuring it remains scrollable and disabling user edits.
@@ -393,6 +606,18 @@ class M16GUI(tk.Tk):
         self.diag_text.see("end")
         self.diag_text.config(state="disabled")
 
+    def plot_diag_report(self, report: dict, received: float) -> None:
+        """
+        Add a report to the link quality plots in the diagnostic window.
+
+        Parameters:
+            report (dict): Decoded diagnostic report.
+            received (float): Monotonic time the report was received.
+        """
+        if self.diag_window is None:
+            return
+        self.link_plot.add_report(report, received)
+
     def read_response(self) -> (str | None):
         """
         Attempt to read available data from the modem (regardless of mode).
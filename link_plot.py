@@ -0,0 +1,235 @@
+import time
+import tkinter as tk
+from array import array
+from tkinter import ttk
+from typing import Optional, Dict, Any, List, Tuple
+
+
+class DecimatingBuffer:
+    """
+    Fixed-size buffer of min/max buckets for plotting a series over an unbounded session.
+
+    Every bucket holds the time of its first sample and the minimum and maximum of the samples in it.
+    When all buckets are used, neighbouring buckets are merged pairwise and the number of samples per bucket
+    doubles, so the memory use and the cost of drawing the buffer never grow beyond the capacity.
+    """
+
+    def __init__(self, capacity: int = 512) -> None:
+        """
+        Parameters:
+            capacity (int): Number of buckets kept, must be even (default 512).
+        """
+        if capacity < 2 or capacity % 2 != 0:
+            raise ValueError(f"Capacity {capacity} must be an even number of at least 2")
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.mins = array('d', [0.0]) * capacity
+        self.maxs = array('d', [0.0]) * capacity
+        self.length = 0  # Number of complete buckets
+        self.samples_per_bucket = 1
+        self.last = None  # Last added value
+        self.last_time = None  # Time of the last added value, the end of the last bucket
+
+        # The bucket currently being filled
+        self._pending_count = 0
+        self._pending_time = 0.0
+        self._pending_min = 0.0
+        self._pending_max = 0.0
+
+    def append(self, timestamp: float, value: float) -> None:
+        """
+        Add a sample to the buffer.
+
+        Parameters:
+            timestamp (float): Time of the sample in seconds.
+            value (float): The sample value.
+        """
+        self.last = value
+        self.last_time = timestamp
+        if self._pending_count == 0:
+            self._pending_time = timestamp
+            self._pending_min = value
+            self._pending_max = value
+        else:
+            self._pending_min = min(self._pending_min, value)
+            self._pending_max = max(self._pending_max, value)
+        self._pending_count += 1
+
+        if self._pending_count >= self.samples_per_bucket:
+            if self.length == self.capacity:
+                # The pending bucket keeps filling up to the doubled bucket size
+                self._decimate()
+                return
+            self.times[self.length] = self._pending_time
+            self.mins[self.length] = self._pending_min
+            self.maxs[self.length] = self._pending_max
+            self.length += 1
+            self._pending_count = 0
+
+    def _decimate(self) -> None:
+        """
+        Merge neighbouring buckets pairwise, halving the number of buckets used.
+        """
+        half = self.capacity // 2
+        for i in range(half):
+            a, b = 2 * i, 2 * i + 1
+            self.times[i] = self.times[a]
+            self.mins[i] = min(self.mins[a], self.mins[b])
+            self.maxs[i] = max(self.maxs[a], self.maxs[b])
+        self.length = half
+        self.samples_per_bucket *= 2
+
+    def buckets(self) -> List[Tuple[float, float, float]]:
+        """
+        Return the buckets as (time, min, max), including the bucket currently being filled.
+        """
+        result = [(self.times[i], self.mins[i], self.maxs[i]) for i in range(self.length)]
+        if self._pending_count:
+            result.append((self._pending_time, self._pending_min, self._pending_max))
+        return result
+
+    def clear(self) -> None:
+        """
+        Remove all samples from the buffer.
+        """
+        self.length = 0
+        self.samples_per_bucket = 1
+        self.last = None
+        self.last_time = None
+        self._pending_count = 0
+
+
+class LinkPlot(ttk.Frame):
+    """
+    Live plots of the link quality fields from diagnostic reports, drawn on a single Tk Canvas.
+    """
+    SERIES = ["SIGNAL_POWER", "NOISE_POWER", "BER", "PER"]
+    COLORS = {"SIGNAL_POWER": "#2e7d32", "NOISE_POWER": "#c62828", "BER": "#1565c0", "PER": "#6a1b9a"}
+    REDRAW_INTERVAL_MS = 250
+    MARGIN = 8
+
+    def __init__(self, master: tk.Misc, capacity: int = 512, width: int = 560, height: int = 400) -> None:
+        """
+        Parameters:
+            master (tk.Misc): Parent widget.
+            capacity (int): Number of buckets kept per series (default 512).
+            width (int): Initial width of the canvas in pixels.
+            height (int): Initial height of the canvas in pixels.
+        """
+        super().__init__(master)
+        self.canvas = tk.Canvas(self, width=width, height=height, background="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+        self.buffers = {name: DecimatingBuffer(capacity) for name in self.SERIES}
+        self.start_time = None
+        self._last_counters = None
+        self._redraw_id: Optional[str] = None  # Redraw scheduled with after()
+
+    def add_report(self, report: Dict[str, Any], timestamp: Optional[float] = None) -> None:
+        """
+        Add the link quality fields of a decoded report to the plots.
+        The packet error rate is computed from the change in PACKET_VALID and PACKET_INVALID since the last report.
+
+        Parameters:
+            report (Dict[str, Any]): Report decoded with M16.decode_packet().
+            timestamp (float, optional): Time the report was received, defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.start_time is None:
+            self.start_time = timestamp
+        t = timestamp - self.start_time
+
+        for name in ("SIGNAL_POWER", "NOISE_POWER", "BER"):
+            if name in report:
+                self.buffers[name].append(t, report[name])
+
+        counters = (report.get("PACKET_VALID"), report.get("PACKET_INVALID"))
+        if None not in counters:
+            if self._last_counters is not None:
+                # The counters wrap at 16 and 8 bits
+                valid = (counters[0] - self._last_counters[0]) % 0x10000
+                invalid = (counters[1] - self._last_counters[1]) % 0x100
+                if valid + invalid > 0:
+                    self.buffers["PER"].append(t, invalid / (valid + invalid))
+            self._last_counters = counters
+
+        self.schedule_redraw()
+
+    def clear(self) -> None:
+        """
+        Remove all data from the plots.
+        """
+        for buffer in self.buffers.values():
+            buffer.clear()
+        self.start_time = None
+        self._last_counters = None
+        self.schedule_redraw()
+
+    def schedule_redraw(self) -> None:
+        """
+        Redraw the plots at most once per REDRAW_INTERVAL_MS, no matter how fast reports arrive.
+        """
+        if self._redraw_id is None:
+            self._redraw_id = self.after(self.REDRAW_INTERVAL_MS, self.redraw)
+
+    def destroy(self) -> None:
+        """
+        Cancel the scheduled redraw before the widget is destroyed, e.g. when the diagnostic window is closed.
+        """
+        if self._redraw_id is not None:
+            self.after_cancel(self._redraw_id)
+            self._redraw_id = None
+        super().destroy()
+
+    def redraw(self) -> None:
+        """
+        Draw all series, each in its own horizontal band of the canvas.
+        """
+        self._redraw_id = None
+        self.canvas.delete("all")
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        band = height / len(self.SERIES)
+
+        t_end = max((b.last_time for b in self.buffers.values() if b.last_time is not None), default=0.0)
+        t_span = max(t_end, 1.0)
+
+        for index, name in enumerate(self.SERIES):
+            top = index * band + self.MARGIN
+            bottom = (index + 1) * band - self.MARGIN
+            left, right = self.MARGIN, width - self.MARGIN
+            self.canvas.create_rectangle(left, top, right, bottom, outline="#bdbdbd")
+
+            buffer = self.buffers[name]
+            buckets = buffer.buckets()
+            latest = "-" if buffer.last is None else f"{buffer.last:.3g}"
+            self.canvas.create_text(left + 4, top + 2, anchor="nw", text=f"{name}: {latest}",
+                                    fill=self.COLORS[name])
+            if not buckets:
+                continue
+
+            low = min(b[1] for b in buckets)
+            high = max(b[2] for b in buckets)
+            if high == low:
+                high, low = high + 1, low - 1
+            self.canvas.create_text(right - 4, top + 2, anchor="ne", text=f"{high:.3g}", fill="#757575")
+            self.canvas.create_text(right - 4, bottom - 2, anchor="se", text=f"{low:.3g}", fill="#757575")
+
+            def x(t: float) -> float:
+                return left + (right - left) * t / t_span
+
+            def y(v: float) -> float:
+                return bottom - (bottom - top) * (v - low) / (high - low)
+
+            upper, lower = [], []
+            for t, v_min, v_max in buckets:
+                upper.extend((x(t), y(v_max)))
+                lower.extend((x(t), y(v_min)))
+            if len(buckets) == 1:
+                self.canvas.create_oval(upper[0] - 2, upper[1] - 2, upper[0] + 2, upper[1] + 2,
+                                        fill=self.COLORS[name], outline="")
+                continue
+            self.canvas.create_line(*upper, fill=self.COLORS[name])
+            if lower != upper:
+                self.canvas.create_line(*lower, fill=self.COLORS[name])
@@ -0,0 +1,179 @@
+from typing import Optional, Iterable
+
+from m16_frame import HEADER_BLOCKS
+
+# Addresses are 7 bits and sent in the first block of a frame, see m16_frame.Frame
+MAX_UNICAST = 95  # Node addresses are 0 to 95
+FIRST_GROUP = 96  # Multicast groups are 96 to 126
+BROADCAST = 127  # Every node
+
+
+def is_group(address: int) -> bool:
+    """
+    True for multicast group addresses and the broadcast address.
+    """
+    return address >= FIRST_GROUP
+
+
+class AddressFilter:
+    """
+    Drops received blocks of frames for other nodes before they are decoded, logged or passed to listeners.
+
+    The filter follows the frame boundaries in the stream of received blocks. The first block of a frame holds
+    the link destination, if that is not this node, the broadcast address or one of the joined groups, the
+    frame's blocks are dropped. Only the length in the third block is looked at, to know where the next frame
+    starts. After a pause of more than max_gap seconds the next block is taken as the start of a new frame.
+    Blocks the modem could not decode are counted with the PACKET_INVALID counter of the diagnostic reports and
+    keep their place in the frame, so a lost block does not shift the boundaries of the frames after it. If the
+    lost block is the first block the frame is passed on, if it held the length every block is passed on until
+    the next pause.
+
+    Installed as M16.address_filter, it works on what read_packet() reads:
+        - diagnostic reports with a received block (TB_VALID) are dropped by looking at the raw bytes, other
+          reports are passed on and counted in lost_blocks if they report a lost block of a frame passed on
+        - data read in transparent mode has the bytes of foreign frames removed
+
+    Example:
+        modem.address_filter = AddressFilter(5, groups=[100])
+    """
+
+    def __init__(self, node_id: int, groups: Iterable[int] = (), max_gap: float = 10.0) -> None:
+        """
+        Parameters:
+            node_id (int): Address of this node (0 to MAX_UNICAST).
+            groups (Iterable[int]): Multicast groups this node is a member of (FIRST_GROUP to BROADCAST - 1).
+            max_gap (float): Seconds without a block after which a new frame starts (default 10).
+        """
+        if not 0 <= node_id <= MAX_UNICAST:
+            raise ValueError(f"Node address {node_id} is not between 0 and {MAX_UNICAST}")
+        self.node_id = node_id
+        self.groups = set()
+        for group in groups:
+            self.join(group)
+        self.max_gap = max_gap
+
+        self._position = 0  # Block number within the current frame
+        self._blocks = 0  # Number of blocks in the current frame, 0 until the length is known
+        self._accepting = True
+        self._pending = b""  # First byte of a block in transparent mode
+        self._last_time: Optional[float] = None
+        self._packet_invalid: Optional[int] = None  # PACKET_INVALID of the last report
+
+        # Statistics
+        self.accepted_frames = 0
+        self.dropped_frames = 0
+        self.dropped_blocks = 0
+        self.lost_blocks = 0  # Blocks lost in frames passed on, see m16_frame.FrameDecoder.skip()
+
+    def join(self, group: int) -> None:
+        """
+        Become a member of a multicast group.
+        """
+        if not FIRST_GROUP <= group < BROADCAST:
+            raise ValueError(f"Group address {group} is not between {FIRST_GROUP} and {BROADCAST - 1}")
+        self.groups.add(group)
+
+    def leave(self, group: int) -> None:
+        """
+        Stop being a member of a multicast group.
+        """
+        self.groups.discard(group)
+
+    def accepts(self, address: int) -> bool:
+        """
+        True if frames for the address are for this node.
+        """
+        return address == self.node_id or address == BROADCAST or address in self.groups
+
+    def accept_block(self, block: bytes, time: Optional[float] = None) -> bool:
+        """
+        Follow the frame boundaries with one received block.
+
+        Parameters:
+            block (bytes): The received block of 2 bytes.
+            time (float, optional): Time the block was received.
+
+        Returns:
+            bool: True if the block belongs to a frame for this node.
+        """
+        self._check_gap(time)
+        if self._position == 0:
+            self._blocks = 0
+            self._accepting = self.accepts(block[0])
+            if self._accepting:
+                self.accepted_frames += 1
+            else:
+                self.dropped_frames += 1
+        elif self._position == HEADER_BLOCKS - 1:
+            self._blocks = HEADER_BLOCKS + (block[1] + 1) // 2 + 1
+
+        accepting = self._accepting
+        self._next_position()
+        if not accepting:
+            self.dropped_blocks += 1
+        return accepting
+
+    def skip_block(self, time: Optional[float] = None) -> bool:
+        """
+        Follow the frame boundaries over a block the modem could not decode.
+
+        Parameters:
+            time (float, optional): Time the block was lost.
+
+        Returns:
+            bool: True if the block belongs to a frame that is passed on.
+        """
+        self._check_gap(time)
+        if self._position in (0, HEADER_BLOCKS - 1):
+            # Without the destination the receiver finds the frame corrupt,
+            # without the length everything is passed on until the next pause
+            self._blocks = 0
+            self._accepting = True
+        accepting = self._accepting
+        self._next_position()
+        if accepting:
+            self.lost_blocks += 1
+        return accepting
+
+    def _check_gap(self, time: Optional[float]) -> None:
+        if time is not None:
+            if self._last_time is not None and time - self._last_time > self.max_gap:
+                self._position = 0
+            self._last_time = time
+
+    def _next_position(self) -> None:
+        self._position += 1
+        if self._blocks and self._position >= self._blocks:
+            self._position = 0
+
+    def filter(self, packet: bytes, time: Optional[float] = None) -> Optional[bytes]:
+        """
+        Filter what read_packet() has read.
+
+        Parameters:
+            packet (bytes): A diagnostic report or data read in transparent mode.
+            time (float, optional): Time the data was received.
+
+        Returns:
+            Optional[bytes]: The packet, the data of frames for this node, or None if nothing is left.
+        """
+        # A report: '$', received block, ..., PACKET_INVALID in byte 8, flags with TB_VALID in bit 6 of byte 15, '\n'
+        if len(packet) == 18 and packet[0] == 0x24 and packet[17] == 0x0A:
+            if self._packet_invalid is not None:
+                # The 8 bit counter wraps around
+                for _ in range((packet[8] - self._packet_invalid) % 256):
+                    self.skip_block(time)
+            self._packet_invalid = packet[8]
+            if not packet[15] & 0x40 or packet[15] & 0x80:
+                return packet
+            return packet if self.accept_block(packet[1:3], time) else None
+
+        data = self._pending + packet
+        kept = bytearray()
+        end = len(data) - len(data) % 2
+        for i in range(0, end, 2):
+            if self.accept_block(data[i:i+2], time):
+                kept += data[i:i+2]
+        # A single byte waits for the rest of its block
+        self._pending = data[end:]
+        return bytes(kept) if kept else None
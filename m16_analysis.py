@@ -0,0 +1,280 @@
+import os
+import csv
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Iterable
+
+import numpy as np
+
+PACKET_LENGTH = 18
+# The 16 data bytes of a report, see M16.decode_packet()
+REPORT_DTYPE = np.dtype([
+    ("TR_BLOCK", "<u2"), ("BER", "u1"), ("SIGNAL_POWER", "u1"), ("NOISE_POWER", "u1"), ("PACKET_VALID", "<u2"),
+    ("PACKET_INVALID", "u1"), ("GIT_REV", "u1"), ("TIME_0", "u1"), ("TIME_1", "u1"), ("TIME_2", "u1"),
+    ("CHIP_ID", "<u2"), ("FLAGS", "u1"), ("MODE", "u1"),
+])
+FIELDS = ("TR_BLOCK", "BER", "SIGNAL_POWER", "NOISE_POWER", "PACKET_VALID", "PACKET_INVALID", "GIT_REV", "TIME",
+          "CHIP_ID", "HW_REV", "CHANNEL", "TB_VALID", "TX_COMPLETE", "DIAGNOSTIC_MODE", "LEVEL")
+
+TICKS_PER_SECOND = 1000.0  # rate of the TIME counter
+BLOCK_AIRTIME = 2.0  # seconds to transmit one block
+SNR_BINS = np.arange(-50, 155, 5)  # SIGNAL_POWER - NOISE_POWER
+BER_BINS = np.arange(0, 264, 8)
+INTERARRIVAL_BINS = np.concatenate(([0.0], 2.0 ** np.arange(-1, 11)))  # seconds, 0 and 0.5 to 1024
+HISTOGRAMS = {"snr_histogram": SNR_BINS, "ber_histogram": BER_BINS, "interarrival_histogram": INTERARRIVAL_BINS}
+
+
+def decode_capture(data: bytes) -> Dict[str, np.ndarray]:
+    """
+    Decode all reports in bytes read from the modem, e.g. a raw capture of the serial port, into columns.
+
+    Reports are found the way M16.read_packet() finds them, a '$' followed 17 bytes later by '\\n', bytes between
+    reports (e.g. data in transparent mode) are skipped.
+
+    Parameters:
+        data (bytes): The captured bytes.
+
+    Returns:
+        Dict[str, np.ndarray]: One array per field of M16.decode_packet(), TR_BLOCK as the little endian integer of
+                               the two bytes and GIT_REV as an integer.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer) < PACKET_LENGTH:
+        return columns_from_records(np.zeros(0, dtype=REPORT_DTYPE))
+    starts = np.flatnonzero((buffer[:-PACKET_LENGTH + 1] == 0x24) & (buffer[PACKET_LENGTH - 1:] == 0x0A))
+    if len(starts) > 1 and np.any(np.diff(starts) < PACKET_LENGTH):
+        # A '$' inside a report lined up with a '\n', keep the first of overlapping candidates as read_packet() does
+        kept = []
+        end = -1
+        for start in starts.tolist():
+            if start >= end:
+                kept.append(start)
+                end = start + PACKET_LENGTH
+        starts = np.array(kept, dtype=np.int64)
+    rows = buffer[starts[:, None] + np.arange(1, PACKET_LENGTH - 1)]
+    return columns_from_records(np.ascontiguousarray(rows).view(REPORT_DTYPE).reshape(-1))
+
+
+def columns_from_records(records: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Split report records of REPORT_DTYPE into the fields of M16.decode_packet().
+    """
+    flags = records["FLAGS"]
+    return {
+        "TR_BLOCK": records["TR_BLOCK"].astype(np.int64),
+        "BER": records["BER"].astype(np.int64),
+        "SIGNAL_POWER": records["SIGNAL_POWER"].astype(np.int64),
+        "NOISE_POWER": records["NOISE_POWER"].astype(np.int64),
+        "PACKET_VALID": records["PACKET_VALID"].astype(np.int64),
+        "PACKET_INVALID": records["PACKET_INVALID"].astype(np.int64),
+        "GIT_REV": records["GIT_REV"].astype(np.int64),
+        "TIME": (records["TIME_2"].astype(np.int64) << 16) | (records["TIME_1"].astype(np.int64) << 8)
+                | records["TIME_0"],
+        "CHIP_ID": records["CHIP_ID"].astype(np.int64),
+        "HW_REV": (flags & 0b00000011).astype(np.int64),
+        "CHANNEL": ((flags & 0b00111100) >> 2).astype(np.int64),
+        "TB_VALID": ((flags & 0b01000000) >> 6).astype(np.int64),
+        "TX_COMPLETE": ((flags & 0b10000000) >> 7).astype(np.int64),
+        "DIAGNOSTIC_MODE": (records["MODE"] & 0b00000001).astype(np.int64),
+        "LEVEL": ((records["MODE"] & 0b00001100) >> 2).astype(np.int64),
+    }
+
+
+def columns_from_reports(reports: Iterable[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Put decoded reports, e.g. read from JSON files saved by M16.request_report(), into columns.
+    TR_BLOCK and GIT_REV may be bytes or hex strings.
+    """
+    def number(value: Any) -> int:
+        if isinstance(value, str):
+            value = bytes.fromhex(value)
+        return int.from_bytes(value, "little") if isinstance(value, bytes) else int(value)
+
+    reports = list(reports)
+    return {field: np.array([number(report.get(field, 0)) for report in reports], dtype=np.int64)
+            for field in FIELDS}
+
+
+def load_file(path: str) -> Dict[str, np.ndarray]:
+    """
+    Load the reports of a recorded session into columns.
+
+    Parameters:
+        path (str): A JSON file with a report or a list of reports, a JSON Lines file (.jsonl) with one report per
+                    line, or any other file as a raw capture of the bytes read from the modem.
+
+    Returns:
+        Dict[str, np.ndarray]: The reports as columns, see decode_capture().
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        with open(path, "r") as file:
+            content = json.load(file)
+        return columns_from_reports(content if isinstance(content, list) else [content])
+    if extension == ".jsonl":
+        with open(path, "r") as file:
+            return columns_from_reports(json.loads(line) for line in file if line.strip())
+    with open(path, "rb") as file:
+        return decode_capture(file.read())
+
+
+def modem_seconds(time: np.ndarray) -> np.ndarray:
+    """
+    Unwrap the 24 bit TIME counter of consecutive reports into seconds since the first report.
+    A step back by more than half the counter range is a modem restart and counts as no time.
+    """
+    if len(time) == 0:
+        return np.zeros(0)
+    steps = np.diff(time) % (1 << 24)
+    steps[steps > 1 << 23] = 0
+    return np.concatenate(([0], np.cumsum(steps))) / TICKS_PER_SECOND
+
+
+def _group_statistics(columns: Dict[str, np.ndarray], mask: np.ndarray, seconds: np.ndarray,
+                      intervals: np.ndarray, valid_steps: np.ndarray, invalid_steps: np.ndarray) -> Dict[str, Any]:
+    """
+    Statistics of the reports selected by mask. The interval and counter steps before a report belong to that
+    report's group.
+    """
+    received = mask & (columns["TB_VALID"] == 1) & (columns["TX_COMPLETE"] == 0)
+    sent = mask & (columns["TX_COMPLETE"] == 1)
+    snr = (columns["SIGNAL_POWER"] - columns["NOISE_POWER"])[received]
+    ber = columns["BER"][received]
+    arrivals = seconds[received]
+    interarrival = np.diff(arrivals)
+    duration = float(intervals[mask].sum())
+    valid, invalid = int(valid_steps[mask].sum()), int(invalid_steps[mask].sum())
+    return {
+        "reports": int(mask.sum()),
+        "duration": duration,
+        "blocks_received": int(received.sum()),
+        "blocks_sent": int(sent.sum()),
+        "packets_valid": valid,
+        "packets_invalid": invalid,
+        "packet_error_rate": invalid / (valid + invalid) if valid + invalid else None,
+        "tx_duty_cycle": min(int(sent.sum()) * BLOCK_AIRTIME / duration, 1.0) if duration > 0 else None,
+        "snr_mean": float(snr.mean()) if len(snr) else None,
+        "ber_mean": float(ber.mean()) if len(ber) else None,
+        "interarrival_median": float(np.median(interarrival)) if len(interarrival) else None,
+        "interarrival_p90": float(np.percentile(interarrival, 90)) if len(interarrival) else None,
+        "snr_histogram": np.histogram(np.clip(snr, SNR_BINS[0], SNR_BINS[-1] - 1), SNR_BINS)[0],
+        "ber_histogram": np.histogram(ber, BER_BINS)[0],
+        "interarrival_histogram": np.histogram(np.clip(interarrival, 0, INTERARRIVAL_BINS[-1] - 1),
+                                               INTERARRIVAL_BINS)[0],
+    }
+
+
+def session_statistics(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """
+    Link statistics of one recorded session, in total and for every combination of channel and power level.
+
+    The packet error rate comes from the steps of the PACKET_VALID and PACKET_INVALID counters between reports,
+    steps larger than the blocks that fit in the time between the reports are taken as a modem restart and ignored.
+    The TX duty cycle is the airtime of the blocks with TX_COMPLETE over the time covered by the reports.
+
+    Returns:
+        Dict[str, Any]: "total" and "groups", a list of the statistics with "channel" and "level" of each group.
+                        Histograms are counts for the bins in HISTOGRAMS.
+    """
+    seconds = modem_seconds(columns["TIME"])
+    intervals = np.concatenate(([0.0], np.diff(seconds)))
+    valid_steps = np.concatenate(([0], np.diff(columns["PACKET_VALID"]) % (1 << 16)))
+    invalid_steps = np.concatenate(([0], np.diff(columns["PACKET_INVALID"]) % (1 << 8)))
+    possible = intervals / BLOCK_AIRTIME + 1
+    restarted = valid_steps + invalid_steps > possible
+    valid_steps[restarted] = 0
+    invalid_steps[restarted] = 0
+
+    arguments = (seconds, intervals, valid_steps, invalid_steps)
+    levels = 4 - columns["LEVEL"]
+    total = _group_statistics(columns, np.ones(len(seconds), dtype=bool), *arguments)
+    groups = []
+    for channel, level in sorted(set(zip(columns["CHANNEL"].tolist(), levels.tolist()))):
+        statistics = {"channel": channel, "level": level}
+        statistics.update(_group_statistics(columns, (columns["CHANNEL"] == channel) & (levels == level), *arguments))
+        groups.append(statistics)
+    return {"total": total, "groups": groups}
+
+
+def analyse_file(path: str) -> Dict[str, Any]:
+    """
+    Load a recorded session and compute its statistics, see session_statistics().
+    """
+    statistics = session_statistics(load_file(path))
+    statistics["session"] = path
+    return statistics
+
+
+def analyse_files(paths: List[str], processes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Analyse many recorded sessions in parallel in a pool of processes.
+
+    Parameters:
+        paths (List[str]): The session files, see load_file().
+        processes (int, optional): Number of processes, defaults to the number of CPUs. 1 analyses in this process.
+
+    Returns:
+        List[Dict[str, Any]]: The statistics of every session in the order of paths.
+    """
+    if processes == 1 or len(paths) <= 1:
+        return [analyse_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(analyse_file, paths))
+
+
+def _rows(sessions: List[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    """
+    The total and the groups of every session as flat rows with the session, channel and level.
+    """
+    for session in sessions:
+        yield {"session": session["session"], "channel": None, "level": None, **session["total"]}
+        for group in session["groups"]:
+            yield {"session": session["session"], **group}
+
+
+def export_csv(sessions: List[Dict[str, Any]], path: str) -> None:
+    """
+    Write the scalar statistics of the sessions to a CSV file, one row per session total and per group.
+    """
+    rows = [{key: value for key, value in row.items() if key not in HISTOGRAMS} for row in _rows(sessions)]
+    if not rows:
+        return
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def export_npz(sessions: List[Dict[str, Any]], path: str) -> None:
+    """
+    Write the histograms of the sessions to a compressed NPZ file.
+
+    The bins are stored as "<histogram>_bins" and the counts as "<histogram>" with one row per CSV row, in the same
+    order of session totals and groups, together with the session, channel and level of every row (-1 for totals).
+    """
+    rows = list(_rows(sessions))
+    arrays = {f"{name}_bins": bins for name, bins in HISTOGRAMS.items()}
+    for name, bins in HISTOGRAMS.items():
+        arrays[name] = np.array([row[name] for row in rows], dtype=np.int64).reshape(len(rows), len(bins) - 1)
+    arrays["session"] = np.array([row["session"] for row in rows], dtype=str)
+    arrays["channel"] = np.array([-1 if row["channel"] is None else row["channel"] for row in rows])
+    arrays["level"] = np.array([-1 if row["level"] is None else row["level"] for row in rows])
+    np.savez_compressed(path, **arrays)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Link statistics of recorded M16 sessions.")
+    parser.add_argument("files", nargs="+", help="Raw captures, JSON reports or JSON Lines report logs")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes (default: CPUs)")
+    parser.add_argument("--csv", help="Write the statistics to this CSV file")
+    parser.add_argument("--npz", help="Write the histograms to this NPZ file")
+    arguments = parser.parse_args()
+
+    results = analyse_files(arguments.files, arguments.processes)
+    if arguments.csv:
+        export_csv(results, arguments.csv)
+    if arguments.npz:
+        export_npz(results, arguments.npz)
+    for row in _rows(results):
+        print({key: value for key, value in row.items() if key not in HISTOGRAMS})
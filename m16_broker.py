@@ -0,0 +1,561 @@
+import os
+import json
+import queue
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+from m16_driver import M16
+from m16_transport import Transport
+
+DEFAULT_ADDRESS = "127.0.0.1:5016"
+
+# Fields of a decoded report that are bytes and sent as hex strings
+BYTES_FIELDS = ("TR_BLOCK", "GIT_REV")
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    Parse a broker address, "host:port" for TCP or a file path for a Unix socket.
+
+    Parameters:
+        address (str): The address to parse.
+
+    Returns:
+        Union[str, Tuple[str, int]]: (host, port) for TCP, otherwise the socket path.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def report_to_json(report: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Convert a decoded report to a JSON serializable dict.
+    """
+    if report is None:
+        return None
+    return {key: value.hex() if isinstance(value, bytes) else value for key, value in report.items()}
+
+
+def report_from_json(report: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Convert a report received from the broker back to the format returned by M16.decode_packet().
+    """
+    if report is None:
+        return None
+    return {key: bytes.fromhex(value) if key in BYTES_FIELDS else value for key, value in report.items()}
+
+
+class M16Broker:
+    """
+    Owns one modem and shares it with other processes over a local socket.
+
+    Each line sent over the socket is a JSON object. Requests are {"id": n, "method": name, "args": [...],
+    "kwargs": {...}} and are answered with {"id": n, "result": ..., "state": {...}} or {"id": n, "error": text}.
+    Clients that have called "subscribe" also get {"event": "packet", "kind": "block" | "report", "data": hex}
+    for everything read from the modem, so every subscriber sees every received block and report.
+
+    A reader thread continuously reads from the modem. Commands from different clients are sent one at a time
+    by the modem itself, and methods waiting for reports (request_report() and send_msg() in diagnostic mode)
+    get them from the reader thread, so concurrent report requests from several clients share one request.
+    """
+    # Methods of M16 that clients are allowed to call
+    METHODS = ["send_data", "send_two_bytes", "send_msg", "set_channel", "set_level", "set_diagnostic_mode",
+               "reset_diagnostic_mode", "toggle_mode", "get_report", "request_report", "configure"]
+    READ_TIMEOUT = 0.2  # seconds per read of the reader thread
+    CLIENT_QUEUE_SIZE = 1000  # events buffered per client before the oldest are dropped
+
+    def __init__(self, modem: M16, address: str = DEFAULT_ADDRESS) -> None:
+        """
+        Parameters:
+            modem (M16): The connected modem to share.
+            address (str): "host:port" to listen on TCP, or a path to listen on a Unix socket
+                           (default "127.0.0.1:5016").
+        """
+        self.logger = logging.getLogger(__name__)
+        self.modem = modem
+        self.address = parse_address(address)
+        self.clients: List["_ClientHandler"] = []
+        self.clients_lock = threading.Lock()
+        self.running = False
+        self.server = None
+        self.reader_thread = None
+        self.modem.add_listener(self._publish)
+
+    def start(self) -> None:
+        """
+        Start listening for clients and reading from the modem in background threads.
+        """
+        broker = self
+
+        class Handler(_ClientHandler):
+            pass
+        Handler.broker = broker
+
+        if isinstance(self.address, tuple):
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self.server = socketserver.ThreadingTCPServer(self.address, Handler)
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = socketserver.ThreadingUnixStreamServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.running = True
+
+        self.reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader_thread.start()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Broker listening on {self.address}")
+
+    def serve_forever(self) -> None:
+        """
+        Start the broker and block until it is stopped.
+        """
+        self.start()
+        try:
+            while self.running:
+                self.reader_thread.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stop the broker and close the client connections. The modem is not closed.
+        """
+        self.running = False
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.remove(self.address)
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+        self.modem.remove_listener(self._publish)
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Return the modem's internal state.
+        """
+        return {"channel": self.modem.channel, "level": self.modem.level, "diagnostic": self.modem.diagnostic}
+
+    def call(self, method: str, args: List[Any], kwargs: Dict[str, Any]) -> Any:
+        """
+        Run a modem method on behalf of a client.
+
+        Parameters:
+            method (str): Name of the M16 method, must be in METHODS.
+            args (List[Any]): Positional arguments.
+            kwargs (Dict[str, Any]): Keyword arguments.
+
+        Returns:
+            Any: The JSON serializable result of the method.
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Method {method} is not supported by the broker")
+        result = getattr(self.modem, method)(*args, **kwargs)
+        if method == "request_report":
+            return report_to_json(result)
+        return result
+
+    def _read_loop(self) -> None:
+        """
+        Continuously read from the modem. Data is passed on to subscribers by _publish().
+        """
+        self.modem.background_reader = True
+        try:
+            while self.running:
+                self.modem.read_packet(timeout=self.READ_TIMEOUT)
+        except Exception as e:
+            self.logger.error(f"Error reading from modem: {e}")
+            self.running = False
+        finally:
+            self.modem.background_reader = False
+
+    def _publish(self, data: bytes) -> None:
+        """
+        Send received data to all subscribed clients.
+        """
+        report = self.modem.decode_packet(data)
+        if report is not None:
+            self.modem.update_state_from_report(report)
+        event = {"event": "packet", "kind": "report" if report is not None else "block", "data": data.hex()}
+        with self.clients_lock:
+            clients = [client for client in self.clients if client.subscribed]
+        for client in clients:
+            client.send(event)
+
+
+class _ClientHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection of the broker.
+    """
+    broker: M16Broker = None
+
+    def setup(self) -> None:
+        super().setup()
+        self.subscribed = False
+        self.dropped = 0
+        self.closed = False
+        self.outbox = queue.Queue(maxsize=self.broker.CLIENT_QUEUE_SIZE)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        with self.broker.clients_lock:
+            self.broker.clients.append(self)
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                self.send({"error": "Invalid JSON"})
+                continue
+            self.send(self._handle_request(request))
+
+    def _handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Handle one request and return the response.
+        """
+        response = {"id": request.get("id")}
+        method = request.get("method")
+        try:
+            if method == "subscribe":
+                self.subscribed = True
+                result = True
+            elif method == "unsubscribe":
+                self.subscribed = False
+                result = True
+            elif method == "state":
+                result = None
+            else:
+                result = self.broker.call(method, request.get("args", []), request.get("kwargs", {}))
+            response["result"] = result
+        except Exception as e:
+            response["error"] = f"{type(e).__name__}: {e}"
+        response["state"] = self.broker.state()
+        return response
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """
+        Queue a message for the client, dropping the oldest message if the client is not keeping up.
+        """
+        while True:
+            try:
+                self.outbox.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.outbox.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _write_loop(self) -> None:
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                return
+            try:
+                self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def close(self) -> None:
+        """
+        Close the connection to the client.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.send(None)
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def finish(self) -> None:
+        with self.broker.clients_lock:
+            if self in self.broker.clients:
+                self.broker.clients.remove(self)
+        self.send(None)
+        self.writer.join(1)
+        if self.dropped:
+            self.broker.logger.warning(f"Dropped {self.dropped} events for a slow client")
+        super().finish()
+
+
+class BrokerTransport(Transport):
+    """
+    Transport to a modem shared by an M16Broker.
+
+    Everything the broker reads from the modem arrives as a byte stream, the same as from a serial port, so the
+    driver finds blocks and reports in it as usual. The stream is only subscribed to when it is first read, and
+    at most RX_BUFFER_SIZE bytes are kept for a client that stops reading, the oldest are dropped. Written data is
+    sent through the broker with "send_data", other requests are made with call().
+    """
+    RX_BUFFER_SIZE = 18 * 1000  # bytes kept for the driver, about as many reports as the broker queues per client
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 0.5) -> None:
+        """
+        Parameters:
+            address (str): Address of the broker, "host:port" or a Unix socket path (default "127.0.0.1:5016").
+            timeout (float): Timeout for connecting to the broker and for reads (default 0.5).
+        """
+        self.timeout = timeout
+        target = parse_address(address)
+        if isinstance(target, tuple):
+            self.sock = socket.create_connection(target, timeout=timeout)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(target)
+        self.sock.settimeout(None)
+        self.is_open = True
+        self.rfile = self.sock.makefile("rb")
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Dict[str, Any]] = {}
+        self.pending_lock = threading.Condition()
+        self.next_id = 0
+        self.closed = False
+        self._rx = bytearray()
+        self._rx_condition = threading.Condition()
+        self.subscribed = False
+        self.dropped = 0  # Bytes dropped because the driver did not read them
+
+        self.reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader_thread.start()
+
+    def _read_loop(self) -> None:
+        """
+        Dispatch messages from the broker, responses to the waiting callers and events to the receive buffer.
+        """
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message.get("event") == "packet":
+                    with self._rx_condition:
+                        self._rx += bytes.fromhex(message["data"])
+                        overflow = len(self._rx) - self.RX_BUFFER_SIZE
+                        if overflow > 0:
+                            del self._rx[:overflow]
+                            self.dropped += overflow
+                        self._rx_condition.notify_all()
+                    continue
+                with self.pending_lock:
+                    self.pending[message.get("id")] = message
+                    self.pending_lock.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.pending_lock:
+                self.closed = True
+                self.pending_lock.notify_all()
+            with self._rx_condition:
+                self._rx_condition.notify_all()
+
+    def call(self, method: str, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Call a method on the broker and wait for the response.
+
+        Returns:
+            Dict[str, Any]: The response, with "result" or "error" and the modem "state".
+        """
+        with self.pending_lock:
+            self.next_id += 1
+            request_id = self.next_id
+        request = {"id": request_id, "method": method, "args": list(args), "kwargs": kwargs}
+        with self.send_lock:
+            self.sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+        with self.pending_lock:
+            while request_id not in self.pending:
+                if self.closed:
+                    raise ConnectionError("Connection to the broker was closed")
+                self.pending_lock.wait()
+            return self.pending.pop(request_id)
+
+    def subscribe(self) -> None:
+        """
+        Ask the broker for everything it reads from the modem, if not done yet.
+        """
+        if self.subscribed or self.closed:
+            return
+        response = self.call("subscribe")
+        if "error" in response:
+            raise RuntimeError(f"Broker error in subscribe: {response['error']}")
+        self.subscribed = True
+
+    def discard(self) -> None:
+        """
+        Drop the received bytes not read yet.
+        """
+        with self._rx_condition:
+            self._rx.clear()
+
+    def write(self, data: bytes) -> int:
+        response = self.call("send_data", data.decode("ascii"))
+        if "error" in response:
+            raise RuntimeError(f"Broker error in send_data: {response['error']}")
+        return response.get("result")
+
+    def read(self, size: int = 1) -> bytes:
+        self.subscribe()
+        with self._rx_condition:
+            self._rx_condition.wait_for(lambda: self._rx or self.closed, self.timeout)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    @property
+    def in_waiting(self) -> int:
+        self.subscribe()
+        with self._rx_condition:
+            return len(self._rx)
+
+    def close(self) -> None:
+        self.is_open = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class M16Client(M16):
+    """
+    Drop-in replacement for M16 that uses a modem shared by an M16Broker.
+
+    Attaching to the broker does not configure the modem, the channel, level and mode are taken from the broker.
+    Every block and report read by the broker after this client first calls read_packet() is sent to this client
+    and returned by read_packet(), a client that only sends does not receive them. Commands are run by the broker, so a message from send_msg() is not interleaved with the blocks of other clients. With a
+    TDMA scheduler set, every block is sent on its own in this node's time slot instead.
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 0.5) -> None:
+        """
+        Parameters:
+            address (str): Address of the broker, "host:port" or a Unix socket path (default "127.0.0.1:5016").
+            timeout (float): Timeout for connecting to the broker and for reads (default 0.5).
+        """
+        super().__init__(BrokerTransport(address, timeout), channel=None, level=None, diagnostic=None,
+                         timeout=timeout)
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        Call a method on the broker and wait for the result.
+        """
+        response = self.ser.call(method, *args, **kwargs)
+        state = response.get("state")
+        if state is not None:
+            self.channel = state["channel"]
+            self.level = state["level"]
+            self.diagnostic = state["diagnostic"]
+        if "error" in response:
+            raise RuntimeError(f"Broker error in {method}: {response['error']}")
+        return response.get("result")
+
+    def configure(self, channel: Optional[int] = None, level: Optional[int] = None,
+                  diagnostic: Optional[bool] = None,
+                  progress: Optional[Callable[[int, int, str], None]] = None,
+                  cancel: Optional[threading.Event] = None) -> bool:
+        """
+        Apply channel, power level and mode to the shared modem, see M16.configure().
+        Progress is only reported when the whole configuration is done and cancel is only checked before starting.
+        """
+        if channel is None and level is None and diagnostic is None:
+            return True
+        if cancel is not None and cancel.is_set():
+            return False
+        result = self._call("configure", channel, level, diagnostic)
+        if progress is not None:
+            progress(1, 1, "Configuration done")
+        return result
+
+    def send_data(self, data: str) -> int | None:
+        return self._call("send_data", data)
+
+    def set_channel(self, channel: int) -> bool:
+        return self._call("set_channel", channel)
+
+    def set_level(self, level: int) -> bool:
+        return self._call("set_level", level)
+
+    def set_diagnostic_mode(self) -> None:
+        self._call("set_diagnostic_mode")
+
+    def reset_diagnostic_mode(self) -> None:
+        self._call("reset_diagnostic_mode")
+
+    def toggle_mode(self) -> None:
+        self._call("toggle_mode")
+
+    def get_report(self) -> None:
+        self._call("get_report")
+
+    def request_report(self, filename: Optional[str] = None, overall_timeout: float = 5.0,
+                       max_age: Optional[float] = None) -> Dict[str, Any] | None:
+        """
+        Request a diagnostic report from the shared modem and optionally save it as a JSON file.
+
+        Parameters:
+            filename (str, optional): If provided, the report is saved to this file.
+            overall_timeout (float): Maximum time (in seconds) to wait for a valid report.
+            max_age (float, optional): Accept a report the broker received less than max_age seconds ago.
+
+        Returns:
+            Dict[str, Any]: The decoded report if successful; otherwise, None.
+        """
+        report = report_from_json(self._call("request_report", overall_timeout=overall_timeout, max_age=max_age))
+        if report is not None and filename is not None:
+            with open(filename, "w") as f:
+                json.dump(report, f, indent=4, default=self._default_converter)
+            self.logger.info(f"Report saved to {filename}")
+        return report
+
+    def send_two_bytes(self, data: str) -> (int | None):
+        with self.command_lock:
+            if self.tdma is not None:
+                self.tdma.wait_for_slot()
+            sent = self._call("send_two_bytes", data)
+            self.last_send_time = self.clock.time()
+        return sent
+
+    def send_msg(self, msg: str, timeout_per_chunk: float = 5.0) -> (int | None):
+        if self.tdma is not None:
+            # Every block has to wait for the time slot of this node
+            with self.command_lock:
+                if not self.background_reader:
+                    # Reports received while nobody was reading are not replies to this message
+                    self.ser.subscribe()
+                    self.ser.discard()
+                    self._read_buffer = b""
+                return super().send_msg(msg, timeout_per_chunk)
+        with self.command_lock:
+            sent = self._call("send_msg", msg, timeout_per_chunk)
+            self.last_send_time = self.clock.time()
+        return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share one M16 modem between several processes.")
+    parser.add_argument("port", help='Serial port of the modem (e.g. "COM3" or "/dev/ttyUSB0")')
+    parser.add_argument("--listen", default=DEFAULT_ADDRESS,
+                        help=f'"host:port" or Unix socket path to listen on (default "{DEFAULT_ADDRESS}")')
+    parser.add_argument("--channel", type=int, default=None, help="Channel to set on start (default: keep)")
+    parser.add_argument("--level", type=int, default=None, help="Power level to set on start (default: keep)")
+    parser.add_argument("--diagnostic", action=argparse.BooleanOptionalAction, default=None,
+                        help="Set diagnostic or transparent mode on start (default: keep)")
+    arguments = parser.parse_args()
+
+    modem = M16(arguments.port, channel=arguments.channel, level=arguments.level, diagnostic=arguments.diagnostic)
+    M16Broker(modem, arguments.listen).serve_forever()
+    modem.close()
@@ -0,0 +1,202 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Iterator
+
+
+class SystemClock:
+    """
+    Real time, used by the driver unless another clock is given.
+    """
+
+    def time(self) -> float:
+        """
+        Current time in seconds, only differences between two times are meaningful.
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Wait for the given number of seconds.
+        """
+        time.sleep(seconds)
+
+    def condition(self) -> threading.Condition:
+        """
+        Create a condition variable whose wait() timeouts are measured with this clock.
+        """
+        return threading.Condition()
+
+    def rlock(self) -> threading.RLock:
+        """
+        Create a reentrant lock whose acquire() timeouts are measured with this clock.
+        """
+        return threading.RLock()
+
+
+class VirtualClock:
+    """
+    Simulated time that jumps forward instantly when every actor is waiting.
+
+    An actor is a thread that uses the clock. When all actors are sleeping, waiting on a condition or waiting
+    for a lock created by the clock, the time moves straight to the earliest point where one of them wakes up.
+    A driver talking to an emulated modem therefore runs through minutes of configuration sleeps and
+    transmission pauses in milliseconds, while behaving exactly as it would in real time.
+
+    By default the thread creating the clock is the only actor. Other threads must be registered with actor(),
+    otherwise the time moves on while they are still working.
+    """
+    LOCK_POLL_INTERVAL = 0.01  # simulated seconds between attempts to get a busy lock
+    CONDITION_POLL_INTERVAL = 0.001  # real seconds between checks of a waiting condition
+
+    def __init__(self, start: float = 0.0, actors: int = 1) -> None:
+        """
+        Parameters:
+            start (float): Start time in seconds (default 0).
+            actors (int): Number of threads using the clock (default 1).
+        """
+        self._now = start
+        self.actors = actors
+        self._condition = threading.Condition()
+        self._deadlines: List[float] = []  # Wake up time of every waiting actor
+
+    def time(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float) -> None:
+        with self._condition:
+            deadline = self._now + max(seconds, 0)
+            self._deadlines.append(deadline)
+            try:
+                self._advance()
+                while self._now < deadline:
+                    self._condition.wait()
+            finally:
+                self._deadlines.remove(deadline)
+
+    def advance(self, seconds: float) -> None:
+        """
+        Move the time forward, e.g. from a test where no actor is waiting.
+        """
+        with self._condition:
+            self._now += seconds
+            self._condition.notify_all()
+
+    @contextmanager
+    def actor(self) -> Iterator[None]:
+        """
+        Register the calling thread as an actor while the context is active.
+        """
+        with self._condition:
+            self.actors += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.actors -= 1
+                self._advance()
+
+    def _advance(self) -> None:
+        """
+        Move to the earliest wake up time if every actor is waiting. The caller holds self._condition.
+        """
+        if self._deadlines and len(self._deadlines) >= self.actors:
+            # Waits without a timeout do not move the time, only a notification ends them
+            earliest = min(self._deadlines)
+            if earliest != float("inf"):
+                self._now = max(self._now, earliest)
+            self._condition.notify_all()
+
+    def _register(self, deadline: float) -> None:
+        with self._condition:
+            self._deadlines.append(deadline)
+            self._advance()
+
+    def _unregister(self, deadline: float) -> None:
+        with self._condition:
+            self._deadlines.remove(deadline)
+
+    def condition(self) -> threading.Condition:
+        return _VirtualCondition(self)
+
+    def rlock(self) -> "_VirtualRLock":
+        return _VirtualRLock(self)
+
+
+class _VirtualCondition(threading.Condition):
+    """
+    Condition variable whose wait() timeout is measured in simulated time.
+    """
+
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__()
+        self.clock = clock
+        # Counts notify() calls, a notification arriving as a poll times out is not reported by wait()
+        self._notifications = 0
+
+    def notify(self, n: int = 1) -> None:
+        self._notifications += 1
+        super().notify(n)
+
+    def notify_all(self) -> None:
+        self._notifications += 1
+        super().notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = float("inf") if timeout is None else self.clock.time() + max(timeout, 0)
+        notifications = self._notifications
+        self.clock._register(deadline)
+        try:
+            while True:
+                if super().wait(self.clock.CONDITION_POLL_INTERVAL) or self._notifications != notifications:
+                    return True
+                if self.clock.time() >= deadline:
+                    return False
+        finally:
+            self.clock._unregister(deadline)
+
+    def wait_for(self, predicate, timeout: Optional[float] = None):
+        deadline = None if timeout is None else self.clock.time() + timeout
+        result = predicate()
+        while not result:
+            if deadline is not None:
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    break
+                self.wait(remaining)
+            else:
+                self.wait()
+            result = predicate()
+        return result
+
+
+class _VirtualRLock:
+    """
+    Reentrant lock whose acquire() waits in simulated time, so a thread waiting for the lock counts as waiting.
+    """
+
+    def __init__(self, clock: VirtualClock) -> None:
+        self.clock = clock
+        self._lock = threading.RLock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(blocking=False):
+            return True
+        if not blocking:
+            return False
+        deadline = float("inf") if timeout < 0 else self.clock.time() + timeout
+        while True:
+            self.clock.sleep(min(self.clock.LOCK_POLL_INTERVAL, max(deadline - self.clock.time(), 0)))
+            if self._lock.acquire(blocking=False):
+                return True
+            if self.clock.time() >= deadline:
+                return False
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.release()
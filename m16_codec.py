@@ -0,0 +1,373 @@
+from collections import deque
+from typing import Optional, List, Sequence, Tuple
+
+from m16_driver import M16
+
+KEYFRAME = 0x40  # Header flag of a keyframe
+UNCHANGED = 0x20  # Header flag of a delta frame without residuals, every field was predicted
+SEQUENCE_MODULO = 32  # The low 5 bits of the header are the sequence number
+PREDICTORS = ("delta", "linear", "xor")
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Zigzag varint of a signed integer in 7 bit bytes, as the driver sends ASCII: 6 bits per byte, with 0x40 set on
+    every byte but the last. Values from -32 to 31 take one byte.
+    """
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    data = bytearray()
+    while value >= 0x40:
+        data.append(0x40 | (value & 0x3F))
+        value >>= 6
+    data.append(value)
+    return bytes(data)
+
+
+def decode_varint(data: bytes, position: int) -> Optional[Tuple[int, int]]:
+    """
+    Read a varint written by encode_varint().
+
+    Returns:
+        Optional[Tuple[int, int]]: The value and the position after it, None if the data ends before the varint.
+    """
+    value = shift = 0
+    while position < len(data):
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x3F) << shift
+        shift += 6
+        if not byte & 0x40:
+            return (value >> 1) ^ -(value & 1), position
+    return None
+
+
+def check_byte(data: bytes) -> int:
+    """
+    CRC-7 (polynomial 0x09, as used by SD cards) of the data, it fits in one 7 bit byte.
+    """
+    crc = 0
+    for byte in data:
+        for bit in range(7, -1, -1):
+            feedback = ((crc >> 6) ^ (byte >> bit)) & 1
+            crc = ((crc << 1) & 0x7F) ^ (0x09 if feedback else 0)
+    return crc
+
+
+class _Predictor:
+    """
+    Predicts every field from the records both ends have decoded since the last keyframe.
+    """
+
+    def __init__(self, fields: int, predictors: Optional[Sequence[str]]) -> None:
+        predictors = list(predictors) if predictors is not None else ["delta"] * fields
+        if len(predictors) != fields or any(predictor not in PREDICTORS for predictor in predictors):
+            raise ValueError(f"Give one predictor of {', '.join(PREDICTORS)} for each of the {fields} fields")
+        self.fields = fields
+        self.predictors = predictors
+        self.history: "deque[Tuple[int, ...]]" = deque(maxlen=2)
+
+    def residuals(self, record: Sequence[int]) -> List[int]:
+        return [self._residual(i, value) for i, value in enumerate(record)]
+
+    def _residual(self, field: int, value: int) -> int:
+        last = self.history[-1][field]
+        if self.predictors[field] == "xor":
+            return value ^ last
+        if self.predictors[field] == "linear" and len(self.history) == 2:
+            return value - (2 * last - self.history[0][field])
+        return value - last
+
+    def apply(self, residuals: Sequence[int]) -> Tuple[int, ...]:
+        record = []
+        for field, residual in enumerate(residuals):
+            last = self.history[-1][field]
+            if self.predictors[field] == "xor":
+                record.append(residual ^ last)
+            elif self.predictors[field] == "linear" and len(self.history) == 2:
+                record.append(residual + 2 * last - self.history[0][field])
+            else:
+                record.append(residual + last)
+        return tuple(record)
+
+
+class TelemetryEncoder:
+    """
+    Encodes a stream of records of integer fields, e.g. a vehicle status sent every few seconds, into small frames.
+
+    A keyframe holds every field. In between, a delta frame holds only the fields that differ from their prediction,
+    as a bit mask and the residuals as varints, and is a single block if every field was predicted:
+        - "delta" predicts the previous value, for slowly changing values
+        - "linear" extrapolates the last two values, for values changing at a steady rate (depth, position)
+        - "xor" sends the changed bits, for status flags
+    Every frame starts with a header byte (keyframe flag and sequence number) and ends with a CRC-7 check byte. All
+    bytes are 7 bit, so a frame is sent with modem.send_msg(frame.decode("ascii")).
+
+    A lost frame makes the following delta frames useless until the next keyframe. The keyframe interval is chosen
+    to deliver the most records per byte sent for the loss rate given to set_loss_rate(), e.g. the loss_rate of the
+    receiving TelemetryDecoder sent back by the receiver, between 1 and max_interval frames.
+
+    Example:
+        encoder = TelemetryEncoder(4, ["linear", "delta", "delta", "xor"])
+        modem.send_msg(encoder.encode([depth_cm, heading, battery_mv, flags]).decode("ascii"))
+    """
+    MAX_INTERVAL = 32  # frames between keyframes without losses
+
+    def __init__(self, fields: int, predictors: Optional[Sequence[str]] = None,
+                 max_interval: int = MAX_INTERVAL) -> None:
+        """
+        Parameters:
+            fields (int): Number of fields in a record.
+            predictors (Sequence[str], optional): "delta", "linear" or "xor" for every field, by default "delta".
+            max_interval (int): Largest number of frames from one keyframe to the next (default 32).
+        """
+        self.predictor = _Predictor(fields, predictors)
+        self.max_interval = max_interval
+        self.interval = max_interval
+        self.loss_rate = 0.0
+        self.sequence = 0
+        self._since_keyframe: Optional[int] = None  # Frames sent since the last keyframe
+        self._keyframe_bytes = 0.0  # Average sizes of the frames sent, for choosing the interval
+        self._delta_bytes = 0.0
+
+        # Statistics
+        self.records = 0
+        self.keyframes = 0
+        self.bytes_sent = 0
+
+    def set_loss_rate(self, loss_rate: float) -> None:
+        """
+        Set the share of frames lost on the way to the receiver and choose the keyframe interval for it.
+        """
+        self.loss_rate = min(max(loss_rate, 0.0), 1.0)
+        self._choose_interval()
+
+    def force_keyframe(self) -> None:
+        """
+        Send the next record as a keyframe, e.g. when the receiver has just started.
+        """
+        self._since_keyframe = None
+
+    def _choose_interval(self) -> None:
+        """
+        Pick the interval delivering the most decodable records per byte. With keyframes every n frames and a loss
+        rate p, frame i after a keyframe is decoded if it and the i frames before it arrived, with probability
+        (1 - p) ** (i + 1).
+        """
+        if not self._keyframe_bytes or not self._delta_bytes:
+            return
+        received = 1 - self.loss_rate
+        best, best_value = 1, 0.0
+        for interval in range(1, self.max_interval + 1):
+            decoded = sum(received ** (i + 1) for i in range(interval))
+            value = decoded / (self._keyframe_bytes + (interval - 1) * self._delta_bytes)
+            if value > best_value:
+                best, best_value = interval, value
+        self.interval = best
+
+    def encode(self, record: Sequence[int]) -> bytes:
+        """
+        Encode the next record.
+
+        Parameters:
+            record (Sequence[int]): The value of every field.
+
+        Returns:
+            bytes: The frame, 7 bit bytes.
+        """
+        if len(record) != self.predictor.fields:
+            raise ValueError(f"A record has {self.predictor.fields} fields, not {len(record)}")
+        record = tuple(int(value) for value in record)
+        header = self.sequence
+        if self._since_keyframe is None or self._since_keyframe + 1 >= self.interval:
+            header |= KEYFRAME
+            body = b"".join(encode_varint(value) for value in record)
+            self.predictor.history.clear()
+            self._since_keyframe = 0
+        else:
+            residuals = self.predictor.residuals(record)
+            mask = sum(1 << i for i, residual in enumerate(residuals) if residual)
+            if mask:
+                body = encode_varint(mask) + b"".join(encode_varint(residual) for residual in residuals if residual)
+            else:
+                header |= UNCHANGED
+                body = b""
+            self._since_keyframe += 1
+        self.predictor.history.append(record)
+        frame = bytes([header]) + body
+        frame += bytes([check_byte(frame)])
+
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        self.records += 1
+        size = len(frame) + len(frame) % 2  # with the padding byte of send_msg()
+        self.bytes_sent += size
+        if header & KEYFRAME:
+            self.keyframes += 1
+            self._keyframe_bytes = size if not self._keyframe_bytes else 0.8 * self._keyframe_bytes + 0.2 * size
+        else:
+            self._delta_bytes = size if not self._delta_bytes else 0.8 * self._delta_bytes + 0.2 * size
+        self._choose_interval()
+        return frame
+
+    @property
+    def blocks_per_record(self) -> float:
+        """
+        Average number of 2 byte blocks sent per record.
+        """
+        return self.bytes_sent / 2 / self.records if self.records else 0.0
+
+
+class TelemetryDecoder:
+    """
+    Decodes the frames of a TelemetryEncoder with the same fields and predictors from the received blocks.
+
+    Frames start at a block boundary, a frame of odd length is followed by one padding byte as send_msg() adds.
+    A block that does not start a valid frame is dropped, so after a lost or corrupt block decoding continues with
+    the next frame. Delta frames after a lost frame are skipped until the next keyframe.
+
+    Example:
+        decoder = TelemetryDecoder(4, ["linear", "delta", "delta", "xor"])
+        modem.add_listener(decoder.on_packet)
+        ...
+        record = decoder.records.popleft()
+    """
+    RECORD_HISTORY = 256  # number of decoded records kept in self.records
+    LOSS_SMOOTHING = 0.05  # weight of every frame in the average loss rate
+
+    def __init__(self, fields: int, predictors: Optional[Sequence[str]] = None, max_gap: float = 10.0) -> None:
+        """
+        Parameters:
+            fields (int): Number of fields in a record.
+            predictors (Sequence[str], optional): "delta", "linear" or "xor" for every field, by default "delta".
+            max_gap (float): Seconds without a block after which a partial frame is dropped (default 10).
+        """
+        self.predictor = _Predictor(fields, predictors)
+        self.max_gap = max_gap
+        self.records: "deque[Tuple[int, ...]]" = deque(maxlen=self.RECORD_HISTORY)
+        self.loss_rate = 0.0
+        self._buffer = b""
+        self._pending = b""  # First byte of a block in transparent mode
+        self._sequence: Optional[int] = None  # Sequence number of the last frame decoded
+        self._synchronised = False  # The predictor holds the records of the current keyframe
+        self._last_time: Optional[float] = None
+
+        # Statistics
+        self.frames = 0
+        self.lost = 0  # Frames missing in the sequence numbers
+        self.skipped = 0  # Delta frames that could not be decoded after a loss
+        self.dropped_bytes = 0  # Bytes that did not belong to a valid frame
+
+    def on_packet(self, packet: bytes) -> None:
+        """
+        Listener for read packets, feeds received blocks from diagnostic reports (TB_VALID) or the bytes read in
+        transparent mode to the decoder.
+        """
+        report = M16.decode_packet(packet)
+        if report is not None:
+            if report["TB_VALID"] and not report["TX_COMPLETE"]:
+                self.feed(report["TR_BLOCK"])
+            return
+        data = self._pending + packet
+        end = len(data) - len(data) % 2
+        for i in range(0, end, 2):
+            self.feed(data[i:i+2])
+        self._pending = data[end:]
+
+    def feed(self, block: bytes, time: Optional[float] = None) -> List[Tuple[int, ...]]:
+        """
+        Add a received block.
+
+        Parameters:
+            block (bytes): The block of 2 bytes.
+            time (float, optional): Time the block was received.
+
+        Returns:
+            List[Tuple[int, ...]]: The records decoded with this block, they are also added to self.records.
+        """
+        if time is not None:
+            if self._last_time is not None and time - self._last_time > self.max_gap:
+                self.dropped_bytes += len(self._buffer)
+                self._buffer = b""
+            self._last_time = time
+        self._buffer += block
+        decoded = []
+        while self._buffer:
+            length = self._frame_length(self._buffer)
+            if length is None:
+                break
+            if length == 0 or check_byte(self._buffer[:length - 1]) != self._buffer[length - 1]:
+                # Not the start of a frame, try from the next block
+                self.dropped_bytes += 2
+                self._buffer = self._buffer[2:]
+                continue
+            frame = self._buffer[:length]
+            self._buffer = self._buffer[length + length % 2:]
+            record = self._decode(frame)
+            if record is not None:
+                decoded.append(record)
+                self.records.append(record)
+        return decoded
+
+    def _frame_length(self, data: bytes) -> Optional[int]:
+        """
+        Length of the frame at the start of data, None if more bytes are needed and 0 if it is not a frame.
+        """
+        if data[0] & 0x80 or data[0] & KEYFRAME and data[0] & UNCHANGED:
+            return 0
+        position = 1
+        if data[0] & KEYFRAME:
+            count = self.predictor.fields
+        elif data[0] & UNCHANGED:
+            count = 0
+        else:
+            varint = decode_varint(data, position)
+            if varint is None:
+                return None
+            mask, position = varint
+            if mask < 0 or mask >> self.predictor.fields:
+                return 0
+            count = bin(mask).count("1")
+        for _ in range(count):
+            varint = decode_varint(data, position)
+            if varint is None:
+                return None
+            position = varint[1]
+        return position + 1 if position < len(data) else None
+
+    def _decode(self, frame: bytes) -> Optional[Tuple[int, ...]]:
+        header = frame[0]
+        sequence = header & (SEQUENCE_MODULO - 1)
+        missing = 0 if self._sequence is None else (sequence - self._sequence - 1) % SEQUENCE_MODULO
+        self._sequence = sequence
+        self.frames += 1
+        self.lost += missing
+        for _ in range(missing):
+            self.loss_rate += self.LOSS_SMOOTHING * (1 - self.loss_rate)
+        self.loss_rate -= self.LOSS_SMOOTHING * self.loss_rate
+        if missing:
+            self._synchronised = False
+
+        values = []
+        position = 1
+        if header & KEYFRAME:
+            for _ in range(self.predictor.fields):
+                value, position = decode_varint(frame, position)
+                values.append(value)
+            record = tuple(values)
+            self.predictor.history.clear()
+            self._synchronised = True
+        elif not self._synchronised:
+            self.skipped += 1
+            return None
+        elif header & UNCHANGED:
+            record = self.predictor.apply([0] * self.predictor.fields)
+        else:
+            mask, position = decode_varint(frame, 1)
+            for field in range(self.predictor.fields):
+                if mask >> field & 1:
+                    value, position = decode_varint(frame, position)
+                    values.append(value)
+                else:
+                    values.append(0)
+            record = self.predictor.apply(values)
+        self.predictor.history.append(record)
+        return record
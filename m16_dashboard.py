@@ -0,0 +1,469 @@
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple
+
+from m16_driver import M16
+from m16_broker import parse_address, report_to_json
+
+DEFAULT_ADDRESS = "0.0.0.0:8016"
+
+
+class BroadcastBuffer:
+    """
+    Ring buffer of numbered events shared by all viewers.
+
+    An event is serialized once when it is published, every viewer then reads the same bytes from the buffer at its
+    own pace. Publishing never waits for a viewer, a viewer that falls behind by more than the size of the buffer
+    continues with the oldest event still kept.
+    """
+
+    def __init__(self, size: int) -> None:
+        """
+        Parameters:
+            size (int): Number of events kept.
+        """
+        self.events: "deque[Tuple[int, bytes, Dict[str, Any]]]" = deque(maxlen=size)
+        self.sequence = 0  # Number of the last event published
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, kind: str, message: Dict[str, Any]) -> int:
+        """
+        Add an event and wake the viewers.
+
+        Parameters:
+            kind (str): Name of the Server-Sent Event.
+            message (Dict[str, Any]): JSON serializable data of the event.
+
+        Returns:
+            int: Number of the event.
+        """
+        with self.condition:
+            self.sequence += 1
+            message = dict(message, id=self.sequence)
+            data = f"id: {self.sequence}\nevent: {kind}\ndata: {json.dumps(message)}\n\n".encode("utf-8")
+            self.events.append((self.sequence, data, message))
+            self.condition.notify_all()
+            return self.sequence
+
+    def read(self, after: int, timeout: float) -> List[Tuple[int, bytes]]:
+        """
+        Wait for events published after the given event number.
+
+        Parameters:
+            after (int): Number of the last event the viewer has.
+            timeout (float): Seconds to wait for a new event.
+
+        Returns:
+            List[Tuple[int, bytes]]: The new events as (number, Server-Sent Event), empty after the timeout or when
+                                     the buffer is closed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after or self.closed, timeout)
+            if self.closed:
+                return []
+            return [(sequence, data) for sequence, data, _ in self.events if sequence > after]
+
+    def messages(self) -> List[Dict[str, Any]]:
+        """
+        Return the data of the events kept, oldest first.
+        """
+        with self.condition:
+            return [message for _, _, message in self.events]
+
+    def close(self) -> None:
+        """
+        Wake all viewers and make them stop reading.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class M16Dashboard:
+    """
+    Web dashboard of a modem, served by the process that owns the M16 instance, for watching it from any browser
+    on the network.
+
+    The pages show the configuration of the modem, live link metrics (signal and noise power, SNR, BER, packet error
+    rate, blocks sent and received) and the recent message history. Every report and block read from the modem is
+    published as a Server-Sent Event in one BroadcastBuffer. The listener on the modem only updates the metrics and
+    adds the event to the buffer, so the work on the thread reading the serial port does not grow with the number
+    of viewers, each viewer is served by its own thread of the HTTP server.
+
+    Endpoints:
+        /, /link, /history: configuration, link metrics and message history pages
+        /events: Server-Sent Events "report" and "data", starting with the kept history (or after Last-Event-ID)
+        /api/state: configuration, metrics and latest report as JSON
+        /api/history: the kept events as JSON
+
+    Example:
+        dashboard = M16Dashboard(modem)
+        dashboard.start()  # reads from the modem in a background thread
+    """
+    HISTORY = 500  # number of events kept for new viewers and the history page
+    KEEPALIVE = 15.0  # seconds between comments sent to idle viewers
+    READ_TIMEOUT = 0.2  # seconds per read of the reader thread
+    MAX_PACKET_STEP = 100  # packets between two reports, a counter going further back means the modem restarted
+
+    def __init__(self, modem: M16, address: str = DEFAULT_ADDRESS, read: bool = True) -> None:
+        """
+        Parameters:
+            modem (M16): The connected modem.
+            address (str): "host:port" to serve on (default "0.0.0.0:8016", every network interface).
+            read (bool): If True, start() reads from the modem in a background thread. Set it to False when another
+                         thread already reads, e.g. an M16Broker or a RelayEngine (default True).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.modem = modem
+        self.address = parse_address(address)
+        if not isinstance(self.address, tuple):
+            raise ValueError(f"The dashboard address must be host:port, not {address}")
+        self.read = read
+        self.buffer = BroadcastBuffer(self.HISTORY)
+        self.lock = threading.Lock()
+        self.report: Optional[Dict[str, Any]] = None  # Latest report
+        self.metrics: Dict[str, Any] = {"reports": 0, "blocks_received": 0, "blocks_sent": 0, "bytes_received": 0,
+                                        "signal_power": None, "noise_power": None, "snr": None, "ber": None,
+                                        "packet_error_rate": None, "interarrival": None}
+        self._packets: Optional[Tuple[int, int]] = None  # PACKET_VALID and PACKET_INVALID of the previous report
+        self._packets_valid = 0
+        self._packets_invalid = 0
+        self._last_block_time: Optional[float] = None
+        self.running = False
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.reader_thread = None
+        self.modem.add_listener(self.on_packet)
+
+    @property
+    def url(self) -> str:
+        """
+        URL of the dashboard, with the port chosen by the system when started on port 0.
+        """
+        host, port = self.server.server_address[:2] if self.server is not None else self.address
+        return f"http://{'localhost' if host in ('', '0.0.0.0') else host}:{port}/"
+
+    def start(self) -> None:
+        """
+        Start serving, and reading from the modem if enabled, in background threads.
+        """
+        dashboard = self
+
+        class Handler(_DashboardHandler):
+            pass
+        Handler.dashboard = dashboard
+
+        ThreadingHTTPServer.allow_reuse_address = True
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.running = True
+        if self.read:
+            self.reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+            self.reader_thread.start()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Dashboard on {self.url}")
+
+    def serve_forever(self) -> None:
+        """
+        Start the dashboard and block until it is stopped.
+        """
+        self.start()
+        try:
+            while self.running:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stop serving and disconnect the viewers. The modem is not closed.
+        """
+        self.running = False
+        self.buffer.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+        self.modem.remove_listener(self.on_packet)
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Return the configuration, the link metrics and the latest report.
+        """
+        with self.lock:
+            return {"channel": self.modem.channel, "level": self.modem.level, "diagnostic": self.modem.diagnostic,
+                    "metrics": dict(self.metrics), "report": report_to_json(self.report)}
+
+    def on_packet(self, packet: bytes) -> None:
+        """
+        Listener for read packets, updates the modem state and the metrics and publishes the packet to the viewers.
+        """
+        time = self.modem.clock.time()
+        report = M16.decode_packet(packet)
+        if report is not None:
+            self.modem.update_state_from_report(report)
+        with self.lock:
+            if report is not None:
+                self._update_metrics(report, time)
+                message = {"time": time, "report": report_to_json(report), "metrics": dict(self.metrics)}
+                if report["TB_VALID"] and not report["TX_COMPLETE"]:
+                    message["text"] = _printable(report["TR_BLOCK"])
+                kind = "report"
+            else:
+                self.metrics["bytes_received"] += len(packet)
+                message = {"time": time, "data": packet.hex(), "text": _printable(packet),
+                           "metrics": dict(self.metrics)}
+                kind = "data"
+        self.buffer.publish(kind, message)
+
+    def _update_metrics(self, report: Dict[str, Any], time: float) -> None:
+        metrics = self.metrics
+        self.report = report
+        metrics["reports"] += 1
+        metrics["signal_power"] = report["SIGNAL_POWER"]
+        metrics["noise_power"] = report["NOISE_POWER"]
+        if report["TX_COMPLETE"]:
+            metrics["blocks_sent"] += 1
+        elif report["TB_VALID"]:
+            metrics["blocks_received"] += 1
+            metrics["snr"] = report["SIGNAL_POWER"] - report["NOISE_POWER"]
+            metrics["ber"] = report["BER"]
+            if self._last_block_time is not None:
+                metrics["interarrival"] = time - self._last_block_time
+            self._last_block_time = time
+
+        # Count the steps of the packet counters, they wrap at 16 and 8 bits. A counter going back further than a
+        # wraparound explains means the modem restarted, the error rate is counted again from this report.
+        packets = (report["PACKET_VALID"], report["PACKET_INVALID"])
+        if self._packets is not None:
+            valid = (packets[0] - self._packets[0]) % 0x10000
+            invalid = (packets[1] - self._packets[1]) % 0x100
+            if ((packets[0] < self._packets[0] and valid > self.MAX_PACKET_STEP)
+                    or (packets[1] < self._packets[1] and invalid > self.MAX_PACKET_STEP)):
+                self._packets_valid = self._packets_invalid = 0
+                metrics["packet_error_rate"] = None
+            else:
+                self._packets_valid += valid
+                self._packets_invalid += invalid
+                total = self._packets_valid + self._packets_invalid
+                if total:
+                    metrics["packet_error_rate"] = self._packets_invalid / total
+        self._packets = packets
+
+    def _read_loop(self) -> None:
+        """
+        Continuously read from the modem. Data is published by on_packet().
+        """
+        self.modem.background_reader = True
+        try:
+            while self.running:
+                self.modem.read_packet(timeout=self.READ_TIMEOUT)
+        except Exception as e:
+            self.logger.error(f"Error reading from modem: {e}")
+            self.running = False
+        finally:
+            self.modem.background_reader = False
+
+
+def _printable(data: bytes) -> str:
+    """
+    Received bytes as text, with non printable bytes replaced by '.'.
+    """
+    return "".join(chr(byte) if 0x20 <= byte < 0x7F else "." for byte in data)
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    """
+    Serves the pages, the JSON API and the event stream of the dashboard.
+    """
+    dashboard: M16Dashboard = None
+    PAGES = {"/": "Configuration", "/link": "Link", "/history": "History"}
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path in self.PAGES:
+            self._send(PAGE.replace("{page}", path).encode("utf-8"), "text/html; charset=utf-8")
+        elif path == "/events":
+            self._stream_events()
+        elif path == "/api/state":
+            self._send(json.dumps(self.dashboard.state()).encode("utf-8"), "application/json")
+        elif path == "/api/history":
+            self._send(json.dumps(self.dashboard.buffer.messages()).encode("utf-8"), "application/json")
+        else:
+            self.send_error(404)
+
+    def _send(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self) -> None:
+        """
+        Send the kept events, or those after Last-Event-ID when the browser reconnects, then the live events.
+        """
+        buffer = self.dashboard.buffer
+        last_event = self.headers.get("Last-Event-ID", "")
+        after = int(last_event) if last_event.isdigit() else 0
+        if after > buffer.sequence:
+            after = 0  # The dashboard was restarted since the browser connected
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        try:
+            self.wfile.write(b"retry: 2000\n\n")
+            self.wfile.flush()
+            while self.dashboard.running:
+                events = buffer.read(after, self.dashboard.KEEPALIVE)
+                if events:
+                    after = events[-1][0]
+                    self.wfile.write(b"".join(data for _, data in events))
+                else:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format: str, *args: Any) -> None:
+        self.dashboard.logger.debug(f"{self.address_string()} {format % args}")
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>M16 dashboard</title>
+<style>
+body { font-family: sans-serif; margin: 1em 2em; }
+nav a { margin-right: 1em; }
+nav a.current { font-weight: bold; }
+table { border-collapse: collapse; }
+td, th { padding: 2px 10px; text-align: left; border-bottom: 1px solid #ddd; }
+section { display: none; }
+#status { color: #888; }
+</style>
+</head>
+<body>
+<nav>
+<a href="/">Configuration</a> <a href="/link">Link</a> <a href="/history">History</a>
+<span id="status">connecting</span>
+</nav>
+<section id="/">
+<h2>Configuration</h2>
+<table id="configuration"></table>
+</section>
+<section id="/link">
+<h2>Link</h2>
+<table id="metrics"></table>
+</section>
+<section id="/history">
+<h2>History</h2>
+<table><thead><tr><th>#</th><th>Time</th><th>Kind</th><th>Text</th><th>Details</th></tr></thead>
+<tbody id="messages"></tbody></table>
+</section>
+<script>
+const page = "{page}";
+const HISTORY = 200;
+document.getElementById(page).style.display = "block";
+document.querySelector('nav a[href="' + page + '"]').className = "current";
+
+function fill(id, rows) {
+  const table = document.getElementById(id);
+  table.replaceChildren();
+  for (const [name, value] of rows) {
+    const row = table.insertRow();
+    row.insertCell().textContent = name;
+    row.insertCell().textContent = value === null || value === undefined ? "-" : value;
+  }
+}
+
+function showState(state, report) {
+  const rows = [["Channel", state.channel], ["Level", state.level], ["Diagnostic mode", state.diagnostic]];
+  if (report) {
+    rows.push(["Reported channel", report.CHANNEL], ["Reported level", 4 - report.LEVEL],
+              ["Reported diagnostic mode", report.DIAGNOSTIC_MODE], ["Chip ID", report.CHIP_ID],
+              ["Hardware revision", report.HW_REV], ["Firmware revision", report.GIT_REV],
+              ["Modem time", report.TIME]);
+  }
+  fill("configuration", rows);
+}
+
+function showMetrics(metrics) {
+  const format = (value, digits) => typeof value === "number" ? value.toFixed(digits) : value;
+  fill("metrics", [["Reports", metrics.reports], ["Blocks received", metrics.blocks_received],
+                   ["Blocks sent", metrics.blocks_sent], ["Transparent bytes received", metrics.bytes_received],
+                   ["Signal power", metrics.signal_power], ["Noise power", metrics.noise_power],
+                   ["SNR", metrics.snr], ["BER", metrics.ber],
+                   ["Packet error rate", format(metrics.packet_error_rate, 3)],
+                   ["Time between blocks (s)", format(metrics.interarrival, 1)]]);
+}
+
+function addMessage(kind, message) {
+  const body = document.getElementById("messages");
+  const row = body.insertRow(0);
+  const report = message.report;
+  let details = message.data || "";
+  if (report) {
+    details = report.TX_COMPLETE ? "TX complete" : report.TB_VALID ? "block " + report.TR_BLOCK : "report";
+    details += ", signal " + report.SIGNAL_POWER + ", noise " + report.NOISE_POWER + ", BER " + report.BER;
+  }
+  for (const value of [message.id, message.time.toFixed(1), kind, message.text || "", details]) {
+    row.insertCell().textContent = value;
+  }
+  while (body.rows.length > HISTORY) body.deleteRow(-1);
+}
+
+let state = {};
+fetch("/api/state").then(response => response.json()).then(initial => {
+  state = initial;
+  showState(state, state.report);
+  showMetrics(state.metrics);
+});
+
+const events = new EventSource("/events");
+events.onopen = () => document.getElementById("status").textContent = "live";
+events.onerror = () => document.getElementById("status").textContent = "reconnecting";
+for (const kind of ["report", "data"]) {
+  events.addEventListener(kind, event => {
+    const message = JSON.parse(event.data);
+    if (message.report) {
+      state.channel = message.report.CHANNEL;
+      state.level = 4 - message.report.LEVEL;
+      state.diagnostic = !!message.report.DIAGNOSTIC_MODE;
+      showState(state, message.report);
+    }
+    showMetrics(message.metrics);
+    addMessage(kind, message);
+  });
+}
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a web dashboard of an M16 modem.")
+    parser.add_argument("port", help='Serial port of the modem (e.g. "COM3" or "/dev/ttyUSB0")')
+    parser.add_argument("--listen", default=DEFAULT_ADDRESS,
+                        help=f'"host:port" to serve the dashboard on (default "{DEFAULT_ADDRESS}")')
+    parser.add_argument("--channel", type=int, default=None, help="Channel to set on start (default: keep)")
+    parser.add_argument("--level", type=int, default=None, help="Power level to set on start (default: keep)")
+    parser.add_argument("--diagnostic", action=argparse.BooleanOptionalAction, default=None,
+                        help="Set diagnostic or transparent mode on start (default: keep)")
+    arguments = parser.parse_args()
+
+    modem = M16(arguments.port, channel=arguments.channel, level=arguments.level, diagnostic=arguments.diagnostic)
+    M16Dashboard(modem, arguments.listen).serve_forever()
+    modem.close()
@@ -0,0 +1,103 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Union
+
+from serial.tools import list_ports
+
+from m16_driver import M16
+from m16_transport import Transport
+
+logger = logging.getLogger(__name__)
+
+
+def list_serial_ports() -> List[str]:
+    """
+    List the serial ports on this machine.
+
+    Returns:
+        List[str]: Device names of the serial ports (e.g. "COM3" or "/dev/ttyUSB0").
+    """
+    return sorted(port.device for port in list_ports.comports())
+
+
+def probe_port(port: Union[str, Transport], baudrate: int = 9600, timeout: float = 3.0) -> Optional[Dict[str, Any]]:
+    """
+    Check if an M16 modem is connected to a port by requesting a report.
+    The modem configuration is not changed.
+
+    Parameters:
+        port (Union[str, Transport]): The port to probe, a name or URL as for M16, or a transport.
+        baudrate (int): Baud rate (default 9600).
+        timeout (float): Maximum time (in seconds) to wait for a valid report (default 3).
+
+    Returns:
+        Optional[Dict[str, Any]]: Identification and configuration of the modem if it answered with a valid report,
+        otherwise None.
+    """
+    try:
+        modem = M16(port, baudrate, channel=None, level=None, diagnostic=None)
+    except Exception as e:
+        logger.debug(f"Could not open {port}: {e}")
+        return None
+
+    try:
+        report = modem.request_report(overall_timeout=timeout)
+    except Exception as e:
+        logger.debug(f"Error probing {port}: {e}")
+        report = None
+    finally:
+        modem.close()
+
+    if report is None:
+        return None
+    return {
+        "port": port,
+        "CHIP_ID": report["CHIP_ID"],
+        "HW_REV": report["HW_REV"],
+        "GIT_REV": report["GIT_REV"].hex(),
+        "channel": modem.channel,
+        "level": modem.level,
+        "diagnostic": modem.diagnostic,
+        "report": report,
+    }
+
+
+def discover_modems(ports: Optional[List[Union[str, Transport]]] = None, baudrate: int = 9600,
+                    timeout: float = 3.0) -> List[Dict[str, Any]]:
+    """
+    Find the ports with an M16 modem connected.
+    All ports are probed at the same time, so the search takes about one probe timeout no matter how many
+    ports there are.
+
+    Parameters:
+        ports (List[Union[str, Transport]], optional): Ports to probe, defaults to all serial ports on this machine.
+        baudrate (int): Baud rate (default 9600).
+        timeout (float): Maximum time (in seconds) to wait for a report from each port (default 3).
+
+    Returns:
+        List[Dict[str, Any]]: One entry per modem found as returned by probe_port(), sorted by port.
+    """
+    if ports is None:
+        ports = list_serial_ports()
+    if not ports:
+        return []
+
+    logger.info(f"Searching for modems on: {', '.join(str(port) for port in ports)}")
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = list(executor.map(lambda port: probe_port(port, baudrate, timeout), ports))
+
+    modems = [result for result in results if result is not None]
+    for modem in modems:
+        logger.info(f"Found modem on {modem['port']}: CHIP_ID={modem['CHIP_ID']}, HW_REV={modem['HW_REV']}, "
+                    f"GIT_REV={modem['GIT_REV']}, channel={modem['channel']}, level={modem['level']}")
+    return modems
+
+
+if __name__ == "__main__":
+    found = discover_modems()
+    if not found:
+        print("No modems found")
+    for entry in found:
+        mode = "diagnostic" if entry["diagnostic"] else "transparent"
+        print(f"{entry['port']}: CHIP_ID={entry['CHIP_ID']} HW_REV={entry['HW_REV']} GIT_REV={entry['GIT_REV']} "
+              f"channel={entry['channel']} level={entry['level']} mode={mode}")
@@ -1,10 +1,12 @@
-import os
-import serial
 import struct
 import json
 import logging
-from time import time, sleep
-from typing import Optional, Dict, Any
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Callable, List, Union
+
+from m16_clock import SystemClock, VirtualClock
+from m16_transport import Transport, open_transport
 
 class M16:
     """
@@ -21,50 +23,148 @@ class M16:
     CHANNELS = [1, 2, 3, 4, 5 ,6, 7, 8, 9, 10, 11, 12]
     LEVELS = [1, 2, 3, 4]
     PACKET_LENGTH = 18
+    COMMAND_GAP = 1.0  # seconds between the two characters of a command
+    POLL_INTERVAL = 0.1  # seconds between checks of the serial port while reading
+    REPORT_HISTORY = 32  # number of recently received reports kept
 
-    def __init__(self, port: str, baudrate: int = 9600, channel: int = 1, level: int = 4, diagnostic: bool = False, 
-                 timeout: float = 0.5) -> None:
+    def __init__(self, port: Union[str, Transport], baudrate: int = 9600, channel: Optional[int] = 1, level: Optional[int] = 4,
+                 diagnostic: Optional[bool] = False, timeout: float = 0.5,
+                 clock: Optional[Union[SystemClock, VirtualClock]] = None) -> None:
         """
         Initialize the modem connection. If channel, level or diagnostic mode is not spesified they are set to default
         default = channel = 1, Level = 4, diagnostic mode = False
         If an optional parameter is left as None, the modem will retain its current configuration.
         
         Parameters:
-            port (str): Serial port (e.g. "COM3" on Windows or "/dev/ttyUSB0" on Linux).
+            port (Union[str, Transport]): Serial port (e.g. "COM3" on Windows or "/dev/ttyUSB0" on Linux),
+                                          a URL (e.g. "tcp://host:port", "rfc2217://host:port" or "loop://")
+                                          or a Transport object, see m16_transport.open_transport().
             baudrate (int): Baud rate (default 9600).
             timeout (float): Timeout for serial reads (default 0.5).
             channel (int): Channel to set (valid values 1 to 12), (default 1).
             level (int): Power level to set (valid values 1 to 4), (default 4).
             diagnostic (bool): If True, set the modem to diagnostic mode; if False, set transparent mode, (default 1).
+            clock (SystemClock | VirtualClock, optional): Clock used for all waiting, defaults to real time.
+                                                          See m16_clock.VirtualClock for running in simulated time.
         """
+        self.clock = clock if clock is not None else SystemClock()
+
         # Logging
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s:%(lineno)d=%(levelname)s:%(message)s')
 
-        # Check if the port exists
-        if not os.path.exists(port):
-            raise ValueError(f"Port {port} does not exist")
-        self.ser = serial.Serial(port, baudrate, timeout=timeout)
-
-        # Initialize internal state with defaults.
-        self.channel = channel
-        self.level = level
-        self.diagnostic = diagnostic
+        # Raises ValueError if the port does not exist
+        self.ser = open_transport(port, baudrate, timeout)
+
+        # Bytes read after the last packet returned by read_packet()
+        self._read_buffer = b""
+
+        # Callbacks receiving everything returned by read_packet()
+        self.listeners: List[Callable[[bytes], None]] = []
+
+        # Command sequences are sent one at a time when the modem is used from several threads
+        self.command_lock = self.clock.rlock()
+        # Nothing is written before this clock time, the gap after a command that did not wait for it itself
+        self._quiet_until: Optional[float] = None
+
+        # Recently received reports as (sequence number, receive time, report), shared by all readers
+        self.reports = deque(maxlen=self.REPORT_HISTORY)
+        self.report_sequence = 0  # Number of reports received
+        self.report_condition = self.clock.condition()
+        # Set to True when another thread continuously calls read_packet(), methods waiting for a report
+        # then wait for that thread to receive it instead of reading the port themselves.
+        self.background_reader = False
+        # Optional m16_tdma.TdmaScheduler, when set every block waits for this node's time slot
+        self.tdma = None
+        # Optional m16_address.AddressFilter, when set blocks of frames for other nodes are dropped by read_packet()
+        self.address_filter = None
+        # Clock time the last block was written to the modem, see m16_timesync.TimeSync
+        self.last_send_time: Optional[float] = None
+        self._report_in_flight = False
+        self._report_generation = 0
+        self._report_result = None
+
+        # Internal state is unknown until it is set or read from a report.
+        self.channel = None
+        self.level = None
+        self.diagnostic = None
         
         self.logger.info(f"Connecting to modem with: channel: {channel}, level: {level}, diagnostic: {diagnostic}")
+        self.configure(channel, level, diagnostic)
 
-        self.set_channel(channel)
-        self.logger.info(f"Setting channel: {channel}")
+    def configure(self, channel: Optional[int] = None, level: Optional[int] = None,
+                  diagnostic: Optional[bool] = None,
+                  progress: Optional[Callable[[int, int, str], None]] = None,
+                  cancel: Optional[threading.Event] = None) -> bool:
+        """
+        Apply channel, power level and mode to the modem one step at a time.
+        Parameters left as None are not changed. Each step takes about 2 seconds, so callers that
+        must stay responsive (e.g. a GUI) should run this in a background thread.
 
-        self.set_level(level)
-        self.logger.info(f"Setting level: {level}")
+        Parameters:
+            channel (int, optional): Channel to set (valid values 1 to 12).
+            level (int, optional): Power level to set (valid values 1 to 4).
+            diagnostic (bool, optional): If True, set diagnostic mode; if False, set transparent mode.
+            progress (Callable, optional): Called as progress(step, total, description) before each step
+                                           and once more with step == total when done.
+            cancel (threading.Event, optional): When set, the remaining steps are skipped.
 
-        if diagnostic:
-            self.set_diagnostic_mode()
-        else:
-            self.reset_diagnostic_mode()
-        self.logger.info(f"Setting diagnostic mode: {diagnostic}")
+        Returns:
+            bool: True if all steps were applied, False if the configuration was cancelled.
+        """
+        steps = []
+        if channel is not None:
+            steps.append((f"Setting channel: {channel}", lambda: self.set_channel(channel)))
+        if level is not None:
+            steps.append((f"Setting level: {level}", lambda: self.set_level(level)))
+        if diagnostic is not None:
+            if diagnostic:
+                steps.append(("Setting diagnostic mode: True", self.set_diagnostic_mode))
+            else:
+                steps.append(("Setting diagnostic mode: False", self.reset_diagnostic_mode))
+
+        for step, (description, action) in enumerate(steps):
+            if cancel is not None and cancel.is_set():
+                self.logger.info("Configuration cancelled")
+                return False
+            if progress is not None:
+                progress(step, len(steps), description)
+            self.logger.info(description)
+            action()
+
+        if progress is not None:
+            progress(len(steps), len(steps), "Configuration done")
+        return True
+
+    def add_listener(self, callback: Callable[[bytes], None]) -> None:
+        """
+        Register a callback that is called with every packet or buffer returned by read_packet(),
+        regardless of which thread or method did the reading.
+
+        Parameters:
+            callback (Callable[[bytes], None]): Function called with the received bytes.
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[bytes], None]) -> None:
+        """
+        Remove a callback registered with add_listener().
+
+        Parameters:
+            callback (Callable[[bytes], None]): The callback to remove.
+        """
+        if callback in self.listeners:
+            self.listeners.remove(callback)
 
+    def _notify_listeners(self, data: bytes) -> None:
+        """
+        Pass received data on to all registered listeners.
+        """
+        for callback in list(self.listeners):
+            try:
+                callback(data)
+            except Exception as e:
+                self.logger.warning(f"Listener {callback} failed: {e}")
 
     def send_data(self, data: str) -> int | None:
         """
@@ -76,7 +176,13 @@ class M16:
         Returns: 
             int: Number of characters written.
         """
-        return self.ser.write(data.encode('ascii'))
+        with self.command_lock:
+            if self._quiet_until is not None:
+                remaining = self._quiet_until - self.clock.time()
+                if remaining > 0:
+                    self.clock.sleep(remaining)
+                self._quiet_until = None
+            return self.ser.write(data.encode('ascii'))
 
     def set_channel(self, channel: int) -> bool:
         """
@@ -88,18 +194,19 @@ class M16:
         if channel not in self.CHANNELS:
             self.logger.warning(f"Channel: {channel} is not a valid channel, needs to be between 1-12 ")
             return False
-        self.send_data('c')
-        sleep(1)
-        self.send_data('c')
-        # For channels 10-12, convert to letters: 10 -> 'a', 11 -> 'b', 12 -> 'c'
-        if channel in (10, 11, 12):
-            ch_str = {10: 'a', 11: 'b', 12: 'c'}[channel]
-        else:
-            ch_str = str(channel)
-        self.send_data(ch_str)
-        self.channel = channel  # Update internal state
-        sleep(1)
-        return True
+        with self.command_lock:
+            self.send_data('c')
+            self.clock.sleep(1)
+            self.send_data('c')
+            # For channels 10-12, convert to letters: 10 -> 'a', 11 -> 'b', 12 -> 'c'
+            if channel in (10, 11, 12):
+                ch_str = {10: 'a', 11: 'b', 12: 'c'}[channel]
+            else:
+                ch_str = str(channel)
+            self.send_data(ch_str)
+            self.channel = channel  # Update internal state
+            self.clock.sleep(1)
+            return True
 
     def set_level(self, level: int) -> bool:
         """
@@ -111,84 +218,119 @@ class M16:
         if level not in self.LEVELS:
             self.logger.warning(f"Level: {level} is not a valid level, needs to be between 1-4 ")
             return False
-        self.send_data('l')
-        sleep(1)
-        self.send_data('l')
-        self.send_data(str(level))
-        self.level = level  # Update internal state
-        sleep(1)
-        return True
+        with self.command_lock:
+            self.send_data('l')
+            self.clock.sleep(1)
+            self.send_data('l')
+            self.send_data(str(level))
+            self.level = level  # Update internal state
+            self.clock.sleep(1)
+            return True
 
     def set_diagnostic_mode(self) -> None:
         """
         Set the modem in diagnostic mode.
         """
-        self.send_data('d')
-        sleep(1)
-        self.send_data('d')
-        self.diagnostic = True  # Update internal state
-        sleep(1)
+        with self.command_lock:
+            self.send_data('d')
+            self.clock.sleep(1)
+            self.send_data('d')
+            self.diagnostic = True  # Update internal state
+            self.clock.sleep(1)
 
     def reset_diagnostic_mode(self) -> None:
         """
         Reset the modem from diagnostic mode (enter transparent mode).
         """
-        self.send_data('t')
-        sleep(1)
-        self.send_data('t')
-        self.diagnostic = False  # Update internal state
-        sleep(1)
+        with self.command_lock:
+            self.send_data('t')
+            self.clock.sleep(1)
+            self.send_data('t')
+            self.diagnostic = False  # Update internal state
+            self.clock.sleep(1)
 
     def toggle_mode(self) -> None:
         """
         Toggle between diagnostic and transparent modes.
         """
-        self.send_data('m')
-        sleep(1)
-        self.send_data('m')
-        # Toggle internal state if already set; if not, we cannot infer reliably.
-        if self.diagnostic is not None:
-            self.diagnostic = not self.diagnostic
-        sleep(1)
+        with self.command_lock:
+            self.send_data('m')
+            self.clock.sleep(1)
+            self.send_data('m')
+            # Toggle internal state if already set; if not, we cannot infer reliably.
+            if self.diagnostic is not None:
+                self.diagnostic = not self.diagnostic
+            self.clock.sleep(1)
 
     def get_report(self) -> None:
         """
         Request a diagnostic report from the modem.
         """
-        self.send_data('r')
-        sleep(1)
-        self.send_data('r')
-        sleep(1)
+        with self.command_lock:
+            self.send_data('r')
+            self.clock.sleep(1)
+            self.send_data('r')
+            self.clock.sleep(1)
 
-    def request_report(self, filename: Optional[str] = None, overall_timeout: float = 5.0) -> Dict[str, Any] | None:
+    def request_report(self, filename: Optional[str] = None, overall_timeout: float = 5.0,
+                       max_age: Optional[float] = None) -> Dict[str, Any] | None:
         """
         Request a diagnostic report, decode it, update member varaibles from the report,
         and optionally save the report as a JSON file.
         
-        This function sends the report request command and then listens for a valid packet
-        until overall_timeout seconds have elapsed.
+        This function sends the report request command and returns as soon as a valid report is received after
+        it, or None when overall_timeout seconds have elapsed. The two characters of the command are
+        COMMAND_GAP seconds apart, with a shorter overall_timeout no request is sent and only a report the modem
+        sends on its own can be returned. Callers asking for a report while another request
+        is in progress share its result instead of sending a new request. In diagnostic mode the reports the
+        modem sends on its own are used as well.
         
         Parameters:
             filename (str, optional): If provided, the report is saved to this file.
             overall_timeout (float): Maximum time (in seconds) to wait for a valid report.
+            max_age (float, optional): If a report received less than max_age seconds ago exists,
+                                       it is returned without sending a request.
         
         Returns:
             Dict[str, Any]: The decoded report if successful; otherwise, None.
         """
-        # Send the report request.
-        self.get_report()
-        packet = self.read_packet()
-        self.logger.debug(f"Found a packet of length: {len(str(packet))} -> {str(packet)}")
+        deadline = self.clock.time() + overall_timeout
+        leader = False
+
+        with self.report_condition:
+            cached = self.latest_report(max_age) if max_age is not None else None
+            if cached is not None:
+                self.logger.debug("Using cached report")
+                report = cached
+            elif self._report_in_flight:
+                # Share the result of the request already in progress.
+                generation = self._report_generation
+                while self._report_generation == generation:
+                    remaining = deadline - self.clock.time()
+                    if remaining <= 0:
+                        break
+                    self.report_condition.wait(remaining)
+                report = self._report_result if self._report_generation != generation else None
+            else:
+                leader = True
+                self._report_in_flight = True
+                after = self.report_sequence
+
+        if leader:
+            report = None
+            try:
+                report = self._request_new_report(after, deadline)
+            finally:
+                with self.report_condition:
+                    self._report_in_flight = False
+                    self._report_result = report
+                    self._report_generation += 1
+                    self.report_condition.notify_all()
 
-        if packet is None:
+        if report is None:
             self.logger.info("No valid packet received.")
             return None
-
-        report = self.decode_packet(packet)
         self.logger.debug(f"Decoded packet: \n{report}")
-        if report is None:
-            self.logger.info("Failed to decode the packet.")
-            return None
 
         # Update internal state from the report.
         self.update_state_from_report(report)
@@ -200,7 +342,98 @@ class M16:
             self.logger.info(f"Report saved to {filename}")
 
         return report
-    
+
+    def _request_new_report(self, after: int, deadline: float) -> Optional[Dict[str, Any]]:
+        """
+        Send the report command and wait for a report with a sequence number after the given one.
+        The command is only sent if both characters can be written before the deadline: a lone 'r' left in the
+        modem would be sent together with the next character written. For the same reason the second character
+        is sent even if a report arrived between the two. The gap after the command is not waited for here,
+        the next character written waits for it in send_data().
+        """
+        if not self.command_lock.acquire(timeout=max(deadline - self.clock.time(), 0)):
+            return None
+        report = None
+        try:
+            start = max(self.clock.time(), self._quiet_until or 0.0)
+            if deadline - start >= self.COMMAND_GAP:
+                self.send_data('r')
+                gap_end = self.clock.time() + self.COMMAND_GAP
+                report = self.wait_for_report(after, deadline=gap_end)
+                remaining = gap_end - self.clock.time()
+                if remaining > 0:
+                    self.clock.sleep(remaining)
+                self.send_data('r')
+                self._quiet_until = self.clock.time() + self.COMMAND_GAP
+        finally:
+            self.command_lock.release()
+        if report is not None:
+            return report
+        return self.wait_for_report(after, deadline)
+
+    def latest_report(self, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the most recently received report.
+
+        Parameters:
+            max_age (float, optional): Only return the report if it was received less than max_age seconds ago.
+
+        Returns:
+            Optional[Dict[str, Any]]: The report, or None if there is no report (new enough).
+        """
+        with self.report_condition:
+            if not self.reports:
+                return None
+            _, received, report = self.reports[-1]
+        if max_age is not None and self.clock.time() - received > max_age:
+            return None
+        return report
+
+    def wait_for_report(self, after: int, deadline: float,
+                        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait for a report received after the report with a given sequence number.
+        The port is read by this method unless background_reader is set, then it waits for the reading thread.
+
+        Parameters:
+            after (int): Only reports with a larger sequence number are accepted, use report_sequence
+                         before sending a command to wait for a report caused by it.
+            deadline (float): Time (of self.clock) at which to give up.
+            predicate (Callable, optional): Only reports for which the predicate returns True are accepted.
+
+        Returns:
+            Optional[Dict[str, Any]]: The first accepted report, or None if none arrived before the deadline.
+        """
+        while True:
+            with self.report_condition:
+                for sequence, _, report in self.reports:
+                    if sequence > after and (predicate is None or predicate(report)):
+                        return report
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    return None
+                if self._reader_elsewhere():
+                    self.report_condition.wait(remaining)
+                    continue
+            self.read_packet(timeout=remaining)
+
+    def _reader_elsewhere(self) -> bool:
+        """
+        True if another thread reads the port, methods waiting for a report then wait for it instead of reading.
+        """
+        return self.background_reader
+
+    def _record_report(self, packet: bytes) -> None:
+        """
+        Keep the packet as the latest report if it is a valid report and wake up threads waiting for one.
+        """
+        report = self.decode_packet(packet)
+        if report is None:
+            return
+        with self.report_condition:
+            self.report_sequence += 1
+            self.reports.append((self.report_sequence, self.clock.time(), report))
+            self.report_condition.notify_all()
 
     def update_state_from_report(self, report: Dict[str, Any]) -> None:
         """
@@ -228,8 +461,12 @@ class M16:
         if len(data) != 2:
             return 0
         else: 
-            bytes = self.send_data(data)
-            sleep(1)
+            with self.command_lock:
+                if self.tdma is not None:
+                    self.tdma.wait_for_slot()
+                bytes = self.send_data(data)
+                self.last_send_time = self.clock.time()
+                self.clock.sleep(1)
             return bytes
 
     def send_msg(self, msg: str, timeout_per_chunk: float = 5.0) -> (int | None):
@@ -252,59 +489,79 @@ class M16:
         if len(msg) % 2 != 0:
             msg = msg + " "
 
-        for i in range(0, len(msg), 2):
-            chunk = msg[i:i+2]
-            sent_char = self.send_two_bytes(chunk)
-            self.logger.info(f"Sent chunk: '{chunk}'")
-            if sent_char is not None:
-                sum_sent_char += sent_char
-            
-            if self.diagnostic:
-                # Wait for a report with TX_COMPLETE set to 1.
-                start_time = time()
-                while time() - start_time < timeout_per_chunk:
-                    packet = self.read_packet()
-                    if packet is not None:
-                        report = self.decode_packet(packet)
-                        if report is not None:
-                            if report.get("TX_COMPLETE", 0) == 1:
-                                self.logger.info(f"Transmission complete for chunk: '{chunk}'")
-                                break
-                    sleep(0.1)
-            else:
-                # In transparent mode, simply wait the transmission duration.
-                sleep(2)
+        with self.command_lock:
+            for i in range(0, len(msg), 2):
+                chunk = msg[i:i+2]
+                start_time = self.clock.time()
+                after = self.report_sequence
+                sent_char = self.send_two_bytes(chunk)
+                self.logger.info(f"Sent chunk: '{chunk}'")
+                if sent_char is not None:
+                    sum_sent_char += sent_char
+                
+                if self.diagnostic:
+                    # Wait for a report with TX_COMPLETE set to 1.
+                    report = self.wait_for_report(after, deadline=start_time + timeout_per_chunk,
+                                                  predicate=lambda r: r.get("TX_COMPLETE", 0) == 1)
+                    if report is not None:
+                        self.logger.info(f"Transmission complete for chunk: '{chunk}'")
+                else:
+                    # In transparent mode, simply wait the transmission duration.
+                    self.clock.sleep(2)
         return sent_char
 
-    def read_packet(self) -> Optional[bytes]:
+    def read_packet(self, timeout: float = 2.0) -> Optional[bytes]:
         """
         Read data from the serial port and search for a valid diagnostic packet.
         A valid packet starts with '$' (0x24) and ends with '\\n' (0x0A) and is exactly 18 bytes long.
         
+        Parameters:
+            timeout (float): Seconds to wait for a valid packet (default 2).
+
         Returns:
             Optional[bytes]: The valid packet if found, otherwise the buffer if it is not empty.
+                             None if nothing was read or address_filter dropped what was read.
+        """
+        packet = self._read_packet(timeout)
+        if packet is not None and self.address_filter is not None:
+            # Drop traffic for other nodes before it is decoded or passed to the listeners
+            packet = self.address_filter.filter(packet, self.clock.time())
+        if packet is not None:
+            self._record_report(packet)
+            self._notify_listeners(packet)
+        return packet
+
+    def _read_packet(self, timeout_duration: float) -> Optional[bytes]:
+        """
+        Read from the serial port for up to timeout_duration seconds, see read_packet().
         """
-        buffer = b""
-        start_time = time()
-        timeout_duration = 2  # seconds to wait for a valid packet
+        # Start with what was read after the packet returned by the previous call
+        buffer = self._read_buffer
+        self._read_buffer = b""
+        deadline = self.clock.time() + timeout_duration
 
-        while time() - start_time < timeout_duration:
+        while True:
             if self.ser.in_waiting:
                 data = self.ser.read(self.ser.in_waiting)
                 buffer += data
                 self.logger.debug(f"Buffer length: {len(buffer)}, buffer: {str(buffer)}")
 
-            if b'$' in buffer and b'\n' in buffer:
-                start_index = buffer.rfind(b'$')
-                end_index = buffer.rfind(b'\n', start_index)
-                packet = buffer[start_index:end_index + 1]
-                if len(packet) == self.PACKET_LENGTH:
+            # Return the first complete packet, several reports may arrive in one read
+            start_index = buffer.find(b'$')
+            while start_index != -1:
+                end_index = start_index + self.PACKET_LENGTH
+                if end_index <= len(buffer) and buffer[end_index - 1:end_index] == b'\n':
+                    packet = buffer[start_index:end_index]
+                    self._read_buffer = buffer[end_index:]
                     self.logger.debug(f"Returning packet: {str(packet)}")
                     return packet
-                elif len(packet) > self.PACKET_LENGTH:
-                    self.logger.debug(f"Returning packet: {str(packet)}")
-                    return packet[:self.PACKET_LENGTH]
-            sleep(0.1)
+                start_index = buffer.find(b'$', start_index + 1)
+
+            # Compare with a fixed deadline, summed up sleeps may fall short of it by a rounding error
+            remaining = deadline - self.clock.time()
+            if remaining <= 0:
+                break
+            self.clock.sleep(min(self.POLL_INTERVAL, remaining))
 
         if len(buffer) == 0:
             self.logger.debug(f"Returning None")
@@ -313,7 +570,8 @@ class M16:
             self.logger.debug(f"Returning buffer: {str(buffer)}")
             return buffer
 
-    def decode_packet(self, packet: bytes) -> Optional[Dict[str, Any]]:
+    @staticmethod
+    def decode_packet(packet: bytes) -> Optional[Dict[str, Any]]:
         """
         Decode a diagnostic packet received from the modem.
         
@@ -332,7 +590,7 @@ class M16:
         except UnicodeDecodeError:
             return None
 
-        if len(packet_str) != self.PACKET_LENGTH or packet_str[0] != '$' or packet_str[-1] != '\n':
+        if len(packet_str) != M16.PACKET_LENGTH or packet_str[0] != '$' or packet_str[-1] != '\n':
             return None
 
         data_bytes = packet_str[1:17].encode('ISO-8859-1')
@@ -0,0 +1,324 @@
+import heapq
+import struct
+import itertools
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Union, Callable
+
+from m16_clock import SystemClock, VirtualClock
+from m16_transport import Transport
+
+
+def encode_report(report: Dict[str, Any]) -> bytes:
+    """
+    Encode a report in the 18 byte format sent by the modem, the inverse of M16.decode_packet().
+
+    Parameters:
+        report (Dict[str, Any]): Report with the keys returned by M16.decode_packet(), missing keys are 0.
+
+    Returns:
+        bytes: The encoded report.
+    """
+    time_field = report.get("TIME", 0) & 0xFFFFFF
+    data = struct.pack(
+        "<HBBBHBBBBBHBB",
+        int.from_bytes(report.get("TR_BLOCK", b"\x00\x00"), "little"),
+        report.get("BER", 0),
+        report.get("SIGNAL_POWER", 0),
+        report.get("NOISE_POWER", 0),
+        report.get("PACKET_VALID", 0) & 0xFFFF,
+        report.get("PACKET_INVALID", 0) & 0xFF,
+        int.from_bytes(report.get("GIT_REV", b"\x00"), "little"),
+        time_field & 0xFF,
+        (time_field >> 8) & 0xFF,
+        (time_field >> 16) & 0xFF,
+        report.get("CHIP_ID", 0),
+        (report.get("HW_REV", 0) & 0b11)
+        | ((report.get("CHANNEL", 0) & 0b1111) << 2)
+        | ((report.get("TB_VALID", 0) & 1) << 6)
+        | ((report.get("TX_COMPLETE", 0) & 1) << 7),
+        (report.get("DIAGNOSTIC_MODE", 0) & 1) | ((report.get("LEVEL", 0) & 0b11) << 2),
+    )
+    return b"$" + data + b"\n"
+
+
+class Medium:
+    """
+    The water between emulated modems. This one delivers every block without errors or delay
+    to all other modems on the same channel, see m16_medium.AcousticMedium for a realistic channel.
+    """
+
+    def __init__(self) -> None:
+        self.modems: List["M16Emulator"] = []
+
+    def attach(self, modem: "M16Emulator") -> None:
+        """
+        Put a modem in the water.
+        """
+        self.modems.append(modem)
+        modem.medium = self
+
+    def transmit(self, sender: "M16Emulator", block: bytes, start: float, end: float) -> None:
+        """
+        Called by a modem sending a block between start and end.
+        """
+        for modem in self.modems:
+            if modem is not sender and modem.channel == sender.channel:
+                modem.deliver(block, end)
+
+
+class M16Emulator:
+    """
+    Emulation of an M16 modem's UART interface, for running the driver and applications without hardware.
+
+    Commands are recognised the way the driver sends them: a command character, a pause of at least
+    MIN_COMMAND_GAP seconds and the same character again, for channel and level followed by the value.
+    Two characters sent without a pause are a data block, which is transmitted for BLOCK_AIRTIME seconds
+    and delivered to the other modems on the same medium. In diagnostic mode a report is sent every
+    REPORT_INTERVAL seconds, on TX_COMPLETE and when a block is received.
+
+    The emulator does not run a thread. Everything it does is computed from the clock when the host reads
+    from or writes to its transport, so with a VirtualClock a whole session runs as fast as the host can poll.
+    """
+    COMMANDS = "cldtmr"
+    CHANNEL_CHARACTERS = "123456789abc"
+    MIN_COMMAND_GAP = 0.5  # seconds between the two characters of a command
+    BLOCK_AIRTIME = 2.0  # seconds to transmit one 2 byte block
+    REPORT_DELAY = 0.05  # seconds from a report request to the report
+    REPORT_INTERVAL = 1.0  # seconds between reports in diagnostic mode
+    TICKS_PER_SECOND = 1000  # rate of the TIME counter in the reports
+
+    def __init__(self, clock: Optional[Union[SystemClock, VirtualClock]] = None, channel: int = 1, level: int = 4,
+                 diagnostic: bool = False, chip_id: int = 39040, hw_rev: int = 2, git_rev: int = 0x56,
+                 medium: Optional[Medium] = None, drift: float = 0.0, initial_time: int = 0) -> None:
+        """
+        Parameters:
+            clock (SystemClock | VirtualClock, optional): Clock shared with the driver, defaults to real time.
+            channel (int): Channel at power on (default 1).
+            level (int): Power level at power on (default 4).
+            diagnostic (bool): Diagnostic mode at power on (default False).
+            chip_id (int): CHIP_ID in the reports.
+            hw_rev (int): HW_REV in the reports.
+            git_rev (int): GIT_REV in the reports.
+            medium (Medium, optional): Medium to attach the modem to.
+            drift (float): Error of the modem's TIME counter in parts per million (default 0).
+            initial_time (int): TIME counter at power on in ticks, e.g. close to the 24 bit wraparound (default 0).
+        """
+        self.clock = clock if clock is not None else SystemClock()
+        self.channel = channel
+        self.level = level
+        self.diagnostic = diagnostic
+        self.chip_id = chip_id
+        self.hw_rev = hw_rev
+        self.git_rev = git_rev
+        self.drift = drift
+        self.initial_time = initial_time
+        self.start_time = self.clock.time()
+
+        # Link statistics reported in the diagnostic reports
+        self.packet_valid = 0
+        self.packet_invalid = 0
+        self.ber = 0
+        self.signal_power = 0
+        self.noise_power = 40
+        self.blocks_sent = 0
+
+        self.lock = threading.RLock()  # The driver may use the transport from several threads
+        self.output = bytearray()  # Bytes waiting to be read by the host
+        self._events: List[Tuple[float, int, str, Any]] = []  # (time, order, kind, data)
+        self._order = itertools.count()
+        self._inbox = deque()  # (time, resolve) of blocks on their way from the medium
+        self._pending: Optional[Tuple[int, float]] = None  # First character of a block or command
+        self._command: Optional[str] = None  # Command waiting for its value
+        self._tx_busy_until = self.start_time
+        self._next_report = self.start_time + self.REPORT_INTERVAL
+
+        self.medium = None
+        if medium is not None:
+            medium.attach(self)
+
+    def transport(self, timeout: float = 0.5) -> "EmulatorTransport":
+        """
+        Create a transport connecting the driver to this modem.
+        """
+        return EmulatorTransport(self, timeout)
+
+    def _schedule(self, at: float, kind: str, data: Any = None) -> None:
+        heapq.heappush(self._events, (at, next(self._order), kind, data))
+
+    def receive(self, data: bytes) -> None:
+        """
+        Handle bytes written by the host.
+        """
+        with self.lock:
+            self._receive(data)
+
+    def _receive(self, data: bytes) -> None:
+        self.update()
+        now = self.clock.time()
+        for character in data:
+            if self._command is not None:
+                self._set_value(self._command, chr(character))
+                self._command = None
+            elif self._pending is None:
+                self._pending = (character, now)
+            else:
+                first, first_time = self._pending
+                self._pending = None
+                if first == character and chr(first) in self.COMMANDS and now - first_time >= self.MIN_COMMAND_GAP:
+                    self._run_command(chr(first), now)
+                else:
+                    self._transmit(bytes([first, character]), now)
+
+    def _run_command(self, command: str, now: float) -> None:
+        if command in "cl":
+            self._command = command
+        elif command == "d":
+            self.diagnostic = True
+            self._next_report = now + self.REPORT_INTERVAL
+        elif command == "t":
+            self.diagnostic = False
+        elif command == "m":
+            self.diagnostic = not self.diagnostic
+            self._next_report = now + self.REPORT_INTERVAL
+        elif command == "r":
+            self._schedule(now + self.REPORT_DELAY, "report")
+
+    def _set_value(self, command: str, value: str) -> None:
+        if command == "c" and value in self.CHANNEL_CHARACTERS:
+            self.channel = self.CHANNEL_CHARACTERS.index(value) + 1
+        elif command == "l" and value in "1234":
+            self.level = int(value)
+
+    def _transmit(self, block: bytes, now: float) -> None:
+        # Blocks written while transmitting are sent after the current one
+        start = max(now, self._tx_busy_until)
+        end = start + self.BLOCK_AIRTIME
+        self._tx_busy_until = end
+        self.blocks_sent += 1
+        self._schedule(end, "tx_complete", block)
+        if self.medium is not None:
+            self.medium.transmit(self, block, start, end)
+
+    def deliver(self, block: Optional[bytes], at: float, signal_power: int = 100, noise_power: int = 40,
+                ber: int = 0) -> None:
+        """
+        Called by the medium when a block arrives at this modem, block is None if it could not be decoded.
+        """
+        self.schedule_reception(at, lambda: (block, signal_power, noise_power, ber))
+
+    def schedule_reception(self, at: float,
+                           resolve: Callable[[], Optional[Tuple[Optional[bytes], int, int, int]]]) -> None:
+        """
+        Called by the medium for a block whose outcome is only known when it has arrived, e.g. because a
+        transmission starting later may still collide with it. resolve() is called at the arrival time and returns
+        the same values as the arguments of deliver(), or None if the modem did not detect anything.
+        """
+        # Not under self.lock, the medium calls this while another modem's lock may be held
+        self._inbox.append((at, resolve))
+
+    def update(self) -> None:
+        """
+        Handle everything that has happened up to the current time.
+        """
+        with self.lock:
+            self._update()
+
+    def _update(self) -> None:
+        while self._inbox:
+            at, resolve = self._inbox.popleft()
+            self._schedule(at, "rx", resolve)
+        now = self.clock.time()
+        while True:
+            next_event = self._events[0][0] if self._events else float("inf")
+            next_report = self._next_report if self.diagnostic else float("inf")
+            if min(next_event, next_report) > now:
+                return
+            if next_report < next_event:
+                self._next_report += self.REPORT_INTERVAL
+                self._emit_report(next_report)
+                continue
+            at, _, kind, data = heapq.heappop(self._events)
+            if kind == "report":
+                self._emit_report(at)
+            elif kind == "tx_complete":
+                if self.diagnostic:
+                    self._emit_report(at, tx_complete=True)
+            elif kind == "rx":
+                reception = data()
+                if reception is not None:
+                    self._receive_block(at, *reception)
+
+    def _receive_block(self, at: float, block: Optional[bytes], signal_power: int, noise_power: int,
+                       ber: int) -> None:
+        self.signal_power = signal_power
+        self.noise_power = noise_power
+        self.ber = ber
+        if block is None:
+            self.packet_invalid += 1
+            if self.diagnostic:
+                self._emit_report(at)
+            return
+        self.packet_valid += 1
+        if self.diagnostic:
+            self._emit_report(at, block=block)
+        else:
+            self.output += block
+
+    def report(self, at: Optional[float] = None, block: Optional[bytes] = None,
+               tx_complete: bool = False) -> Dict[str, Any]:
+        """
+        The report the modem would send at a given time.
+        """
+        at = self.clock.time() if at is None else at
+        return {
+            "TR_BLOCK": block if block is not None else b"\x00\x00",
+            "BER": self.ber,
+            "SIGNAL_POWER": self.signal_power,
+            "NOISE_POWER": self.noise_power,
+            "PACKET_VALID": self.packet_valid,
+            "PACKET_INVALID": self.packet_invalid,
+            "GIT_REV": self.git_rev.to_bytes(1, "little"),
+            "TIME": self.initial_time + int((at - self.start_time) * (1 + self.drift * 1e-6) * self.TICKS_PER_SECOND),
+            "CHIP_ID": self.chip_id,
+            "HW_REV": self.hw_rev,
+            "CHANNEL": self.channel,
+            "TB_VALID": int(block is not None),
+            "TX_COMPLETE": int(tx_complete),
+            "DIAGNOSTIC_MODE": int(self.diagnostic),
+            "LEVEL": 4 - self.level,
+        }
+
+    def _emit_report(self, at: float, block: Optional[bytes] = None, tx_complete: bool = False) -> None:
+        self.output += encode_report(self.report(at, block, tx_complete))
+
+
+class EmulatorTransport(Transport):
+    """
+    Transport connecting the driver to an M16Emulator.
+    """
+
+    def __init__(self, modem: M16Emulator, timeout: float = 0.5) -> None:
+        self.modem = modem
+        self.timeout = timeout
+        self.is_open = True
+
+    def write(self, data: bytes) -> int:
+        self.modem.receive(data)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = self.modem.clock.time() + self.timeout
+        self.modem.update()
+        while len(self.modem.output) < size and self.modem.clock.time() < deadline:
+            self.modem.clock.sleep(min(0.01, deadline - self.modem.clock.time()))
+            self.modem.update()
+        with self.modem.lock:
+            data = bytes(self.modem.output[:size])
+            del self.modem.output[:size]
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        self.modem.update()
+        return len(self.modem.output)
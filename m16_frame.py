@@ -0,0 +1,229 @@
+from typing import Optional, List, Tuple
+
+# Values in a frame are 7 bits, the driver sends ASCII
+MAX_NODE_ID = 127
+MAX_PAYLOAD = 127  # bytes
+HEADER_BLOCKS = 3
+
+
+def checksum(data: bytes) -> bytes:
+    """
+    CRC-16/CCITT of the data reduced to 14 bits and split into two 7 bit bytes, so it fits in one block.
+
+    Parameters:
+        data (bytes): The data to check.
+
+    Returns:
+        bytes: The two checksum bytes.
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    crc &= 0x3FFF
+    return bytes([crc >> 7, crc & 0x7F])
+
+
+class Frame:
+    """
+    A message with addresses, sent as a sequence of 2 byte blocks:
+
+        block 0:      link destination, link source   (the next hop and the node sending this copy)
+        block 1:      destination, origin             (the end points of the message)
+        block 2:      message id, payload length
+        block 3...:   payload, padded with a space to whole blocks
+        last block:   checksum of blocks 1 to the end of the payload
+
+    Block 0 is rewritten by every relay, so it is not part of the checksum.
+    All values are 0 to 127, payloads are ASCII of at most MAX_PAYLOAD bytes.
+    """
+
+    def __init__(self, destination: int, origin: int, message_id: int, payload: bytes,
+                 next_hop: Optional[int] = None, sender: Optional[int] = None) -> None:
+        """
+        Parameters:
+            destination (int): Node the message is for.
+            origin (int): Node that created the message.
+            message_id (int): Number identifying the message among those from the origin (0 to 127).
+            payload (bytes): ASCII payload of at most MAX_PAYLOAD bytes.
+            next_hop (int, optional): Link destination, defaults to the destination.
+            sender (int, optional): Link source, defaults to the origin.
+        """
+        for name, value in (("destination", destination), ("origin", origin), ("message id", message_id)):
+            if not 0 <= value <= MAX_NODE_ID:
+                raise ValueError(f"The {name} {value} is not between 0 and {MAX_NODE_ID}")
+        if len(payload) > MAX_PAYLOAD or any(byte > 0x7F for byte in payload):
+            raise ValueError(f"The payload must be ASCII of at most {MAX_PAYLOAD} bytes")
+        self.destination = destination
+        self.origin = origin
+        self.message_id = message_id
+        self.payload = bytes(payload)
+        self.next_hop = destination if next_hop is None else next_hop
+        self.sender = origin if sender is None else sender
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        """
+        (origin, message id), identifies copies of the same message.
+        """
+        return self.origin, self.message_id
+
+    def link_header(self) -> bytes:
+        return bytes([self.next_hop, self.sender])
+
+    def body(self) -> bytes:
+        """
+        Blocks 1 to the end of the payload, the part covered by the checksum.
+        """
+        payload = self.payload + b" " * (len(self.payload) % 2)
+        return bytes([self.destination, self.origin, self.message_id, len(self.payload)]) + payload
+
+    def encode(self) -> bytes:
+        body = self.body()
+        return self.link_header() + body + checksum(body)
+
+    def blocks(self) -> List[bytes]:
+        data = self.encode()
+        return [data[i:i+2] for i in range(0, len(data), 2)]
+
+    def __repr__(self) -> str:
+        return (f"Frame(destination={self.destination}, origin={self.origin}, message_id={self.message_id}, "
+                f"payload={self.payload!r}, next_hop={self.next_hop}, sender={self.sender})")
+
+
+class FrameDecoder:
+    """
+    Reassembles frames from received blocks one block at a time, so the header is known before the payload
+    has arrived. feed() returns what the block completed:
+        - "header" when the first three blocks have arrived, the frame is in self.frame without payload
+        - "payload" for every later block except the last
+        - "frame" when the frame is complete and the checksum is correct
+        - "corrupt" when the checksum is wrong or a header value is out of range
+        - None for bytes that did not complete a block
+
+    A block reported lost by the modem (a diagnostic report without TB_VALID) is passed to skip(), it keeps its
+    place in the frame so the frame ends as "corrupt" and the next frame starts at the right block. If the lost
+    block held the payload length, or a block is lost without a report, the frame boundaries are found again
+    when no block arrives within max_gap seconds.
+    """
+
+    def __init__(self, max_gap: float = 10.0) -> None:
+        """
+        Parameters:
+            max_gap (float): Seconds without a block after which a partial frame is dropped (default 10).
+        """
+        self.max_gap = max_gap
+        self.frame: Optional[Frame] = None
+        self.data = bytearray()  # Blocks of the current frame
+        self.pending = b""  # A single byte waiting for the second byte of its block
+        self.expected = 0  # Number of blocks in the current frame, 0 until the header is known
+        self.block = b""  # The last block fed
+        self.damaged = False  # A block of the current frame was lost
+        self.synchronised = True  # False from a lost payload length until the next gap
+        self.last_time: Optional[float] = None
+
+    def reset(self) -> None:
+        self.frame = None
+        self.data = bytearray()
+        self.pending = b""
+        self.expected = 0
+        self.damaged = False
+
+    def feed(self, data: bytes, time: Optional[float] = None) -> Optional[str]:
+        """
+        Add one received block (or a part of one in transparent mode).
+
+        Parameters:
+            data (bytes): The received bytes, normally one block of 2 bytes.
+            time (float, optional): Time the block was received, for abandoning interrupted frames.
+
+        Returns:
+            Optional[str]: "header", "payload", "frame", "corrupt" or None, see the class description.
+        """
+        self._check_gap(time)
+        data = self.pending + data
+        if len(data) < 2:
+            self.pending = data
+            return None
+        if len(data) > 2:
+            raise ValueError("Feed one block at a time")
+        self.pending = b""
+        return self._add_block(data)
+
+    def skip(self, time: Optional[float] = None) -> Optional[str]:
+        """
+        Account for a block the modem received but could not decode, in place of the block.
+
+        Parameters:
+            time (float, optional): Time the block was lost.
+
+        Returns:
+            Optional[str]: "payload", "corrupt" or None, see the class description.
+        """
+        self._check_gap(time)
+        self.pending = b""
+        if not self.synchronised:
+            return None
+        if len(self.data) // 2 == HEADER_BLOCKS - 1:
+            # Without the payload length the end of the frame is unknown
+            self.reset()
+            self.synchronised = False
+            return "corrupt"
+        self.damaged = True
+        return self._add_block(b"\x00\x00")
+
+    def _check_gap(self, time: Optional[float]) -> None:
+        if time is not None:
+            if self.last_time is not None and time - self.last_time > self.max_gap:
+                self.reset()
+                self.synchronised = True
+            self.last_time = time
+
+    def _add_block(self, data: bytes) -> Optional[str]:
+        if not self.synchronised:
+            return None
+        self.block = data
+        self.data += data
+        blocks = len(self.data) // 2
+
+        if blocks < HEADER_BLOCKS:
+            return None
+        if blocks == HEADER_BLOCKS:
+            next_hop, sender, destination, origin, message_id, length = self.data
+            if max(self.data) > MAX_NODE_ID or length > MAX_PAYLOAD:
+                self.reset()
+                return "corrupt"
+            self.expected = HEADER_BLOCKS + (length + 1) // 2 + 1
+            if self.damaged:
+                # The addresses are unknown, the frame is only followed to its end
+                self.frame = None
+                return None
+            self.frame = Frame(destination, origin, message_id, b"", next_hop, sender)
+            return "header"
+        if blocks < self.expected:
+            return "payload"
+
+        body = bytes(self.data[2:-2])
+        valid = not self.damaged and checksum(body) == bytes(self.data[-2:])
+        frame = self.frame
+        if frame is not None:
+            frame.payload = body[4:4 + body[3]]
+        self.reset()
+        self.frame = frame
+        return "frame" if valid else "corrupt"
+
+    def feed_bytes(self, data: bytes, time: Optional[float] = None) -> List[Tuple[str, Frame]]:
+        """
+        Add any number of received bytes, e.g. a buffer read in transparent mode.
+
+        Returns:
+            List[Tuple[str, Frame]]: The results other than None of each completed block, with the frame.
+        """
+        events = []
+        for i in range(len(data)):
+            event = self.feed(data[i:i+1], time)
+            if event is not None:
+                events.append((event, self.frame))
+        return events
@@ -0,0 +1,202 @@
+import math
+import random
+import threading
+from typing import Optional, Dict, List, Tuple
+
+from m16_emulator import Medium, M16Emulator
+
+Position = Tuple[float, float, float]
+
+
+class _Arrival:
+    """
+    A transmission as it arrives at one modem, collecting the power of everything overlapping with it.
+    """
+    __slots__ = ("start", "end", "power", "channel", "own", "interference", "cross_channel", "deaf")
+
+    def __init__(self, start: float, end: float, power: float, channel: int, own: bool = False) -> None:
+        self.start = start
+        self.end = end
+        self.power = power
+        self.channel = channel
+        self.own = own  # The modem's own transmission, it cannot receive meanwhile
+        self.interference = 0.0  # Power of overlapping transmissions on the same channel
+        self.cross_channel = 0.0  # Power of overlapping transmissions on other channels
+        self.deaf = False  # The modem was transmitting while this arrived
+
+    def overlaps(self, other: "_Arrival") -> bool:
+        return self.start < other.end and other.start < self.end
+
+    def add(self, other: "_Arrival") -> None:
+        if self.own:
+            return
+        if other.own:
+            self.deaf = True
+        elif other.channel == self.channel:
+            self.interference += other.power
+        else:
+            self.cross_channel += other.power
+
+
+class AcousticMedium(Medium):
+    """
+    Water between many emulated modems, for testing networks of nodes before going to sea.
+
+    Every modem has a position in metres. A block arrives at the other modems after the propagation delay and
+    with the source level of the sender's power level minus the transmission loss (spreading and absorption).
+    Whether it is decoded depends on the signal to noise ratio at the receiver:
+        - transmissions on other channels add to the noise, reduced by channel_isolation dB
+        - transmissions on the same channel overlapping at the receiver collide, the block is lost unless it is
+          CAPTURE_RATIO dB stronger than the others together
+        - a modem does not hear anything while it is transmitting itself
+        - blocks too weak to be detected are not reported at all, blocks detected with bit errors count as
+          PACKET_INVALID and blocks decoded correctly as PACKET_VALID with TB_VALID set in diagnostic mode
+
+    The outcome of a block is decided when it has completely arrived, so collisions with transmissions that
+    start later are included. All calculations use cached per-link values, a network of tens of modems handles
+    thousands of blocks per second of computation.
+    """
+    SOUND_SPEED = 1500.0  # m/s
+    SOURCE_LEVELS = {1: 156.0, 2: 162.0, 3: 168.0, 4: 174.0}  # dB re 1 uPa at 1 m for each power level
+    SPREADING = 20.0  # transmission loss per decade of distance in dB, 20 is spherical spreading
+    ABSORPTION = 8.0  # dB/km
+    PROCESSING_GAIN = 10.0  # dB gained against noise by despreading, not against the same channel
+    DETECTION_THRESHOLD = 0.0  # dB, minimum Eb/N0 without interference for a block to be noticed at all
+    CAPTURE_RATIO = 10.0  # dB a block must be above colliding blocks to survive
+    BLOCK_BITS = 16  # bits in one block
+    REPORT_OFFSET = 50.0  # dB re 1 uPa shown as 0 in SIGNAL_POWER and NOISE_POWER of the reports
+
+    def __init__(self, noise_level: float = 90.0, channel_isolation: float = 25.0,
+                 seed: Optional[int] = None) -> None:
+        """
+        Parameters:
+            noise_level (float): Ambient noise in the modem's band in dB re 1 uPa (default 90).
+            channel_isolation (float): Attenuation of other channels by the receiver in dB (default 25).
+            seed (int, optional): Seed for the bit errors, for repeatable runs.
+        """
+        super().__init__()
+        self.noise_level = noise_level
+        self.channel_isolation = channel_isolation
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.positions: Dict[M16Emulator, Position] = {}
+        self._links: Dict[Tuple[M16Emulator, M16Emulator], Tuple[float, float]] = {}  # (delay, power)
+        self._arrivals: Dict[M16Emulator, List[_Arrival]] = {}  # Recent arrivals at each modem
+
+        # Statistics of all receptions
+        self.transmissions = 0
+        self.delivered = 0
+        self.corrupted = 0
+        self.collisions = 0
+        self.missed = 0
+
+    def attach(self, modem: M16Emulator, position: Position = (0.0, 0.0, 0.0)) -> None:
+        """
+        Put a modem in the water.
+
+        Parameters:
+            modem (M16Emulator): The modem.
+            position (Tuple[float, float, float]): Position (x, y, depth) in metres (default origin).
+        """
+        with self.lock:
+            super().attach(modem)
+            self._arrivals[modem] = []
+        self.move(modem, position)
+
+    def move(self, modem: M16Emulator, position: Position) -> None:
+        """
+        Change the position of a modem, in metres.
+        """
+        with self.lock:
+            self.positions[modem] = tuple(float(p) for p in position)
+            self._links = {link: value for link, value in self._links.items() if modem not in link}
+
+    def _link(self, sender: M16Emulator, receiver: M16Emulator) -> Tuple[float, float]:
+        """
+        Propagation delay in seconds and received power (linear, re 1 uPa^2) for full power, cached per link.
+        """
+        link = self._links.get((sender, receiver))
+        if link is None:
+            distance = max(math.dist(self.positions[sender], self.positions[receiver]), 1.0)
+            loss = self.SPREADING * math.log10(distance) + self.ABSORPTION * distance / 1000
+            link = (distance / self.SOUND_SPEED, 10 ** (-loss / 10))
+            self._links[(sender, receiver)] = self._links[(receiver, sender)] = link
+        return link
+
+    def transmit(self, sender: M16Emulator, block: bytes, start: float, end: float) -> None:
+        with self.lock:
+            self.transmissions += 1
+            now = sender.clock.time()
+            self._add(sender, _Arrival(start, end, math.inf, sender.channel, own=True), now)
+            source = 10 ** (self.SOURCE_LEVELS[sender.level] / 10)
+            for modem in self.modems:
+                if modem is sender:
+                    continue
+                delay, gain = self._link(sender, modem)
+                arrival = _Arrival(start + delay, end + delay, source * gain, sender.channel)
+                self._add(modem, arrival, now)
+                if modem.channel == sender.channel:
+                    modem.schedule_reception(arrival.end, self._resolver(arrival, block))
+
+    def _add(self, modem: M16Emulator, arrival: _Arrival, now: float) -> None:
+        """
+        Register an arrival at a modem and let it interfere with the arrivals it overlaps.
+        Arrivals that ended before now are dropped, later transmissions cannot overlap with them.
+        """
+        arrivals = [other for other in self._arrivals[modem] if other.end > now]
+        for other in arrivals:
+            if other.overlaps(arrival):
+                other.add(arrival)
+                arrival.add(other)
+        arrivals.append(arrival)
+        self._arrivals[modem] = arrivals
+
+    def _resolver(self, arrival: _Arrival, block: bytes):
+        return lambda: self._resolve(arrival, block)
+
+    def _resolve(self, arrival: _Arrival, block: bytes) -> Optional[Tuple[Optional[bytes], int, int, int]]:
+        """
+        Decide the outcome of a block that has arrived, see M16Emulator.schedule_reception().
+        """
+        with self.lock:
+            if arrival.deaf:
+                self.missed += 1
+                return None
+            noise = 10 ** (self.noise_level / 10) + arrival.cross_channel * 10 ** (-self.channel_isolation / 10)
+            despread_noise = noise / 10 ** (self.PROCESSING_GAIN / 10)
+            if 10 * math.log10(arrival.power / despread_noise) < self.DETECTION_THRESHOLD:
+                self.missed += 1
+                return None
+
+            ebn0 = arrival.power / (despread_noise + arrival.interference)
+
+            ber = 0.5 * math.erfc(math.sqrt(ebn0))
+            valid = self.random.random() < (1 - ber) ** self.BLOCK_BITS
+            if arrival.interference > 0:
+                self.collisions += 1
+                if arrival.power < arrival.interference * 10 ** (self.CAPTURE_RATIO / 10):
+                    valid = False
+            if valid:
+                self.delivered += 1
+            else:
+                self.corrupted += 1
+            return (block if valid else None,
+                    self._report_power(arrival.power),
+                    self._report_power(noise + arrival.interference),
+                    min(round(ber * 255), 255))
+
+    def _report_power(self, power: float) -> int:
+        return min(max(round(10 * math.log10(power) - self.REPORT_OFFSET), 0), 255)
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Counts of transmitted blocks and the outcome of their receptions.
+        """
+        with self.lock:
+            return {
+                "transmissions": self.transmissions,
+                "delivered": self.delivered,
+                "corrupted": self.corrupted,
+                "collisions": self.collisions,
+                "missed": self.missed,
+            }
@@ -0,0 +1,439 @@
+import json
+import logging
+import argparse
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_timesync import TimeSync
+
+# Blocks of the test protocol are a kind character and a sequence character
+SEQUENCE_CHARACTERS = "".join(chr(code) for code in range(0x21, 0x7F))  # printable ASCII, 94 sequence numbers
+CHANNEL_CHARACTERS = "123456789abc"
+PING, PONG = "P", "p"  # ping and its reflection
+STREAM, STREAM_END = "S", "E"  # stream block and end of stream, with the number of blocks sent
+CHANNEL, CHANNEL_ACK = "C", "c"  # switch channel, with the new channel
+
+DEFAULT_TIMEOUT = 15.0  # seconds to wait for a reflection after the ping was sent
+
+
+def sequence_character(number: int) -> str:
+    return SEQUENCE_CHARACTERS[number % len(SEQUENCE_CHARACTERS)]
+
+
+def _summary(values: List[float], name: str) -> Dict[str, Optional[float]]:
+    """
+    Minimum, mean and maximum of a list of values, None when it is empty.
+    """
+    if not values:
+        return {f"{name}_min": None, f"{name}_mean": None, f"{name}_max": None}
+    return {f"{name}_min": min(values), f"{name}_mean": sum(values) / len(values), f"{name}_max": max(values)}
+
+
+class PerfEndpoint:
+    """
+    One end of a link test, collects the blocks received by a modem in diagnostic mode together with the time they
+    were received, at the resolution of the modem's TIME counter (see m16_timesync.TimeSync).
+    """
+    POLL_INTERVAL = 0.5  # seconds of each read while waiting for a block
+
+    def __init__(self, modem: M16) -> None:
+        """
+        Parameters:
+            modem (M16): The modem, it must be in diagnostic mode and is read by this endpoint.
+        """
+        self.modem = modem
+        self.clock = modem.clock
+        self.logger = logging.getLogger(__name__)
+        self.sync = TimeSync()
+        self.sync.attach(modem)
+        self._received: "deque[Tuple[bytes, float, Dict[str, Any]]]" = deque()
+        modem.add_listener(self._on_packet)
+
+    def close(self) -> None:
+        """
+        Stop collecting blocks, the modem stays open.
+        """
+        self.modem.remove_listener(self._on_packet)
+        self.sync.detach()
+
+    def _on_packet(self, packet: bytes) -> None:
+        report = M16.decode_packet(packet)
+        if report is None or not report["TB_VALID"] or report["TX_COMPLETE"]:
+            return
+        block = report["TR_BLOCK"]
+        time = self.clock.time()
+        # TimeSync is called first, as it was added first, and knows when the block was received by the modem
+        if self.sync.events and self.sync.events[-1][0] == "rx" and self.sync.events[-1][2] == block:
+            time = self.sync.events[-1][1]
+        self._received.append((block, time, report))
+
+    def send_block(self, block: str) -> float:
+        """
+        Send one block and wait until it has been transmitted.
+
+        Returns:
+            float: The time the block was written to the modem.
+        """
+        self.modem.send_msg(block)
+        return self.modem.last_send_time
+
+    def receive_block(self, timeout: float) -> Optional[Tuple[bytes, float, Dict[str, Any]]]:
+        """
+        Wait for the next received block.
+
+        Returns:
+            Optional[Tuple[bytes, float, Dict[str, Any]]]: The block, the time it was received and its report,
+                                                           None if no block arrived within the timeout.
+        """
+        deadline = self.clock.time() + timeout
+        while not self._received:
+            remaining = deadline - self.clock.time()
+            if remaining <= 0:
+                return None
+            self.modem.read_packet(min(remaining, self.POLL_INTERVAL))
+        return self._received.popleft()
+
+    @staticmethod
+    def _link_quality(reports: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+        """
+        Mean signal power, noise power and BER of the reports of received blocks.
+        """
+        if not reports:
+            return {"signal_power": None, "noise_power": None, "ber": None}
+        return {key.lower(): sum(report[key] for report in reports) / len(reports)
+                for key in ("SIGNAL_POWER", "NOISE_POWER", "BER")}
+
+
+class Reflector(PerfEndpoint):
+    """
+    The far end of a link test: reflects pings, measures streams and follows channel changes.
+
+    Example:
+        Reflector(M16("/dev/ttyUSB0", diagnostic=True)).run()
+    """
+
+    def __init__(self, modem: M16) -> None:
+        super().__init__(modem)
+        self.streams: List[Dict[str, Any]] = []  # Results of the streams received
+        self._stream: Optional[Dict[str, Any]] = None
+
+    def run(self, duration: Optional[float] = None, stop: Optional[threading.Event] = None) -> None:
+        """
+        Answer the other end until the duration has passed or stop is set.
+
+        Parameters:
+            duration (float, optional): Seconds to run, by default until stop is set.
+            stop (threading.Event, optional): Set to stop the reflector.
+        """
+        end = None if duration is None else self.clock.time() + duration
+        while (stop is None or not stop.is_set()) and (end is None or self.clock.time() < end):
+            received = self.receive_block(self.POLL_INTERVAL)
+            if received is not None:
+                self.handle(*received)
+        self._finish_stream(None)
+
+    def handle(self, block: bytes, time: float, report: Dict[str, Any]) -> None:
+        """
+        Act on one received block of the test protocol, other blocks are ignored.
+        """
+        kind, value = chr(block[0]), chr(block[1])
+        if kind == PING:
+            self.send_block(PONG + value)
+        elif kind == STREAM:
+            self._stream_block(SEQUENCE_CHARACTERS.find(value), time, report)
+        elif kind == STREAM_END:
+            self._finish_stream(SEQUENCE_CHARACTERS.find(value))
+        elif kind == CHANNEL and value in CHANNEL_CHARACTERS:
+            self.send_block(CHANNEL_ACK + value)
+            self.modem.set_channel(CHANNEL_CHARACTERS.index(value) + 1)
+            self.logger.info(f"Switched to channel {self.modem.channel}")
+
+    def _stream_block(self, sequence: int, time: float, report: Dict[str, Any]) -> None:
+        stream = self._stream
+        if stream is None:
+            # Streams start at sequence number 0, blocks lost before the first one received count as well
+            stream = self._stream = {"first": time, "last": time, "number": sequence, "sequence": sequence,
+                                     "received": 0, "arrivals": [], "reports": []}
+        else:
+            # Unwrap the sequence number, blocks only arrive in order
+            stream["number"] += (sequence - stream["sequence"]) % len(SEQUENCE_CHARACTERS)
+            stream["sequence"] = sequence
+        stream["received"] += 1
+        stream["arrivals"].append(time)
+        stream["reports"].append(report)
+        stream["last"] = time
+
+    def _finish_stream(self, sent: Optional[int]) -> None:
+        """
+        Compute the results of the current stream, sent is the number of blocks from the end block modulo the
+        number of sequence characters, None if the end block was lost.
+        """
+        stream = self._stream
+        if stream is None:
+            return
+        self._stream = None
+        expected = stream["number"] + 1
+        if sent is not None:
+            # Blocks lost after the last one received
+            expected += (sent - 1 - stream["sequence"]) % len(SEQUENCE_CHARACTERS)
+        intervals = [b - a for a, b in zip(stream["arrivals"], stream["arrivals"][1:])]
+        mean_interval = sum(intervals) / len(intervals) if intervals else None
+        duration = stream["last"] - stream["first"]
+        result = {
+            "received": stream["received"],
+            "expected": expected,
+            "lost": expected - stream["received"],
+            "loss": 1 - stream["received"] / expected,
+            "goodput_bps": 16 * (stream["received"] - 1) / duration if duration > 0 else None,
+            "interarrival_mean": mean_interval,
+            "jitter": (sum(abs(interval - mean_interval) for interval in intervals) / len(intervals)
+                       if intervals else None),
+        }
+        result.update(self._link_quality(stream["reports"]))
+        self.streams.append(result)
+        self.logger.info(f"Stream received: {result}")
+
+
+class PerfClient(PerfEndpoint):
+    """
+    The end running a link test against a Reflector.
+
+    Example:
+        client = PerfClient(M16("/dev/ttyUSB0", diagnostic=True))
+        print(client.ping(count=10))
+    """
+
+    def ping(self, count: int = 10, timeout: float = DEFAULT_TIMEOUT,
+             duration: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Send pings one at a time and wait for each reflection.
+
+        Parameters:
+            count (int): Number of pings (default 10).
+            timeout (float): Seconds to wait for a reflection after the ping was sent (default DEFAULT_TIMEOUT).
+            duration (float, optional): Stop sending after this many seconds, even if count is not reached.
+
+        Returns:
+            Dict[str, Any]: Pings sent and answered, the loss, the round trip times in seconds with their minimum,
+                            mean and maximum and the link quality of the reflections.
+        """
+        end = None if duration is None else self.clock.time() + duration
+        rtts: List[float] = []
+        reports = []
+        sent = 0
+        for number in range(count):
+            if end is not None and self.clock.time() >= end:
+                break
+            value = sequence_character(number)
+            self._received.clear()
+            start = self.send_block(PING + value)
+            sent += 1
+            deadline = start + timeout
+            while True:
+                received = self.receive_block(deadline - self.clock.time())
+                if received is None:
+                    self.logger.info(f"Ping {number} lost")
+                    break
+                block, time, report = received
+                if block == (PONG + value).encode("ascii"):
+                    rtts.append(time - start)
+                    reports.append(report)
+                    break
+        result = {"sent": sent, "received": len(rtts), "loss": 1 - len(rtts) / sent if sent else None, "rtt": rtts}
+        result.update(_summary(rtts, "rtt"))
+        result.update(self._link_quality(reports))
+        return result
+
+    def stream(self, duration: float = 60.0, count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Send numbered blocks back to back, the reflector measures what arrives.
+
+        Parameters:
+            duration (float): Seconds to send for (default 60).
+            count (int, optional): Stop after this many blocks.
+
+        Returns:
+            Dict[str, Any]: Blocks sent, the time it took and the offered rate in bits per second.
+        """
+        start = self.clock.time()
+        sent = 0
+        while self.clock.time() - start < duration and (count is None or sent < count):
+            self.send_block(STREAM + sequence_character(sent))
+            sent += 1
+        elapsed = self.clock.time() - start
+        self.send_block(STREAM_END + sequence_character(sent))
+        return {"sent": sent, "duration": elapsed, "offered_bps": 16 * sent / elapsed if elapsed > 0 else None}
+
+    def set_channel(self, channel: int, timeout: float = DEFAULT_TIMEOUT, retries: int = 3) -> bool:
+        """
+        Move both ends to another channel.
+
+        Returns:
+            bool: True if the reflector confirmed the change, otherwise both stay on the current channel.
+        """
+        value = CHANNEL_CHARACTERS[channel - 1]
+        for _ in range(retries):
+            self._received.clear()
+            start = self.send_block(CHANNEL + value)
+            while True:
+                received = self.receive_block(start + timeout - self.clock.time())
+                if received is None:
+                    break
+                if received[0] == (CHANNEL_ACK + value).encode("ascii"):
+                    self.modem.set_channel(channel)
+                    return True
+        self.logger.warning(f"The reflector did not confirm channel {channel}")
+        return False
+
+    def sweep(self, channels: List[int], levels: List[int], count: int = 5,
+              timeout: float = DEFAULT_TIMEOUT) -> List[Dict[str, Any]]:
+        """
+        Ping at every combination of channel and power level of this end.
+
+        Returns:
+            List[Dict[str, Any]]: The ping results of every combination with its channel and level, channels the
+                                  reflector could not be moved to are left out.
+        """
+        results = []
+        for channel in channels:
+            if channel != self.modem.channel and not self.set_channel(channel, timeout):
+                continue
+            for level in levels:
+                self.modem.set_level(level)
+                result = {"channel": channel, "level": level}
+                result.update(self.ping(count, timeout))
+                results.append(result)
+        return results
+
+
+def emulated_pair(distance: float = 500.0, noise_level: float = 90.0, seed: Optional[int] = None,
+                  channel: int = 1, level: int = 4) -> Tuple[VirtualClock, M16, M16]:
+    """
+    Two emulated modems in an acoustic medium running in simulated time, for running tests without hardware.
+
+    Returns:
+        Tuple[VirtualClock, M16, M16]: The clock and the modems for the client and the reflector.
+    """
+    from m16_emulator import M16Emulator
+    from m16_medium import AcousticMedium
+
+    # Only threads registered with clock.actor() count, see run_test()
+    clock = VirtualClock(actors=0)
+    medium = AcousticMedium(noise_level=noise_level, seed=seed)
+    modems = []
+    for position in ((0.0, 0.0, 10.0), (distance, 0.0, 10.0)):
+        emulator = M16Emulator(clock, channel=channel, level=level, diagnostic=True)
+        medium.attach(emulator, position)
+        modems.append(M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock))
+    for modem in modems:
+        modem.channel, modem.level, modem.diagnostic = channel, level, True
+    return clock, modems[0], modems[1]
+
+
+def run_test(test: Callable[[PerfClient], Any], client_modem: M16,
+             reflector_modem: Optional[M16] = None) -> Dict[str, Any]:
+    """
+    Run a test with a PerfClient, and a Reflector in a second thread when both modems are connected to this host.
+
+    Parameters:
+        test (Callable[[PerfClient], Any]): Runs the test, e.g. lambda client: client.ping(10).
+        client_modem (M16): The modem running the test.
+        reflector_modem (M16, optional): The other modem, if it is connected here.
+
+    Returns:
+        Dict[str, Any]: "client" with the result of the test and, with a local reflector, "reflector" with the
+                        streams it received.
+    """
+    client = PerfClient(client_modem)
+    results: Dict[str, Any] = {}
+    if reflector_modem is None:
+        results["client"] = test(client)
+        client.close()
+        return results
+
+    reflector = Reflector(reflector_modem)
+    stop = threading.Event()
+    clock = client_modem.clock
+
+    def run_client():
+        try:
+            results["client"] = test(client)
+        finally:
+            stop.set()
+
+    tasks = [run_client, lambda: reflector.run(stop=stop)]
+    if isinstance(clock, VirtualClock):
+        # Both ends are actors of the simulated clock, time only moves on when both wait
+        registered = threading.Barrier(len(tasks))
+
+        def actor(task):
+            with clock.actor():
+                registered.wait()
+                task()
+        threads = [threading.Thread(target=actor, args=(task,)) for task in tasks]
+    else:
+        threads = [threading.Thread(target=task) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results["reflector"] = reflector.streams
+    client.close()
+    reflector.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure round trip time, goodput and loss between two M16 modems.")
+    parser.add_argument("mode", choices=["reflect", "ping", "stream", "sweep"],
+                        help="reflect on the far end, or the test to run against it")
+    parser.add_argument("port", nargs="?", help='Serial port of the modem (e.g. "COM3" or "/dev/ttyUSB0")')
+    parser.add_argument("--peer", help="Serial port of the far end modem if it is connected to this host as well, "
+                                       "a reflector is then run on it")
+    parser.add_argument("--emulator", action="store_true",
+                        help="Run both ends on emulated modems in simulated time instead of hardware")
+    parser.add_argument("--distance", type=float, default=500.0, help="Distance in metres with --emulator")
+    parser.add_argument("--noise", type=float, default=90.0, help="Noise level in dB with --emulator")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed with --emulator")
+    parser.add_argument("--channel", type=int, default=1, help="Channel (default 1)")
+    parser.add_argument("--level", type=int, default=4, help="Power level (default 4)")
+    parser.add_argument("--count", type=int, default=10, help="Pings, or pings at each point of a sweep")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to stream or reflect")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds to wait for a reflection")
+    parser.add_argument("--channels", type=int, nargs="+", default=None, help="Channels of a sweep")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3, 4], help="Power levels of a sweep")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    arguments = parser.parse_args()
+
+    if arguments.emulator:
+        _, modem, peer = emulated_pair(arguments.distance, arguments.noise, arguments.seed,
+                                       arguments.channel, arguments.level)
+    elif arguments.port is None:
+        parser.error("a port is needed without --emulator")
+    else:
+        modem = M16(arguments.port, channel=arguments.channel, level=arguments.level, diagnostic=True)
+        peer = (M16(arguments.peer, channel=arguments.channel, level=arguments.level, diagnostic=True)
+                if arguments.peer else None)
+
+    if arguments.mode == "reflect":
+        reflector = Reflector(modem)
+        reflector.run(arguments.duration)
+        output = {"reflector": reflector.streams}
+    else:
+        tests = {
+            "ping": lambda client: client.ping(arguments.count, arguments.timeout),
+            "stream": lambda client: client.stream(arguments.duration),
+            "sweep": lambda client: client.sweep(arguments.channels or [arguments.channel], arguments.levels,
+                                                 arguments.count, arguments.timeout),
+        }
+        output = run_test(tests[arguments.mode], modem, peer)
+    output["settings"] = {key: value for key, value in vars(arguments).items() if key != "output"}
+
+    text = json.dumps(output, indent=4)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(text)
+    print(text)
@@ -0,0 +1,367 @@
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Callable, List, Iterable
+
+from m16_address import AddressFilter, is_group
+from m16_driver import M16
+from m16_frame import Frame, FrameDecoder
+
+
+class RelayEngine:
+    """
+    Store-and-forward relay for multi-hop links between nodes out of each other's acoustic range.
+
+    Frames (see m16_frame.Frame) addressed to this node are delivered to the host, frames for other nodes are
+    sent on to the next hop from the routing table. With a separate transmit modem (e.g. on another channel)
+    forwarding is pipelined: as soon as the header has arrived, the next hop is chosen and every block is sent on
+    while the following one is still arriving, so every hop adds the time of the three header blocks instead
+    of the time of the whole message. With one modem, which cannot receive while transmitting, whole frames are
+    forwarded once their checksum is verified.
+
+    Copies of a message already forwarded or delivered are dropped using a cache of (origin, message id),
+    so routing loops and repeated broadcasts die out. Message ids are 7 bits and reused, so only the last
+    DEDUP_WINDOW ids of every origin received within DEDUP_AGE seconds are remembered.
+
+    The engine installs an m16_address.AddressFilter on the receiving modem, so frames whose link destination is
+    another node are dropped before they reach the frame decoder. Frames for the broadcast address or a joined
+    group are delivered, and forwarded only if the routing table has an entry for that address.
+
+    Example:
+        relay = RelayEngine(2, rx_modem, tx_modem, routes={3: 3, 1: 1})
+        relay.start()
+    """
+    DEDUP_WINDOW = 64  # message ids remembered per origin, well below the 128 ids before they are reused
+    DEDUP_AGE = 600.0  # seconds after which a message id is forgotten
+
+    def __init__(self, node_id: int, rx_modem: M16, tx_modem: Optional[M16] = None,
+                 routes: Optional[Dict[int, int]] = None, default_route: Optional[int] = None,
+                 on_message: Optional[Callable[[Frame], None]] = None, groups: Iterable[int] = ()) -> None:
+        """
+        Parameters:
+            node_id (int): Address of this node (0 to m16_address.MAX_UNICAST).
+            rx_modem (M16): Modem receiving frames.
+            tx_modem (M16, optional): Modem sending frames, defaults to rx_modem (store-and-forward).
+            routes (Dict[int, int], optional): Next hop for each destination, destinations not in the
+                                               table are sent directly.
+            default_route (int, optional): Next hop for destinations not in the routing table, instead of
+                                           sending them directly.
+            on_message (Callable[[Frame], None], optional): Called with every frame delivered to this node.
+            groups (Iterable[int]): Multicast groups this node receives.
+        """
+        self.node_id = node_id
+        self.rx_modem = rx_modem
+        self.tx_modem = tx_modem if tx_modem is not None else rx_modem
+        self.pipelined = self.tx_modem is not rx_modem
+        self.routes = dict(routes or {})
+        self.default_route = default_route
+        self.on_message = on_message
+        self.logger = logging.getLogger(__name__)
+
+        self.messages: "queue.Queue[Frame]" = queue.Queue()  # Frames delivered to this node
+        self._message_condition = rx_modem.clock.condition()
+        self.decoder = FrameDecoder()
+        self.address_filter = AddressFilter(node_id, groups)
+        # Recent message ids sent on and delivered, with the time they were seen, for every origin
+        self.forwarded_keys: "Dict[int, OrderedDict[int, float]]" = {}
+        self.delivered_keys: "Dict[int, OrderedDict[int, float]]" = {}
+        self.lock = threading.Lock()
+        self._outbox = deque()  # Blocks waiting to be sent
+        self._outbox_condition = self.tx_modem.clock.condition()
+        self._sending = False  # A block taken from the outbox is being sent
+        self._forwarding = False  # Blocks of the current frame are being forwarded
+        self._lost_blocks = 0  # address_filter.lost_blocks already passed to the decoder
+        self._message_id = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        # Statistics
+        self.sent = 0
+        self.delivered = 0
+        self.forwarded = 0
+        self.duplicates = 0
+        self.no_route = 0
+        self.corrupt = 0
+        self.blocks_forwarded = 0
+
+        rx_modem.address_filter = self.address_filter
+        rx_modem.add_listener(self.on_packet)
+
+    def next_hop(self, destination: int) -> Optional[int]:
+        """
+        The node to send a frame for the destination to, None if it is not sent on.
+        """
+        if destination in self.routes:
+            return self.routes[destination]
+        if destination == self.node_id or is_group(destination):
+            return None
+        return self.default_route if self.default_route is not None else destination
+
+    def send(self, destination: int, payload: bytes) -> Frame:
+        """
+        Queue a new message from this node.
+
+        Parameters:
+            destination (int): The node the message is for.
+            payload (bytes): ASCII payload of at most m16_frame.MAX_PAYLOAD bytes.
+
+        Returns:
+            Frame: The frame queued for sending.
+        """
+        with self.lock:
+            message_id = self._message_id
+            self._message_id = (self._message_id + 1) % 128
+            self.sent += 1
+            next_hop = self.next_hop(destination)
+            frame = Frame(destination, self.node_id, message_id, payload,
+                          destination if next_hop is None else next_hop, self.node_id)
+            self._remember(self.forwarded_keys, frame.key)
+        for block in frame.blocks():
+            self._queue_block(block)
+        return frame
+
+    @property
+    def next_message_id(self) -> int:
+        """
+        Message id of the next message sent by send(). It can be set to continue the ids used before a restart,
+        which the receivers still have in their duplicate caches.
+        """
+        return self._message_id
+
+    @next_message_id.setter
+    def next_message_id(self, message_id: int) -> None:
+        with self.lock:
+            self._message_id = message_id % 128
+
+    def _remember(self, cache: Dict[int, OrderedDict], key: tuple) -> bool:
+        """
+        Add a message to a dedup cache, returns False if it was already there.
+        """
+        origin, message_id = key
+        now = self.rx_modem.clock.time()
+        ids = cache.setdefault(origin, OrderedDict())
+        while ids and now - next(iter(ids.values())) > self.DEDUP_AGE:
+            ids.popitem(last=False)
+        known = message_id in ids
+        ids.pop(message_id, None)
+        ids[message_id] = now
+        if len(ids) > self.DEDUP_WINDOW:
+            ids.popitem(last=False)
+        return not known
+
+    def _forget(self, cache: Dict[int, OrderedDict], key: tuple) -> None:
+        """
+        Remove a message from a dedup cache.
+        """
+        origin, message_id = key
+        cache.get(origin, {}).pop(message_id, None)
+
+    def on_packet(self, packet: bytes) -> None:
+        """
+        Listener for everything read from the receiving modem, feeds received blocks to the frame decoder.
+        Diagnostic reports carry one block (TB_VALID), in transparent mode the received bytes come as they are.
+        Blocks the address filter found lost in frames it passes on keep their place in the decoder.
+        """
+        report = M16.decode_packet(packet)
+        if report is not None:
+            while self._lost_blocks < self.address_filter.lost_blocks:
+                self._lost_blocks += 1
+                event = self.decoder.skip(self.rx_modem.clock.time())
+                if event is not None:
+                    self._handle(event, self.decoder.frame)
+            if report["TB_VALID"] and not report["TX_COMPLETE"]:
+                self.on_block(report["TR_BLOCK"])
+            return
+        for event, frame in self.decoder.feed_bytes(packet, self.rx_modem.clock.time()):
+            self._handle(event, frame)
+
+    def on_block(self, block: bytes) -> None:
+        """
+        Handle one received block.
+        """
+        event = self.decoder.feed(block, self.rx_modem.clock.time())
+        if event is not None:
+            self._handle(event, self.decoder.frame)
+
+    def _handle(self, event: str, frame: Optional[Frame]) -> None:
+        with self.lock:
+            if event == "header":
+                self._forwarding = False
+                if not self.address_filter.accepts(frame.next_hop):
+                    return  # Overheard a link to another node
+                if self.pipelined:
+                    self._start_forwarding(frame)
+            elif event == "payload":
+                if self._forwarding:
+                    self._forward_block(self.decoder.block)
+            elif event == "corrupt":
+                self.corrupt += 1
+                if self._forwarding and frame is not None:
+                    # The copy sent on is corrupt too, let a retransmission through
+                    self._forward_block(self.decoder.block)
+                    self._forget(self.forwarded_keys, frame.key)
+                self._forwarding = False
+            elif event == "frame":
+                if self._forwarding:
+                    self._forward_block(self.decoder.block)
+                    self._forwarding = False
+                elif not self.address_filter.accepts(frame.next_hop):
+                    return
+                elif not self.pipelined:
+                    self._store_and_forward(frame)
+                if self.address_filter.accepts(frame.destination):
+                    self._deliver(frame)
+
+    def _route(self, frame: Frame) -> Optional[int]:
+        """
+        The next hop for a received frame, None if it is not sent on.
+        """
+        next_hop = self.next_hop(frame.destination)
+        if next_hop is None:
+            if not self.address_filter.accepts(frame.destination):
+                self.no_route += 1
+            return None
+        if next_hop == frame.sender:
+            self.no_route += 1
+            return None
+        if not self._remember(self.forwarded_keys, frame.key):
+            self.duplicates += 1
+            return None
+        return next_hop
+
+    def _start_forwarding(self, frame: Frame) -> None:
+        next_hop = self._route(frame)
+        if next_hop is None:
+            return
+        self._forwarding = True
+        self.forwarded += 1
+        # Rewrite the link header, the rest of the header is sent as received
+        header = bytes([next_hop, self.node_id]) + bytes(self.decoder.data[2:6])
+        for i in range(0, len(header), 2):
+            self._forward_block(header[i:i+2])
+
+    def _store_and_forward(self, frame: Frame) -> None:
+        next_hop = self._route(frame)
+        if next_hop is None:
+            return
+        self.forwarded += 1
+        frame.next_hop, frame.sender = next_hop, self.node_id
+        for block in frame.blocks():
+            self._forward_block(block)
+
+    def _forward_block(self, block: bytes) -> None:
+        self.blocks_forwarded += 1
+        self._queue_block(block)
+
+    def _queue_block(self, block: bytes) -> None:
+        with self._outbox_condition:
+            self._outbox.append(bytes(block))
+            # flush() waits on the same condition, wake the sender as well
+            self._outbox_condition.notify_all()
+
+    def _deliver(self, frame: Frame) -> None:
+        if not self._remember(self.delivered_keys, frame.key):
+            self.duplicates += 1
+            return
+        self.delivered += 1
+        with self._message_condition:
+            self.messages.put(frame)
+            self._message_condition.notify_all()
+        if self.on_message is not None:
+            try:
+                self.on_message(frame)
+            except Exception as e:
+                self.logger.warning(f"Message callback failed: {e}")
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        Wait for the next frame delivered to this node, measuring the timeout with the modem's clock.
+
+        Parameters:
+            timeout (float, optional): Seconds to wait, by default without limit.
+
+        Returns:
+            Optional[Frame]: The frame, or None if none arrived in time.
+        """
+        with self._message_condition:
+            if not self._message_condition.wait_for(lambda: not self.messages.empty(), timeout):
+                return None
+            return self.messages.get_nowait()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all queued blocks have been sent.
+
+        Returns:
+            bool: True if the queue is empty, False if the timeout expired first.
+        """
+        with self._outbox_condition:
+            return self._outbox_condition.wait_for(lambda: not self._outbox and not self._sending, timeout)
+
+    def start(self, read: bool = True) -> None:
+        """
+        Start sending queued blocks and, if read is True, reading the receiving modem in background threads.
+        Use read=False when another thread already calls read_packet() on the receiving modem.
+        """
+        self._stop.clear()
+        targets = [self.send_loop] + ([self.read_loop] if read else [])
+        self._threads = [threading.Thread(target=target, daemon=True) for target in targets]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background threads, blocks not yet sent stay queued.
+        """
+        self._stop.set()
+        with self._outbox_condition:
+            self._outbox_condition.notify_all()
+        for thread in self._threads:
+            thread.join(5)
+        self._threads = []
+
+    def read_loop(self) -> None:
+        """
+        Read the receiving modem until stop() is called, run in a thread by start().
+        """
+        self.rx_modem.background_reader = True
+        try:
+            while not self._stop.is_set():
+                self.rx_modem.read_packet(timeout=0.2)
+        finally:
+            self.rx_modem.background_reader = False
+
+    def send_loop(self) -> None:
+        """
+        Send queued blocks until stop() is called, run in a thread by start().
+        """
+        while True:
+            with self._outbox_condition:
+                self._outbox_condition.wait_for(lambda: self._outbox or self._stop.is_set())
+                if self._stop.is_set():
+                    return
+                block = self._outbox.popleft()
+                self._sending = True
+            try:
+                self.tx_modem.send_msg(block.decode("ascii"))
+            finally:
+                with self._outbox_condition:
+                    self._sending = False
+                    self._outbox_condition.notify_all()
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Counts of frames delivered, forwarded and dropped.
+        """
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "delivered": self.delivered,
+                "forwarded": self.forwarded,
+                "duplicates": self.duplicates,
+                "no_route": self.no_route,
+                "corrupt": self.corrupt,
+                "blocks_forwarded": self.blocks_forwarded,
+                "queued_blocks": len(self._outbox),
+            }
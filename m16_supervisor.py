@@ -0,0 +1,265 @@
+import serial
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Union
+
+from m16_clock import SystemClock, VirtualClock
+from m16_driver import M16
+from m16_transport import Transport, open_transport, transport_available
+
+
+class _CommandInterrupted(Exception):
+    """
+    The connection was restored in the middle of a command, the command is sent again from its first character.
+    """
+
+
+class SupervisedM16(M16):
+    """
+    M16 that survives the serial port disappearing, e.g. when the USB-serial adapter is unplugged.
+
+    When reading or writing fails, the port is reopened with backoff as soon as the device path reappears
+    (URLs are reconnected to directly, a Transport object given as port cannot be reopened).
+    The modem is then probed with a report and only the settings that differ from the state before the
+    connection was lost (channel, level and mode) are set again. A command or block interrupted by the lost
+    connection is sent again from its first character, the modem has lost the characters sent before. Messages
+    are sent from a queue of blocks, so a message interrupted by a lost connection continues from the block that
+    failed.
+    """
+    MIN_BACKOFF = 0.1  # seconds before the first reconnection attempt
+    PROBE_TIMEOUT = 3.0  # seconds to wait for a report after reconnecting
+
+    def __init__(self, port: Union[str, Transport], baudrate: int = 9600, channel: Optional[int] = 1, level: Optional[int] = 4,
+                 diagnostic: Optional[bool] = False, timeout: float = 0.5, max_backoff: float = 5.0,
+                 reconnect_timeout: Optional[float] = None,
+                 on_connection_change: Optional[Callable[[bool], None]] = None,
+                 clock: Optional[Union[SystemClock, VirtualClock]] = None) -> None:
+        """
+        Initialize the modem connection, see M16.__init__().
+
+        Parameters:
+            max_backoff (float): Maximum time (in seconds) between reconnection attempts (default 5).
+            reconnect_timeout (float, optional): Give up reconnecting after this many seconds and raise the
+                                                 error, by default it keeps trying.
+            on_connection_change (Callable, optional): Called with False when the connection is lost and
+                                                       with True when it is restored.
+            clock (SystemClock | VirtualClock, optional): Clock used for all waiting, defaults to real time.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.reconnect_timeout = reconnect_timeout
+        self.on_connection_change = on_connection_change
+        self.pending_blocks = deque()  # Blocks of messages not yet sent
+        self.reconnects = 0
+        self._reconnect_lock = threading.RLock()
+        self._reconnecting = False
+        self._connection_generation = 0
+        self._commands = threading.local()  # Depth of the commands run by _command() in each thread
+        self._probing_thread: Optional[int] = None  # Thread reading the port alone while probing a new connection
+        super().__init__(port, baudrate, channel, level, diagnostic, timeout, clock)
+
+    def send_data(self, data: str) -> int | None:
+        generation = self._connection_generation
+        try:
+            return super().send_data(data)
+        except (serial.SerialException, OSError) as e:
+            self.reconnect(generation, e)
+            self._check_interrupted()
+            return super().send_data(data)
+
+    def _check_interrupted(self) -> None:
+        """
+        Raise _CommandInterrupted if the connection was restored while running a command, the rest of the
+        command on its own would be stray characters for the modem.
+        """
+        if getattr(self._commands, "depth", 0):
+            raise _CommandInterrupted()
+
+    def _command(self, method: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a method of M16 sending a command or block, sending it again from the start if the connection is
+        restored in the middle of it.
+        """
+        self._commands.depth = getattr(self._commands, "depth", 0) + 1
+        try:
+            while True:
+                try:
+                    return method(*args)
+                except _CommandInterrupted:
+                    if self._commands.depth > 1:
+                        raise
+                    self.logger.info(f"Connection restored during {method.__name__}, sending it again")
+        finally:
+            self._commands.depth -= 1
+
+    def set_channel(self, channel: int) -> bool:
+        return self._command(super().set_channel, channel)
+
+    def set_level(self, level: int) -> bool:
+        return self._command(super().set_level, level)
+
+    def set_diagnostic_mode(self) -> None:
+        self._command(super().set_diagnostic_mode)
+
+    def reset_diagnostic_mode(self) -> None:
+        self._command(super().reset_diagnostic_mode)
+
+    def toggle_mode(self) -> None:
+        self._command(super().toggle_mode)
+
+    def get_report(self) -> None:
+        self._command(super().get_report)
+
+    def send_two_bytes(self, data: str) -> (int | None):
+        return self._command(super().send_two_bytes, data)
+
+    def _request_new_report(self, after: int, deadline: float) -> Optional[Dict[str, Any]]:
+        return self._command(super()._request_new_report, after, deadline)
+
+    def _read_packet(self, timeout_duration: float) -> Optional[bytes]:
+        generation = self._connection_generation
+        try:
+            return super()._read_packet(timeout_duration)
+        except (serial.SerialException, OSError) as e:
+            self.reconnect(generation, e)
+            self._check_interrupted()
+            return super()._read_packet(timeout_duration)
+
+    def reconnect(self, generation: Optional[int] = None, error: Optional[Exception] = None) -> None:
+        """
+        Reopen the port and restore the modem configuration.
+        Several threads may notice the lost connection at once, only the first one reconnects.
+
+        Parameters:
+            generation (int, optional): The connection generation the caller was using, if the connection has
+                                        been restored since then nothing is done.
+            error (Exception, optional): The error that was raised by the lost connection.
+        """
+        # Take the command lock first, a thread sending a command may be reconnecting already.
+        with self.command_lock, self._reconnect_lock:
+            if generation is not None and generation != self._connection_generation:
+                return
+            if self._reconnecting:
+                # Failed while probing the new connection, let the reconnection loop handle it.
+                raise error if error is not None else serial.SerialException("Connection lost while reconnecting")
+            self._reconnecting = True
+            try:
+                self._reconnect(error)
+            finally:
+                self._reconnecting = False
+
+    def _reconnect(self, error: Optional[Exception]) -> None:
+        """
+        Reopen the port with backoff until the modem answers, then restore the lost configuration.
+        """
+        wanted = {"channel": self.channel, "level": self.level, "diagnostic": self.diagnostic}
+        self.logger.warning(f"Lost connection to {self.port}: {error}")
+        if self.on_connection_change is not None:
+            self.on_connection_change(False)
+
+        start_time = self.clock.time()
+        backoff = self.MIN_BACKOFF
+        while True:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+
+            if transport_available(self.port):
+                try:
+                    self.ser = open_transport(self.port, self.baudrate, self.timeout)
+                    self._restore(wanted, self._probe())
+                    break
+                except (serial.SerialException, OSError, ValueError) as e:
+                    # ValueError: the device path disappeared again before it was opened
+                    self.logger.info(f"Reconnection to {self.port} failed: {e}")
+
+            if self.reconnect_timeout is not None and self.clock.time() - start_time > self.reconnect_timeout:
+                raise serial.SerialException(f"Could not reconnect to {self.port} within "
+                                             f"{self.reconnect_timeout} seconds")
+            self.clock.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        self._connection_generation += 1
+        self.reconnects += 1
+        self.logger.info(f"Reconnected to {self.port} after {self.clock.time() - start_time:.1f} seconds")
+        if self.on_connection_change is not None:
+            self.on_connection_change(True)
+
+    def _reader_elsewhere(self) -> bool:
+        # Set under command_lock by _probe(), read without it: the caller holds report_condition,
+        # which the probing thread needs to record the report
+        probing_thread = self._probing_thread
+        if probing_thread is not None:
+            return probing_thread != threading.get_ident()
+        return super()._reader_elsewhere()
+
+    def _probe(self) -> Optional[Dict[str, Any]]:
+        """
+        Request a report on the new connection. The reconnecting thread reads the port itself, since the thread
+        that normally reads it may be the one reconnecting, and other threads waiting for a report wait for it.
+        """
+        with self.command_lock:
+            self._probing_thread = threading.get_ident()
+            try:
+                report = self._request_new_report(self.report_sequence, self.clock.time() + self.PROBE_TIMEOUT)
+            finally:
+                self._probing_thread = None
+        if report is not None:
+            self.update_state_from_report(report)
+        return report
+
+    def _restore(self, wanted: Dict[str, Any], report: Optional[Dict[str, Any]]) -> None:
+        """
+        Set the channel, level and mode that differ between the probe report and the wanted state.
+        If the probe did not return a report, everything known is set again.
+        """
+        if report is None:
+            self.logger.info("No report from the modem after reconnecting, restoring the full configuration")
+            self.configure(wanted["channel"], wanted["level"], wanted["diagnostic"])
+            return
+
+        channel = wanted["channel"] if wanted["channel"] not in (None, self.channel) else None
+        level = wanted["level"] if wanted["level"] not in (None, self.level) else None
+        diagnostic = wanted["diagnostic"] if wanted["diagnostic"] not in (None, self.diagnostic) else None
+        if channel is None and level is None and diagnostic is None:
+            self.logger.info("Modem configuration unchanged after reconnecting")
+            return
+        self.logger.info(f"Restoring modem configuration: channel: {channel}, level: {level}, "
+                         f"diagnostic: {diagnostic}")
+        self.configure(channel, level, diagnostic)
+
+    def send_msg(self, msg: str, timeout_per_chunk: float = 5.0) -> (int | None):
+        """
+        Queue a message and send it in 2-byte chunks, see M16.send_msg().
+        If the connection is lost, sending continues from the block that failed once it is restored.
+        If reconnecting fails, the unsent blocks are dropped and the error is raised.
+        """
+        if len(msg) % 2 != 0:
+            msg = msg + " "
+        with self.command_lock:
+            self.pending_blocks.extend(msg[i:i+2] for i in range(0, len(msg), 2))
+            return self.resume(timeout_per_chunk)
+
+    def resume(self, timeout_per_chunk: float = 5.0) -> (int | None):
+        """
+        Send the blocks left in pending_blocks, they are dropped if reconnecting fails.
+
+        Parameters:
+            timeout_per_chunk (float): Maximum time (in seconds) to wait for TX_COMPLETE
+                                       after sending each 2-byte chunk (diagnostic mode only).
+        """
+        sent_char = None
+        with self.command_lock:
+            try:
+                while self.pending_blocks:
+                    sent_char = super().send_msg(self.pending_blocks[0], timeout_per_chunk)
+                    self.pending_blocks.popleft()
+            except (serial.SerialException, OSError):
+                # The rest of the message must not be sent before the next one
+                self.logger.warning(f"Dropping {len(self.pending_blocks)} unsent blocks")
+                self.pending_blocks.clear()
+                raise
+        return sent_char
@@ -0,0 +1,220 @@
+import math
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, Union
+
+from m16_clock import SystemClock, VirtualClock
+from m16_driver import M16
+
+
+class TdmaScheduler:
+    """
+    Time division for several modems sharing a channel. Time is divided into repeating frames of `slots` slots
+    and every node only transmits in its own slot, so blocks from different nodes never collide.
+
+    A slot holds blocks_per_slot blocks of BLOCK_AIRTIME seconds, followed by the time sound needs to travel
+    max_range metres and a guard time for clock errors. A block is only started if it ends, including the
+    propagation delay, before the next slot starts.
+
+    All nodes use the frame start of the beacon node, which has slot 0 and sends a beacon block at the start of
+    every frame it transmits in. The other nodes set their frame start from the time the beacon is received.
+    Beacons are recognised in the diagnostic reports (TB_VALID) of the receiving modem, so the modem must be in
+    diagnostic mode and read continuously (e.g. by a background reader) for the frame start to follow the beacon.
+
+    Example:
+        tdma = TdmaScheduler(slot=2, slots=4, max_range=500)
+        tdma.attach(modem)
+        modem.send_msg("Hello")  # Blocks are only sent in slot 2
+    """
+    SOUND_SPEED = 1500.0  # m/s
+    BLOCK_AIRTIME = 2.0  # seconds to transmit one block
+    BEACON_BLOCK = "*T"  # Block sent by the beacon node at the start of a frame
+    USED_FRAMES_KEPT = 16  # Recent frames remembered to count each used frame once
+
+    def __init__(self, slot: int, slots: int, max_range: float = 500.0, guard: float = 0.5,
+                 blocks_per_slot: int = 1, beacon: bool = False, beacon_range: float = 0.0,
+                 epoch: float = 0.0, clock: Optional[Union[SystemClock, VirtualClock]] = None) -> None:
+        """
+        Parameters:
+            slot (int): This node's slot, 0 to slots - 1. The beacon node has slot 0.
+            slots (int): Number of slots in a frame.
+            max_range (float): Largest distance between two nodes in metres (default 500).
+            guard (float): Extra time at the end of each slot in seconds (default 0.5).
+            blocks_per_slot (int): Number of blocks that fit in a slot (default 1).
+            beacon (bool): True for the node whose clock defines the frame start (default False).
+            beacon_range (float): Distance to the beacon node in metres if known, used to correct the frame start
+                                  for the propagation delay of the beacon (default 0).
+            epoch (float): Start time of a frame on the clock until a beacon is received (default 0).
+            clock (SystemClock | VirtualClock, optional): Clock to use, by default the clock of the modem
+                                                          given to attach().
+        """
+        if not 0 <= slot < slots:
+            raise ValueError(f"Slot {slot} is not between 0 and {slots - 1}")
+        if beacon and slot != 0:
+            raise ValueError("The beacon node must have slot 0")
+        self.slot = slot
+        self.slots = slots
+        self.max_range = max_range
+        self.guard = guard
+        self.blocks_per_slot = blocks_per_slot
+        self.beacon = beacon
+        self.beacon_range = beacon_range
+        self.epoch = epoch
+        self.clock = clock if clock is not None else SystemClock()
+        self._use_modem_clock = clock is None
+        self.modem: Optional[M16] = None
+        self.lock = threading.Lock()
+
+        self.slot_length = blocks_per_slot * self.BLOCK_AIRTIME + max_range / self.SOUND_SPEED + guard
+        self.frame_length = slots * self.slot_length
+
+        # Statistics
+        self.start_time: Optional[float] = None  # Time of the first block sent or heard
+        self.blocks_sent = 0
+        self.wait_time = 0.0  # Seconds spent waiting for the own slot
+        self.own_slots_used = 0  # Frames in which this node sent at least one block
+        self.used_frames = deque(maxlen=self.USED_FRAMES_KEPT)  # The most recent of them
+        self.blocks_heard = [0] * slots  # Blocks received from other nodes in each slot
+        self.beacons_received = 0
+
+    def attach(self, modem: M16) -> None:
+        """
+        Make a modem send its blocks only in this node's slot and follow the beacon.
+        """
+        if self._use_modem_clock:
+            self.clock = modem.clock
+        self.modem = modem
+        modem.tdma = self
+        modem.add_listener(self.on_packet)
+
+    def detach(self) -> None:
+        """
+        Let the modem send whenever it wants again.
+        """
+        if self.modem is not None:
+            self.modem.tdma = None
+            self.modem.remove_listener(self.on_packet)
+            self.modem = None
+
+    def frame_start(self, time: float) -> float:
+        """
+        Start time of the frame containing the given time.
+        """
+        return self.epoch + math.floor((time - self.epoch) / self.frame_length) * self.frame_length
+
+    def slot_at(self, time: float) -> int:
+        """
+        The slot a given time falls in.
+        """
+        return int((time - self.frame_start(time)) // self.slot_length) % self.slots
+
+    def next_transmit_time(self, time: float) -> float:
+        """
+        Earliest time at or after the given time where a block fits in this node's slot.
+        """
+        frame = self.frame_start(time)
+        while True:
+            slot_start = frame + self.slot * self.slot_length
+            latest = slot_start + (self.blocks_per_slot - 1) * self.BLOCK_AIRTIME
+            if time <= latest:
+                return max(time, slot_start)
+            frame += self.frame_length
+
+    def wait_for_slot(self) -> float:
+        """
+        Wait until a block can be sent, called by the modem before every block.
+
+        Returns:
+            float: The time the block is sent.
+        """
+        now = self.clock.time()
+        send_time = self.next_transmit_time(now)
+        if send_time > now:
+            self.clock.sleep(send_time - now)
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = send_time
+            self.blocks_sent += 1
+            self.wait_time += send_time - now
+            frame = math.floor((send_time - self.epoch) / self.frame_length)
+            if frame not in self.used_frames:
+                self.used_frames.append(frame)
+                self.own_slots_used += 1
+        return send_time
+
+    def send_beacon(self) -> float:
+        """
+        Send a beacon at the start of the next frame, only on the beacon node.
+
+        Returns:
+            float: The time the beacon was sent.
+        """
+        if not self.beacon or self.modem is None:
+            raise RuntimeError("Only an attached beacon node sends beacons")
+        with self.modem.command_lock:
+            # The beacon is the first block of a frame
+            now = self.clock.time()
+            frame = self.frame_start(now)
+            start = frame if now <= frame else frame + self.frame_length
+            if start > now:
+                self.clock.sleep(start - now)
+            self.modem.send_two_bytes(self.BEACON_BLOCK)
+            return start
+
+    def on_packet(self, packet: bytes) -> None:
+        """
+        Listener for received packets, follows the beacon and counts the blocks heard in each slot.
+        """
+        report = M16.decode_packet(packet)
+        if report is None or not report["TB_VALID"] or report["TX_COMPLETE"]:
+            return
+        # The report arrives when the block has been received, the block started one airtime earlier
+        start = self._received_time(report) - self.BLOCK_AIRTIME
+        with self.lock:
+            if report["TR_BLOCK"] == self.BEACON_BLOCK.encode("ascii") and not self.beacon:
+                self.epoch = start - self.beacon_range / self.SOUND_SPEED
+                self.beacons_received += 1
+            if self.start_time is None:
+                self.start_time = start
+            self.blocks_heard[self.slot_at(start)] += 1
+
+    def _received_time(self, report: Dict[str, Any]) -> float:
+        """
+        The time the modem recorded the report, another thread may have read newer reports since then.
+        """
+        if self.modem is not None:
+            with self.modem.report_condition:
+                for _, received, recorded in reversed(self.modem.reports):
+                    if recorded == report:
+                        return received
+        return self.clock.time()
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Slot use since the first block sent or heard, for tuning the number of slots and their length.
+
+        Returns:
+            Dict[str, Any]: frames elapsed, own slots used and idle, blocks sent and heard per slot,
+                            the average wait for the own slot and the share of each slot's capacity in use.
+        """
+        with self.lock:
+            if self.start_time is None:
+                frames = 0
+            else:
+                frames = math.floor((self.clock.time() - self.start_time) / self.frame_length) + 1
+            used = self.own_slots_used
+            capacity = max(frames * self.blocks_per_slot, 1)
+            heard = list(self.blocks_heard)
+            heard[self.slot] = self.blocks_sent
+            return {
+                "slot_length": self.slot_length,
+                "frame_length": self.frame_length,
+                "frames": frames,
+                "own_slots_used": used,
+                "own_slots_idle": max(frames - used, 0),
+                "blocks_sent": self.blocks_sent,
+                "average_wait": self.wait_time / self.blocks_sent if self.blocks_sent else 0.0,
+                "blocks_per_slot": heard,
+                "slot_utilisation": [min(count / capacity, 1.0) for count in heard],
+                "beacons_received": self.beacons_received,
+            }
@@ -0,0 +1,227 @@
+import threading
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+from m16_clock import SystemClock, VirtualClock
+from m16_driver import M16
+
+
+class TimeSync:
+    """
+    Maps the modem's TIME counter onto the host clock, so received blocks and TX_COMPLETE are timestamped when they
+    happened in the modem instead of when the host polled the serial port.
+
+    Every diagnostic report carries the 24 bit TIME counter. Each report gives a pair of (modem time, host time the
+    report was read). The host time is always later than the modem time by the serial transfer and the polling
+    delay, so the mapping follows the lower envelope of the pairs: the drift is the least squares slope through the
+    pairs with the smallest delay in each part of the window, and the offset is chosen so no pair lies below the
+    line. The counter is unwrapped using the host clock, which also recognises a modem restart.
+
+    With two modems on the same host, e.g. on a test bench, one_way_latency() compares the end of transmission on
+    one modem with the end of reception on the other, which is the propagation delay plus the receiver's processing.
+
+    Example:
+        sync = TimeSync()
+        sync.attach(modem)
+        ...
+        print(sync.drift_ppm, sync.events[-1])
+    """
+    TIME_BITS = 24  # width of the TIME counter
+    TICKS_PER_SECOND = 1000.0  # rate of the TIME counter
+    WINDOW = 300  # pairs used for the mapping, 5 minutes of reports at one per second
+    MIN_DRIFT_SPAN = 30.0  # seconds covered by the pairs before the drift is estimated
+    SEGMENTS = 10  # parts of the window each giving one pair with the least delay for the drift
+    RESTART_TOLERANCE = 5.0  # seconds the clocks may disagree before the modem is taken as restarted
+    EVENT_HISTORY = 256  # number of timestamped events kept
+
+    def __init__(self, ticks_per_second: float = TICKS_PER_SECOND, window: int = WINDOW, report_delay: float = 0.0,
+                 clock: Optional[Union[SystemClock, VirtualClock]] = None) -> None:
+        """
+        Parameters:
+            ticks_per_second (float): Nominal rate of the TIME counter (default 1000).
+            window (int): Number of recent reports used for the mapping (default WINDOW).
+            report_delay (float): Known time from a report's TIME to the report being readable by the host, e.g.
+                                  0.019 s for 18 bytes at 9600 baud (default 0).
+            clock (SystemClock | VirtualClock, optional): Host clock, by default the clock of the modem given to
+                                                          attach().
+        """
+        if window < 2:
+            raise ValueError("The window must hold at least 2 reports")
+        self.ticks_per_second = ticks_per_second
+        self.report_delay = report_delay
+        self.clock = clock if clock is not None else SystemClock()
+        self._use_modem_clock = clock is None
+        self.modem: Optional[M16] = None
+        self.lock = threading.Lock()
+
+        self.samples: "deque[Tuple[float, float]]" = deque(maxlen=window)  # (modem seconds, host time)
+        self.slope = 1.0  # Host seconds per modem second
+        self.offset: Optional[float] = None  # Host time at modem time 0
+        self._last_ticks: Optional[int] = None  # Last unwrapped TIME
+        self._last_host: Optional[float] = None
+
+        # Timestamped events as (kind, host time, block), kind is "rx" for a received block and "tx" for TX_COMPLETE
+        self.events: "deque[Tuple[str, float, Optional[bytes]]]" = deque(maxlen=self.EVENT_HISTORY)
+        # Time from writing a block to the modem to its TX_COMPLETE, in seconds
+        self.transmit_delays: "deque[float]" = deque(maxlen=self.EVENT_HISTORY)
+
+        # Statistics
+        self.reports = 0
+        self.wraps = 0
+        self.restarts = 0
+
+    @property
+    def drift_ppm(self) -> float:
+        """
+        How much faster the modem counter runs than the host clock, in parts per million.
+        """
+        return (1 / self.slope - 1) * 1e6
+
+    def attach(self, modem: M16) -> None:
+        """
+        Follow the reports read from a modem, which must be in diagnostic mode.
+        """
+        if self._use_modem_clock:
+            self.clock = modem.clock
+        self.modem = modem
+        modem.add_listener(self.on_packet)
+
+    def detach(self) -> None:
+        if self.modem is not None:
+            self.modem.remove_listener(self.on_packet)
+            self.modem = None
+
+    def on_packet(self, packet: bytes) -> None:
+        """
+        Listener for read packets, adds every report to the mapping and timestamps received blocks and TX_COMPLETE.
+        """
+        report = M16.decode_packet(packet)
+        if report is None:
+            return
+        received = self.clock.time()
+        with self.lock:
+            modem_time = self._add(report["TIME"], received)
+            if report["TX_COMPLETE"]:
+                time = self._to_host(modem_time)
+                self.events.append(("tx", time, None))
+                if self.modem is not None and self.modem.last_send_time is not None:
+                    self.transmit_delays.append(time - self.modem.last_send_time)
+            elif report["TB_VALID"]:
+                self.events.append(("rx", self._to_host(modem_time), report["TR_BLOCK"]))
+
+    def add(self, ticks: int, host_time: float) -> float:
+        """
+        Add a pair of TIME and the host time the report was read, e.g. from a recorded session.
+
+        Returns:
+            float: The host time the report was sent by the modem.
+        """
+        with self.lock:
+            return self._to_host(self._add(ticks, host_time))
+
+    def _add(self, ticks: int, host_time: float) -> float:
+        """
+        Unwrap the counter, update the mapping and return the modem time in seconds.
+        """
+        self.reports += 1
+        host_time -= self.report_delay
+        wrap = 1 << self.TIME_BITS
+        if self._last_ticks is None:
+            unwrapped = ticks
+        else:
+            # The host clock tells how far the counter has moved, and so how many times it wrapped
+            expected = self._last_ticks + (host_time - self._last_host) * self.ticks_per_second / self.slope
+            unwrapped = ticks + wrap * round((expected - ticks) / wrap)
+            if abs(unwrapped - expected) > self.RESTART_TOLERANCE * self.ticks_per_second:
+                # The counter jumped, the modem was restarted and the old pairs no longer apply
+                self.restarts += 1
+                self.samples.clear()
+                self.slope = 1.0
+                unwrapped = ticks
+            elif unwrapped // wrap > self._last_ticks // wrap:
+                self.wraps += 1
+        self._last_ticks = unwrapped
+        self._last_host = host_time
+
+        modem_time = unwrapped / self.ticks_per_second
+        self.samples.append((modem_time, host_time))
+        self._fit()
+        return modem_time
+
+    def _fit(self) -> None:
+        samples = list(self.samples)
+        if samples[-1][0] - samples[0][0] >= self.MIN_DRIFT_SPAN:
+            # The pair with the least delay in each segment of the window lies close to the lower envelope,
+            # the drift is the least squares slope through them
+            size = -(-len(samples) // self.SEGMENTS)
+            points = [min(samples[i:i + size], key=lambda s: s[1] - s[0]) for i in range(0, len(samples), size)]
+            mean_modem = sum(modem for modem, _ in points) / len(points)
+            mean_host = sum(host for _, host in points) / len(points)
+            variance = sum((modem - mean_modem) ** 2 for modem, _ in points)
+            self.slope = sum((modem - mean_modem) * (host - mean_host) for modem, host in points) / variance
+        self.offset = min(host - self.slope * modem for modem, host in samples)
+
+    def _to_host(self, modem_time: float) -> float:
+        return self.offset + self.slope * modem_time
+
+    def host_time(self, ticks: int) -> Optional[float]:
+        """
+        The host time of a TIME value close to the last report, None before the first report.
+        """
+        with self.lock:
+            if self._last_ticks is None:
+                return None
+            wrap = 1 << self.TIME_BITS
+            unwrapped = ticks + wrap * round((self._last_ticks - ticks) / wrap)
+            return self._to_host(unwrapped / self.ticks_per_second)
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        State of the mapping and the measured delays.
+
+        Returns:
+            Dict[str, Any]: reports, wraps and restarts seen, the drift in ppm, the mean and largest delay of reading
+                            a report after it was sent (the host polling delay) and the mean and largest time from
+                            writing a block to TX_COMPLETE.
+        """
+        with self.lock:
+            delays = [host - self._to_host(modem) for modem, host in self.samples] if self.samples else [0.0]
+            transmit = list(self.transmit_delays) or [0.0]
+            return {
+                "reports": self.reports,
+                "wraps": self.wraps,
+                "restarts": self.restarts,
+                "drift_ppm": self.drift_ppm,
+                "read_delay_mean": sum(delays) / len(delays),
+                "read_delay_max": max(delays),
+                "transmit_delay_mean": sum(transmit) / len(transmit),
+                "transmit_delay_max": max(transmit),
+            }
+
+
+def one_way_latency(sender: TimeSync, receiver: TimeSync, max_latency: float = 10.0) -> List[float]:
+    """
+    Latencies of blocks from one modem to another attached to the same host clock.
+
+    Every block received by the receiver is matched with the last TX_COMPLETE of the sender before it. The latency is
+    from the end of the transmission to the end of the reception, the propagation delay plus the time the receiving
+    modem needs to decode the block and report it.
+
+    Parameters:
+        sender (TimeSync): Mapping of the sending modem.
+        receiver (TimeSync): Mapping of the receiving modem.
+        max_latency (float): Blocks received later than this after a TX_COMPLETE are not matched (default 10).
+
+    Returns:
+        List[float]: Latency of every matched block in seconds.
+    """
+    with sender.lock:
+        sent = [time for kind, time, _ in sender.events if kind == "tx"]
+    with receiver.lock:
+        received = [time for kind, time, _ in receiver.events if kind == "rx"]
+    latencies = []
+    for time in received:
+        earlier = [end for end in sent if end <= time]
+        if earlier and time - earlier[-1] <= max_latency:
+            latencies.append(time - earlier[-1])
+    return latencies
@@ -0,0 +1,364 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, Callable, Iterator, Tuple
+
+from m16_relay import RelayEngine
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 98  # bytes of file data per frame, 112 characters after packing into 7 bits
+WINDOW = 4  # data frames sent before asking for an acknowledgement
+HASH_LENGTH = 8  # bytes of the SHA-256 digest used to verify and identify a file
+ACK_TIMEOUT = 120.0  # seconds to wait for an acknowledgement after the last frame was sent
+RETRIES = 5  # attempts to get an acknowledgement before giving up
+# Message ids an end of a transfer may use after saving its checkpoint and before saving the next one
+MESSAGE_ID_MARGIN = WINDOW + RETRIES
+
+# Callback receiving (bytes done, total bytes, estimated seconds left or None)
+Progress = Callable[[int, int, Optional[float]], None]
+
+
+def pack7(data: bytes) -> bytes:
+    """
+    Pack bytes into 7 bit values, every 7 bytes become 8, so binary data can be sent as ASCII.
+    """
+    packed = bytearray()
+    for i in range(0, len(data), 7):
+        group = data[i:i+7]
+        value = int.from_bytes(group, "big")
+        septets = (len(group) * 8 + 6) // 7
+        packed += bytes((value >> (7 * (septets - 1 - j))) & 0x7F for j in range(septets))
+    return bytes(packed)
+
+
+def unpack7(packed: bytes) -> bytes:
+    """
+    Reverse pack7().
+    """
+    data = bytearray()
+    for i in range(0, len(packed), 8):
+        group = packed[i:i+8]
+        value = 0
+        for septet in group:
+            value = (value << 7) | septet
+        data += value.to_bytes(len(group) * 7 // 8, "big")
+    return bytes(data)
+
+
+def read_chunks(path: str, offset: int = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """
+    Read a file chunk by chunk from an offset, without loading it whole.
+
+    Yields:
+        Tuple[int, bytes]: Offset and data of every chunk.
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                return
+            yield offset, data
+            offset += len(data)
+
+
+def file_digest(path: str) -> str:
+    """
+    Truncated SHA-256 of a file as hex, read in chunks.
+    """
+    digest = hashlib.sha256()
+    for _, data in read_chunks(path, 0, 65536):
+        digest.update(data)
+    return digest.hexdigest()[:2 * HASH_LENGTH]
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Read a sidecar checkpoint file, an empty dictionary if it does not exist or is damaged.
+    """
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def restore_message_id(engine: RelayEngine, checkpoint: Dict[str, Any]) -> None:
+    """
+    Continue the message ids used before a restart, kept in a checkpoint as "message_id". The other end still has
+    the recent ids in its duplicate cache and would drop new messages reusing them. Only an engine that has not sent
+    anything yet, i.e. one created after the restart, is changed.
+    """
+    if "message_id" in checkpoint and engine.sent == 0:
+        engine.next_message_id = checkpoint["message_id"] + MESSAGE_ID_MARGIN
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """
+    Write a sidecar checkpoint file atomically, so a reboot leaves either the old or the new checkpoint.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class _Eta:
+    """
+    Estimates the time left from the rate of acknowledged bytes since the start of this session.
+    """
+
+    def __init__(self, clock, start_offset: int, total: int) -> None:
+        self.clock = clock
+        self.start_time = clock.time()
+        self.start_offset = start_offset
+        self.total = total
+
+    def __call__(self, done: int) -> Optional[float]:
+        elapsed = self.clock.time() - self.start_time
+        if done <= self.start_offset or elapsed <= 0:
+            return None
+        return (self.total - done) / ((done - self.start_offset) / elapsed)
+
+
+def send_file(engine: RelayEngine, destination: int, path: str, progress: Optional[Progress] = None,
+              cancel: Optional[threading.Event] = None, ack_timeout: float = ACK_TIMEOUT) -> bool:
+    """
+    Send a file to another node, resuming an interrupted transfer of the same file.
+
+    The file is offered with its size and hash, the receiver answers with the number of bytes it already has.
+    Data is then sent in frames of CHUNK_SIZE bytes, every WINDOW frames the receiver acknowledges the bytes it
+    has received in order, and sending continues from there. The acknowledged offset is kept in a sidecar file
+    (path + ".m16send"), so after a reboot or a lost link calling send_file() again continues the transfer.
+    The receiver checks the hash of the complete file.
+
+    The engine must be running (RelayEngine.start()). Diagnostic mode is recommended on both modems, in
+    transparent mode file data can be mistaken for a report.
+
+    Parameters:
+        engine (RelayEngine): Engine of this node.
+        destination (int): Node receiving the file.
+        path (str): The file to send.
+        progress (Callable, optional): Called as progress(bytes acknowledged, total bytes, seconds left or None).
+        cancel (threading.Event, optional): When set, sending stops after the current window.
+        ack_timeout (float): Seconds to wait for an acknowledgement (default ACK_TIMEOUT).
+
+    Returns:
+        bool: True when the receiver has the complete file with the correct hash, False if it was cancelled,
+              no acknowledgement arrived or the hash was wrong.
+    """
+    size = os.path.getsize(path)
+    digest = file_digest(path)
+    checkpoint_path = path + ".m16send"
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint.get("digest") != digest or checkpoint.get("destination") != destination:
+        checkpoint = {"digest": digest, "size": size, "destination": destination, "acknowledged": 0}
+    restore_message_id(engine, checkpoint)
+    checkpoint["message_id"] = engine.next_message_id
+    save_checkpoint(checkpoint_path, checkpoint)
+
+    name = os.path.basename(path)
+    offer = f"O{size}:{digest}:{name}"[:127].encode("ascii", "replace")
+    acknowledged = _request_ack(engine, destination, offer, ack_timeout)
+    if acknowledged is None:
+        return False
+    eta = _Eta(engine.tx_modem.clock, acknowledged[0], size)
+    logger.info(f"Sending {name} ({size} bytes) from offset {acknowledged[0]}")
+
+    while True:
+        offset, verified = acknowledged
+        checkpoint["acknowledged"] = offset
+        checkpoint["message_id"] = engine.next_message_id
+        save_checkpoint(checkpoint_path, checkpoint)
+        if progress is not None:
+            progress(offset, size, eta(offset))
+        if offset >= size:
+            if verified:
+                os.remove(checkpoint_path)
+                return True
+            logger.warning(f"The receiver has {name} with a different hash")
+            return False
+        if cancel is not None and cancel.is_set():
+            return False
+
+        # Send a window of frames, the last one asks for an acknowledgement
+        chunks = []
+        for chunk in read_chunks(path, offset):
+            chunks.append(chunk)
+            if len(chunks) == WINDOW:
+                break
+        for i, (chunk_offset, data) in enumerate(chunks):
+            kind = "d" if i == len(chunks) - 1 else "D"
+            payload = kind.encode("ascii") + str(chunk_offset).encode("ascii") + b":" + pack7(data)
+            if i == len(chunks) - 1:
+                acknowledged = _request_ack(engine, destination, payload, ack_timeout)
+            else:
+                engine.send(destination, payload)
+        if acknowledged is None:
+            return False
+
+
+def _request_ack(engine: RelayEngine, destination: int, payload: bytes,
+                 ack_timeout: float) -> Optional[Tuple[int, bool]]:
+    """
+    Send a frame and wait for the acknowledgement, sending it again if none arrives.
+
+    Returns:
+        Optional[Tuple[int, bool]]: The acknowledged offset and whether the hash of the complete file was
+                                    correct, None if no acknowledgement arrived.
+    """
+    for attempt in range(RETRIES):
+        engine.send(destination, payload)
+        engine.flush()
+        deadline = engine.rx_modem.clock.time() + ack_timeout
+        while True:
+            frame = engine.receive(max(deadline - engine.rx_modem.clock.time(), 0))
+            if frame is None:
+                break
+            if frame.origin == destination and frame.payload[:1] == b"A":
+                offset, _, verified = frame.payload[1:].decode("ascii").partition(":")
+                if offset.isdigit():
+                    return int(offset), verified == "1"
+                logger.warning(f"Ignoring a malformed acknowledgement from node {destination}")
+        logger.info(f"No acknowledgement from node {destination}, attempt {attempt + 1} of {RETRIES}")
+    return None
+
+
+def receive_file(engine: RelayEngine, output: str, timeout: Optional[float] = None,
+                 progress: Optional[Progress] = None) -> Optional[str]:
+    """
+    Receive a file sent with send_file(), resuming an interrupted transfer of the same file.
+
+    Data is written to output + ".part" and the received offset is kept in a sidecar file (output + ".m16recv").
+    When the file is complete its hash is checked, the part file is renamed to output and the sender is told
+    the result.
+
+    Parameters:
+        engine (RelayEngine): Engine of this node, it must be running (RelayEngine.start()).
+        output (str): Path of the received file, or a directory to store it under the name given by the sender.
+        timeout (float, optional): Give up after this many seconds without a frame, by default it waits forever.
+        progress (Callable, optional): Called as progress(bytes received, total bytes, seconds left or None).
+
+    Returns:
+        Optional[str]: Path of the received file, None if the timeout expired or the hash was wrong.
+    """
+    transfer = None
+    clock = engine.rx_modem.clock
+    while True:
+        frame = engine.receive(timeout)
+        if frame is None:
+            return None
+        kind, payload = frame.payload[:1], frame.payload[1:]
+        if kind == b"O":
+            offer = _parse_offer(payload)
+            if offer is None:
+                logger.warning(f"Ignoring a malformed offer from node {frame.origin}: {payload!r}")
+                continue
+            size, digest, name = offer
+            path = os.path.join(output, name) if os.path.isdir(output) else output
+            transfer = _Reception(path, size, digest, frame.origin, engine)
+            transfer.eta = _Eta(clock, transfer.received, transfer.size)
+            logger.info(f"Receiving {path} ({size} bytes) from node {frame.origin}, offset {transfer.received}")
+            engine.send(frame.origin, transfer.ack())
+        elif kind in (b"D", b"d") and transfer is not None and frame.origin == transfer.origin:
+            offset, _, data = payload.partition(b":")
+            if offset.isdigit():
+                transfer.write(int(offset), unpack7(data))
+            if progress is not None:
+                progress(transfer.received, transfer.size, transfer.eta(transfer.received))
+            if kind == b"d":
+                engine.send(frame.origin, transfer.ack())
+                if transfer.complete:
+                    return transfer.path if transfer.verified else None
+
+
+def _parse_offer(payload: bytes) -> Optional[Tuple[int, str, str]]:
+    """
+    Size, hash and file name of an offer, None if it is not a valid offer.
+    """
+    fields = payload.split(b":", 2)
+    if len(fields) != 3 or not fields[0].isdigit():
+        return None
+    digest = fields[1].decode("ascii", "replace")
+    name = os.path.basename(fields[2].decode("ascii", "replace"))
+    if len(digest) != 2 * HASH_LENGTH or any(c not in "0123456789abcdef" for c in digest) or name in ("", ".", ".."):
+        return None
+    return int(fields[0]), digest, name
+
+
+class _Reception:
+    """
+    State of a file being received, with its checkpoint.
+    """
+
+    def __init__(self, path: str, size: int, digest: str, origin: int, engine: RelayEngine) -> None:
+        self.path = path
+        self.size = size
+        self.digest = digest
+        self.origin = origin
+        self.engine = engine
+        self.part_path = path + ".part"
+        self.checkpoint_path = path + ".m16recv"
+        self.complete = False
+        self.verified = False
+
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint.get("digest") == digest:
+            restore_message_id(engine, checkpoint)
+        self.received = 0
+        if not checkpoint and os.path.exists(path) and file_digest(path) == digest:
+            # Received before, but the sender did not get the last acknowledgement
+            self.received = size
+            self.complete = self.verified = True
+            return
+        if checkpoint.get("digest") == digest and os.path.exists(self.part_path):
+            # Data after the checkpoint may have been written before the reboot, it is written again
+            self.received = min(checkpoint.get("received", 0), os.path.getsize(self.part_path))
+        with open(self.part_path, "ab") as file:
+            file.truncate(self.received)
+        self._save()
+        self._check_complete()
+
+    def _save(self) -> None:
+        save_checkpoint(self.checkpoint_path, {"digest": self.digest, "size": self.size, "origin": self.origin,
+                                               "received": self.received,
+                                               "message_id": self.engine.next_message_id})
+
+    def write(self, offset: int, data: bytes) -> None:
+        """
+        Append data received in order, data for other offsets is ignored until it is sent again.
+        """
+        if offset != self.received or self.complete:
+            return
+        with open(self.part_path, "ab") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        self.received += len(data)
+        self._save()
+        self._check_complete()
+
+    def _check_complete(self) -> None:
+        if self.received < self.size or self.complete:
+            return
+        self.complete = True
+        self.verified = file_digest(self.part_path) == self.digest
+        if self.verified:
+            os.replace(self.part_path, self.path)
+            os.remove(self.checkpoint_path)
+        else:
+            logger.warning(f"Received {self.path} with a wrong hash, discarding it")
+            os.remove(self.part_path)
+            os.remove(self.checkpoint_path)
+
+    def ack(self) -> bytes:
+        """
+        Acknowledgement of the bytes received, with the result of the hash check when complete.
+        """
+        result = f":{int(self.verified)}" if self.complete else ""
+        return f"A{self.received}{result}".encode("ascii")
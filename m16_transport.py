@@ -0,0 +1,338 @@
+import os
+import socket
+import select
+import threading
+from time import time
+from typing import Optional, Tuple, Union
+
+import serial
+
+
+class Transport:
+    """
+    Byte stream to a modem, with the part of the pyserial interface used by the driver:
+    write(), read(), in_waiting, is_open and close().
+    """
+    is_open = False
+
+    def write(self, data: bytes) -> int:
+        """
+        Write data to the modem.
+
+        Parameters:
+            data (bytes): The data to write.
+
+        Returns:
+            int: Number of bytes written.
+        """
+        raise NotImplementedError
+
+    def read(self, size: int = 1) -> bytes:
+        """
+        Read up to size bytes, waiting at most the transport timeout for them.
+
+        Parameters:
+            size (int): Number of bytes to read (default 1).
+
+        Returns:
+            bytes: The bytes read, may be fewer than size if the timeout expired.
+        """
+        raise NotImplementedError
+
+    @property
+    def in_waiting(self) -> int:
+        """
+        Number of bytes that can be read without waiting.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Close the transport.
+        """
+        self.is_open = False
+
+
+class SerialTransport(Transport):
+    """
+    Transport over a pyserial port, either a local serial port or a pyserial URL handler
+    such as "rfc2217://host:port", "socket://host:port" or "loop://".
+    """
+
+    def __init__(self, port: str, baudrate: int = 9600, timeout: float = 0.5) -> None:
+        """
+        Parameters:
+            port (str): Serial port (e.g. "COM3" or "/dev/ttyUSB0") or pyserial URL.
+            baudrate (int): Baud rate (default 9600).
+            timeout (float): Timeout for reads (default 0.5).
+        """
+        self.port = port
+        self.ser = serial.serial_for_url(port, baudrate, timeout=timeout)
+
+    @property
+    def is_open(self) -> bool:
+        return self.ser.is_open
+
+    def write(self, data: bytes) -> int:
+        return self.ser.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        return self.ser.read(size)
+
+    @property
+    def in_waiting(self) -> int:
+        return self.ser.in_waiting
+
+    def close(self) -> None:
+        self.ser.close()
+
+
+class SocketTransport(Transport):
+    """
+    Transport over a TCP connection, e.g. to an Ethernet-to-serial bridge next to a topside modem.
+
+    Reads are non-blocking, in_waiting only collects what has already arrived on the socket.
+    Writes are queued and sent by a writer thread, which waits coalesce_delay seconds for more data so the
+    characters of a command written back to back leave in one TCP segment instead of one segment per character.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 0.5, coalesce_delay: float = 0.002) -> None:
+        """
+        Parameters:
+            host (str): Host name or address of the bridge.
+            port (int): TCP port of the bridge.
+            timeout (float): Timeout for connecting and for reads (default 0.5).
+            coalesce_delay (float): Seconds to wait for more data before sending a write (default 0.002).
+        """
+        self.timeout = timeout
+        self.coalesce_delay = coalesce_delay
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.is_open = True
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._tx_condition = threading.Condition()
+        self._error: Optional[Exception] = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a transport that is not open")
+
+    def _fill(self) -> None:
+        """
+        Move everything that has arrived on the socket to the receive buffer without blocking.
+        """
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            if not data:
+                self._error = ConnectionResetError("Connection closed by the remote end")
+                raise self._error
+            self._rx += data
+
+    def write(self, data: bytes) -> int:
+        self._check()
+        with self._tx_condition:
+            self._tx += data
+            self._tx_condition.notify()
+        return len(data)
+
+    def flush(self) -> None:
+        """
+        Wait until all queued writes have been sent.
+        """
+        with self._tx_condition:
+            self._tx_condition.wait_for(lambda: not self._tx or self._error is not None or not self.is_open)
+        self._check()
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._tx_condition:
+                self._tx_condition.wait_for(lambda: self._tx or not self.is_open)
+                if not self.is_open:
+                    return
+                # Let the rest of a command arrive before sending, every write wakes the wait up
+                deadline = time() + self.coalesce_delay
+                remaining = self.coalesce_delay
+                while remaining > 0 and self.is_open:
+                    self._tx_condition.wait(remaining)
+                    remaining = deadline - time()
+                data = bytes(self._tx)
+                self._tx.clear()
+            try:
+                while data:
+                    select.select([], [self.sock], [], self.timeout)
+                    try:
+                        sent = self.sock.send(data)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    data = data[sent:]
+            except OSError as e:
+                self._error = e
+                return
+            finally:
+                with self._tx_condition:
+                    self._tx_condition.notify_all()
+
+    def read(self, size: int = 1) -> bytes:
+        self._check()
+        deadline = time() + self.timeout
+        self._fill()
+        while len(self._rx) < size:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            select.select([self.sock], [], [], remaining)
+            self._fill()
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        self._check()
+        self._fill()
+        return len(self._rx)
+
+    def close(self) -> None:
+        with self._tx_condition:
+            self.is_open = False
+            self._tx_condition.notify_all()
+        self._writer.join(self.timeout)
+        self.sock.close()
+
+
+class MemoryTransport(Transport):
+    """
+    In-memory transport, what is written to one end of a pair can be read from the other end.
+    Used to run the driver against an emulated modem or a test without any hardware.
+    """
+
+    def __init__(self, timeout: float = 0.5) -> None:
+        """
+        Parameters:
+            timeout (float): Timeout for reads (default 0.5).
+        """
+        self.timeout = timeout
+        self.peer: Optional["MemoryTransport"] = None
+        self.is_open = True
+        self._rx = bytearray()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def pair(cls, timeout: float = 0.5) -> Tuple["MemoryTransport", "MemoryTransport"]:
+        """
+        Create two connected transports.
+
+        Parameters:
+            timeout (float): Timeout for reads on both ends (default 0.5).
+
+        Returns:
+            Tuple[MemoryTransport, MemoryTransport]: The two ends.
+        """
+        a, b = cls(timeout), cls(timeout)
+        a.peer, b.peer = b, a
+        return a, b
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a transport that is not open")
+        if self.peer is not None and self.peer.is_open:
+            self.peer.feed(data)
+        return len(data)
+
+    def feed(self, data: bytes) -> None:
+        """
+        Make data available for reading from this end.
+
+        Parameters:
+            data (bytes): The data to add.
+        """
+        with self._condition:
+            self._rx += data
+            self._condition.notify_all()
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a transport that is not open")
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._rx) >= size or not self.is_open, timeout=self.timeout)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise serial.SerialException("Attempting to use a transport that is not open")
+        return len(self._rx)
+
+    def close(self) -> None:
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+class LoopbackTransport(MemoryTransport):
+    """
+    In-memory transport that reads back what is written to it.
+    """
+
+    def __init__(self, timeout: float = 0.5) -> None:
+        super().__init__(timeout)
+        self.peer = self
+
+
+def parse_tcp_url(url: str) -> Tuple[str, int]:
+    """
+    Split a "tcp://host:port" URL into host and port.
+    """
+    host, _, port = url[len("tcp://"):].rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid TCP URL {url}, expected tcp://host:port")
+    return host.strip("[]"), int(port)
+
+
+def open_transport(port: Union[str, Transport], baudrate: int = 9600, timeout: float = 0.5) -> Transport:
+    """
+    Open a transport from a port name, a URL or an existing transport.
+
+    Supported are:
+        - a Transport object, which is returned as is
+        - "tcp://host:port" for a SocketTransport
+        - pyserial URLs such as "rfc2217://host:port", "socket://host:port" or "loop://"
+        - serial ports such as "COM3" or "/dev/ttyUSB0"
+
+    Parameters:
+        port (Union[str, Transport]): The port, URL or transport.
+        baudrate (int): Baud rate for serial ports (default 9600).
+        timeout (float): Timeout for reads (default 0.5).
+
+    Returns:
+        Transport: The opened transport.
+    """
+    if isinstance(port, Transport):
+        return port
+    if port.startswith("tcp://"):
+        host, tcp_port = parse_tcp_url(port)
+        return SocketTransport(host, tcp_port, timeout)
+    if "://" not in port and not os.path.exists(port):
+        raise ValueError(f"Port {port} does not exist")
+    return SerialTransport(port, baudrate, timeout)
+
+
+def transport_available(port: Union[str, Transport]) -> bool:
+    """
+    Check if a transport can be opened for a port, i.e. the device path of a serial port exists.
+    URLs are always considered available, connecting to them shows if they are.
+    """
+    if isinstance(port, Transport):
+        return port.is_open
+    return "://" in port or os.path.exists(port)
@@ -1,6 +1,16 @@
 from m16_driver import M16
+from m16_discovery import discover_modems
 
-PORT = input("Please input the port where the modem is connected (e.g. COM3 or /dev/ttyUSB0): ")
+PORT = input("Please input the port where the modem is connected (e.g. COM3 or /dev/ttyUSB0), "
+             "leave empty to search for it: ")
+
+# Search all serial ports for a modem if no port was given
+if not PORT:
+    modems = discover_modems()
+    if not modems:
+        raise SystemExit("No modem found, check that the modem is connected and has power.")
+    PORT = modems[0]["port"]
+    print(f"Found modem on {PORT}")
 
 CHANNEL = 1
 POWER_LEVEL = 4
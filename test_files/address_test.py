@@ -0,0 +1,121 @@
+# This pytest runs without hardware
+
+import pytest
+from m16_address import AddressFilter, BROADCAST
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, encode_report
+from m16_frame import Frame
+from m16_relay import RelayEngine
+from m16_transport import MemoryTransport
+
+
+def block_reports(frame):
+    """The diagnostic reports a modem sends while receiving a frame."""
+    return [encode_report(M16Emulator().report(block=block)) for block in frame.blocks()]
+
+
+def reception_reports(modem, blocks):
+    """The diagnostic reports a modem sends while receiving blocks, None for a block it could not decode."""
+    reports = []
+    for block in blocks:
+        if block is None:
+            modem.packet_invalid += 1
+        reports.append(encode_report(modem.report(block=block)))
+    return reports
+
+
+def relay_reports(relay, reports):
+    for report in reports:
+        if relay.address_filter.filter(report, relay.rx_modem.clock.time()) is not None:
+            relay.on_packet(report)
+
+
+def test_accepts():
+    address_filter = AddressFilter(5, groups=[100])
+    assert address_filter.accepts(5)
+    assert address_filter.accepts(100)
+    assert address_filter.accepts(BROADCAST)
+    assert not address_filter.accepts(6)
+    assert not address_filter.accepts(101)
+    with pytest.raises(ValueError):
+        AddressFilter(5, groups=[5])
+
+
+def test_filter_transparent_stream():
+    address_filter = AddressFilter(5)
+    foreign = Frame(6, 1, 1, b"Not for you").encode()
+    own = Frame(5, 1, 2, b"For you").encode()
+    broadcast = Frame(BROADCAST, 1, 3, b"For all").encode()
+    stream = foreign + own + foreign + broadcast
+    # Split in odd pieces like reads in transparent mode
+    kept = b"".join(address_filter.filter(stream[i:i+7]) or b"" for i in range(0, len(stream), 7))
+    assert kept == own + broadcast
+    assert address_filter.accepted_frames == 2
+    assert address_filter.dropped_frames == 2
+    assert address_filter.dropped_blocks == 2 * len(foreign) // 2
+
+
+def test_filter_reports():
+    address_filter = AddressFilter(5)
+    status = encode_report(M16Emulator().report())
+    assert address_filter.filter(status) == status
+    assert [address_filter.filter(r) is not None for r in block_reports(Frame(6, 1, 1, b"Hi"))] == [False] * 5
+    assert [address_filter.filter(r) is not None for r in block_reports(Frame(5, 1, 1, b"Hi"))] == [True] * 5
+
+
+def test_driver_drops_before_listeners():
+    host, modem_end = MemoryTransport.pair()
+    modem = M16(host, channel=None, level=None, diagnostic=None)
+    modem.address_filter = AddressFilter(5)
+    received = []
+    modem.add_listener(received.append)
+    for report in block_reports(Frame(6, 1, 1, b"Hi")) + block_reports(Frame(5, 1, 2, b"Hi")):
+        modem_end.write(report)
+    packets = [modem.read_packet(timeout=0.2) for _ in range(10)]
+    assert packets[:5] == [None] * 5
+    assert len(received) == 5
+    assert modem.report_sequence == 5
+
+
+def test_relay_groups():
+    host, _ = MemoryTransport.pair()
+    modem = M16(host, channel=None, level=None, diagnostic=None)
+    relay = RelayEngine(5, modem, groups=[100])
+    for frame in (Frame(100, 1, 1, b"Group"), Frame(101, 1, 2, b"Other group"), Frame(BROADCAST, 1, 3, b"All")):
+        for report in block_reports(frame):
+            if modem.address_filter.filter(report) is not None:
+                relay.on_packet(report)
+    assert [relay.messages.get_nowait().payload for _ in range(2)] == [b"Group", b"All"]
+    assert relay.messages.empty()
+    # Group messages are not sent on without a route
+    assert relay.forwarded == relay.no_route == 0
+
+
+def test_lost_block():
+    host, _ = MemoryTransport.pair()
+    modem = M16(host, channel=None, level=None, diagnostic=None, clock=VirtualClock())
+    relay = RelayEngine(5, modem)
+    receiver = M16Emulator()
+    lost_payload = Frame(5, 1, 1, b"Lost in the middle").blocks()
+    lost_payload[4] = None
+    lost_destination = Frame(5, 1, 2, b"Lost at the start").blocks()
+    lost_destination[0] = None
+    blocks = (lost_payload + Frame(6, 1, 3, b"Not for you").blocks() + Frame(5, 1, 4, b"After").blocks()
+              + lost_destination + Frame(6, 1, 5, b"Not for you").blocks() + Frame(5, 1, 6, b"Last").blocks())
+    relay_reports(relay, reception_reports(receiver, blocks))
+    # The frames after the lost blocks start where they should
+    assert [relay.messages.get_nowait().payload for _ in range(2)] == [b"After", b"Last"]
+    assert relay.messages.empty()
+    assert relay.corrupt == 2
+    assert relay.address_filter.lost_blocks == 2
+    assert relay.address_filter.dropped_frames == 2
+
+    # Without the length the boundaries are found again after a pause
+    lost_length = Frame(5, 1, 7, b"Lost length").blocks()
+    lost_length[2] = None
+    relay_reports(relay, reception_reports(receiver, lost_length))
+    modem.clock.advance(relay.address_filter.max_gap + 1)
+    relay_reports(relay, reception_reports(receiver, Frame(5, 1, 8, b"Found").blocks()))
+    assert relay.messages.get_nowait().payload == b"Found"
+    assert relay.corrupt == 3
@@ -0,0 +1,87 @@
+# This pytest runs without hardware, the recorded sessions are generated
+
+import csv
+import json
+import numpy as np
+import pytest
+from m16_driver import M16
+from m16_emulator import encode_report
+from m16_analysis import decode_capture, session_statistics, analyse_files, export_csv, export_npz, SNR_BINS
+
+
+def session_reports():
+    """Reports of a session: 100 s on channel 1 at level 4, then 50 s on channel 3 at level 2."""
+    reports = []
+    valid = invalid = 0
+    time = (1 << 24) - 50000  # TIME wraps after 50 s
+    for second in range(150):
+        report = {"TIME": time & 0xFFFFFF, "CHIP_ID": 39040, "HW_REV": 2, "DIAGNOSTIC_MODE": 1, "NOISE_POWER": 40,
+                  "CHANNEL": 1 if second < 100 else 3, "LEVEL": 0 if second < 100 else 2}
+        if second % 5 == 0 and second:
+            valid += 1
+            report.update(TR_BLOCK=b"ok", TB_VALID=1, SIGNAL_POWER=70, BER=10)
+        if second % 20 == 2:
+            invalid += 1
+        if second % 10 == 3:
+            report.update(TX_COMPLETE=1)
+        report.update(PACKET_VALID=valid, PACKET_INVALID=invalid)
+        reports.append(report)
+        time += 1000
+    return reports
+
+
+def test_decode_capture():
+    reports = session_reports()[:20]
+    # Transparent data between the reports, with a '$' that is not the start of a report
+    data = b"".join(b"$x" + encode_report(report) for report in reports)
+    columns = decode_capture(data)
+    assert len(columns["TIME"]) == len(reports)
+    for i, report in enumerate(reports):
+        expected = M16.decode_packet(encode_report(report))
+        assert columns["TR_BLOCK"][i] == int.from_bytes(expected["TR_BLOCK"], "little")
+        for field in ("BER", "SIGNAL_POWER", "PACKET_VALID", "TIME", "CHIP_ID", "HW_REV", "CHANNEL", "TB_VALID",
+                      "TX_COMPLETE", "DIAGNOSTIC_MODE", "LEVEL"):
+            assert columns[field][i] == expected[field]
+
+
+def test_session_statistics():
+    statistics = session_statistics(decode_capture(b"".join(encode_report(r) for r in session_reports())))
+    total = statistics["total"]
+    assert total["reports"] == 150
+    assert total["duration"] == pytest.approx(149.0)
+    assert total["blocks_received"] == 29
+    assert total["blocks_sent"] == 15
+    assert total["tx_duty_cycle"] == pytest.approx(15 * 2 / 149.0)
+    assert total["packet_error_rate"] == pytest.approx(8 / (29 + 8))
+    assert total["interarrival_median"] == pytest.approx(5.0)
+    assert total["snr_histogram"][np.searchsorted(SNR_BINS, 30, side="right") - 1] == 29
+
+    groups = {(group["channel"], group["level"]): group for group in statistics["groups"]}
+    assert sorted(groups) == [(1, 4), (3, 2)]
+    assert groups[(1, 4)]["reports"] == 100
+    assert groups[(3, 2)]["blocks_received"] == 10
+    assert groups[(3, 2)]["blocks_sent"] == 5
+
+
+def test_analyse_files(tmp_path):
+    reports = session_reports()
+    capture = tmp_path / "capture.bin"
+    capture.write_bytes(b"".join(encode_report(report) for report in reports))
+    log = tmp_path / "reports.jsonl"
+    log.write_text("\n".join(json.dumps({key: value.hex() if isinstance(value, bytes) else value
+                                         for key, value in report.items()}) for report in reports))
+    sessions = analyse_files([str(capture), str(log)], processes=2)
+    assert [session["session"] for session in sessions] == [str(capture), str(log)]
+    assert sessions[0]["total"]["blocks_received"] == sessions[1]["total"]["blocks_received"] == 29
+
+    export_csv(sessions, str(tmp_path / "summary.csv"))
+    with open(tmp_path / "summary.csv") as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 6  # total and two groups of each session
+    assert rows[1]["channel"] == "1" and rows[1]["level"] == "4"
+
+    export_npz(sessions, str(tmp_path / "summary.npz"))
+    arrays = np.load(tmp_path / "summary.npz")
+    assert arrays["snr_histogram"].shape == (6, len(SNR_BINS) - 1)
+    assert arrays["snr_histogram"][0].sum() == 29
+    assert list(arrays["level"]) == [-1, 4, 2, -1, 4, 2]
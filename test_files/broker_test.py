@@ -0,0 +1,86 @@
+# This pytest runs without hardware, the modems are emulated and run in real time
+
+import time
+import pytest
+from m16_driver import M16
+from m16_emulator import M16Emulator, Medium, encode_report
+from m16_broker import M16Broker, M16Client
+
+
+@pytest.fixture
+def broker(tmp_path):
+    """A broker sharing an emulated modem, and a second emulated modem in the same water."""
+    medium = Medium()
+    modem = M16(M16Emulator(medium=medium).transport(), channel=None, level=None, diagnostic=None)
+    peer = M16(M16Emulator(medium=medium).transport(), channel=None, level=None, diagnostic=None)
+    broker = M16Broker(modem, str(tmp_path / "broker.sock"))
+    broker.start()
+    yield broker, peer
+    broker.stop()
+
+
+class CountingScheduler:
+    """Stands in for m16_tdma.TdmaScheduler, counts the blocks waiting for a slot."""
+
+    def __init__(self):
+        self.waits = 0
+
+    def wait_for_slot(self):
+        self.waits += 1
+
+
+def test_clients_receive_blocks(broker):
+    broker, peer = broker
+    clients = [M16Client(broker.address), M16Client(broker.address)]
+    # A client receives what the broker reads from its first read on
+    for client in clients:
+        assert client.read_packet(timeout=0.1) is None
+    peer.send_two_bytes("Hi")
+    for client in clients:
+        assert client.read_packet(timeout=2.5) == b"Hi"
+        client.close()
+
+
+def test_client_is_a_modem(broker):
+    broker, peer = broker
+    client = M16Client(broker.address)
+    assert client.reports is not None and client.address_filter is None
+    assert client.read_packet(timeout=0.1) is None
+
+    report = client.request_report()
+    assert report is not None and report["CHIP_ID"] == 39040
+    assert client.channel == broker.modem.channel == 1
+    # The report is also read by the client, so the methods of M16 waiting for reports work
+    assert client.wait_for_report(0, deadline=client.clock.time() + 5) is not None
+    assert client.latest_report(max_age=10) is not None
+
+    client.tdma = CountingScheduler()
+    client.send_msg("Hey!")
+    assert client.tdma.waits == 2
+    assert client.last_send_time is not None
+    assert peer.read_packet(timeout=3) == b"Hey!"
+    client.close()
+
+
+def test_sending_client_does_not_buffer(broker):
+    broker, peer = broker
+    client = M16Client(broker.address)
+    client.ser.RX_BUFFER_SIZE = 36
+    report = encode_report(M16Emulator().report())
+    # A client that only sends is not subscribed
+    broker._publish(report)
+    assert not client.ser.subscribed and client.ser.in_waiting == 0
+
+    # A client that stops reading keeps the newest RX_BUFFER_SIZE bytes
+    for _ in range(10):
+        broker._publish(report)
+    deadline = time.monotonic() + 5
+    while client.ser.dropped < 8 * len(report) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.ser.in_waiting == 36 and client.ser.dropped == 8 * len(report)
+
+    # The backlog is not taken as the reply to a message sent with TDMA
+    client.tdma = CountingScheduler()
+    client.send_msg("Hi")
+    assert client.ser.in_waiting == 0
+    client.close()
@@ -0,0 +1,95 @@
+# This pytest runs without hardware, the frames are passed from the encoder to the decoder in blocks
+
+import math
+import random
+from m16_codec import TelemetryEncoder, TelemetryDecoder, encode_varint, decode_varint
+
+PREDICTORS = ["linear", "linear", "delta", "delta", "delta", "delta", "delta", "delta", "xor", "xor"]
+
+
+def telemetry(count):
+    """Slowly changing status of a vehicle: depth and distance at a steady rate, sensors, status flags."""
+    records = []
+    for i in range(count):
+        records.append((1000 + 3 * i, 50 * i, 1800 + round(20 * math.sin(i / 200)), 12400 - i // 10, 85, 21,
+                        -3 + (i % 40 == 0), 512, 0b1010 | (i > 100) << 4, 0))
+    return records
+
+
+def blocks(frame):
+    frame += b" " * (len(frame) % 2)
+    return [frame[i:i+2] for i in range(0, len(frame), 2)]
+
+
+def test_varint():
+    for value in (0, 1, -1, 31, -32, 32, -33, 100000, -123456789):
+        data = encode_varint(value)
+        assert all(byte < 0x80 for byte in data)
+        assert decode_varint(data + b"x", 0) == (value, len(data))
+    assert len(encode_varint(31)) == len(encode_varint(-32)) == 1
+    assert decode_varint(encode_varint(100000)[:-1], 0) is None
+
+
+def test_round_trip():
+    records = telemetry(200)
+    encoder = TelemetryEncoder(10, PREDICTORS)
+    decoder = TelemetryDecoder(10, PREDICTORS)
+    decoded = []
+    text_blocks = 0
+    for record in records:
+        for block in blocks(encoder.encode(record)):
+            decoded += decoder.feed(block)
+        text_blocks += math.ceil(len(",".join(str(value) for value in record)) / 2)
+    assert decoded == records
+    assert decoder.lost == decoder.skipped == decoder.dropped_bytes == 0
+    # Sending the records as text takes ten times the blocks
+    assert encoder.blocks_per_record * 10 <= text_blocks / len(records)
+
+
+def test_recovery_after_loss():
+    records = telemetry(60)
+    encoder = TelemetryEncoder(10, PREDICTORS, max_interval=8)
+    decoder = TelemetryDecoder(10, PREDICTORS)
+    decoded = []
+    for i, record in enumerate(records):
+        frame_blocks = blocks(encoder.encode(record))
+        if i == 10:
+            frame_blocks = frame_blocks[1:]  # The first block of frame 10 is lost
+        if i == 20:
+            frame_blocks[0] = b"\x7f\x7f"  # and frame 20 is corrupt
+        for block in frame_blocks:
+            decoded += decoder.feed(block)
+    # Frames 10 and 20 and the delta frames after them up to the next keyframes (16 and 24) are lost
+    expected = [record for i, record in enumerate(records) if not 10 <= i < 16 and not 20 <= i < 24]
+    assert decoded == expected
+    assert decoder.lost == 2
+    assert decoder.skipped == 8
+    assert decoder.loss_rate > 0
+
+
+def test_interval_follows_loss_rate():
+    encoder = TelemetryEncoder(10, PREDICTORS)
+    for record in telemetry(40):
+        encoder.encode(record)
+    assert encoder.interval == encoder.max_interval
+    intervals = []
+    for loss_rate in (0.05, 0.2, 0.5):
+        encoder.set_loss_rate(loss_rate)
+        intervals.append(encoder.interval)
+    assert encoder.max_interval > intervals[0] > intervals[1] > intervals[2] >= 1
+
+    # With losses the chosen interval decodes more records per block than keyframes every 32 frames
+    def decoded_per_block(interval, loss_rate, count=3000):
+        encoder = TelemetryEncoder(10, PREDICTORS, max_interval=interval)
+        decoder = TelemetryDecoder(10, PREDICTORS)
+        rng = random.Random(1)
+        for record in telemetry(count):
+            frame = encoder.encode(record)
+            if rng.random() >= loss_rate:
+                for block in blocks(frame):
+                    decoder.feed(block)
+        return decoder.frames - decoder.skipped, encoder.bytes_sent / 2
+
+    decoded, sent = decoded_per_block(32, 0.2)
+    adaptive_decoded, adaptive_sent = decoded_per_block(intervals[1], 0.2)
+    assert adaptive_decoded / adaptive_sent > decoded / sent
@@ -0,0 +1,124 @@
+# This pytest runs without hardware, the dashboard is served on localhost for an emulated modem
+
+import json
+import http.client
+import urllib.request
+import pytest
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, encode_report
+from m16_dashboard import M16Dashboard, BroadcastBuffer
+
+
+@pytest.fixture
+def dashboard():
+    modem = M16(M16Emulator().transport(), channel=None, level=None, diagnostic=None, clock=VirtualClock())
+    modem.channel, modem.level, modem.diagnostic = 3, 2, True
+    dashboard = M16Dashboard(modem, "127.0.0.1:0", read=False)
+    dashboard.start()
+    yield dashboard
+    dashboard.stop()
+
+
+def report(**fields):
+    report = {"TIME": 1000, "CHIP_ID": 39040, "HW_REV": 2, "DIAGNOSTIC_MODE": 1, "CHANNEL": 3, "LEVEL": 2,
+              "SIGNAL_POWER": 70, "NOISE_POWER": 40, "BER": 5}
+    report.update(fields)
+    return encode_report(report)
+
+
+def read_events(response, count):
+    """Read count Server-Sent Events as (id, event, data)."""
+    events, fields = [], {}
+    while len(events) < count:
+        line = response.readline().decode("utf-8").rstrip("\n")
+        if not line:
+            if "event" in fields:
+                events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+            fields = {}
+        elif not line.startswith(":"):
+            name, _, value = line.partition(": ")
+            fields[name] = value
+    return events
+
+
+def open_events(dashboard, last_event_id=None):
+    host, port = dashboard.server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port, timeout=5)
+    connection.request("GET", "/events", headers={"Last-Event-ID": last_event_id} if last_event_id else {})
+    response = connection.getresponse()
+    assert response.getheader("Content-Type") == "text/event-stream"
+    return connection, response
+
+
+def test_events(dashboard):
+    dashboard.on_packet(report(PACKET_VALID=10, PACKET_INVALID=0))
+    connection, response = open_events(dashboard)
+    # A new viewer gets the history first, then the live events
+    [(_, kind, first)] = read_events(response, 1)
+    assert kind == "report" and first["report"]["CHANNEL"] == 3
+
+    dashboard.on_packet(report(TB_VALID=1, TR_BLOCK=b"hi", PACKET_VALID=11, PACKET_INVALID=1))
+    dashboard.on_packet(b"ab")
+    block, data = read_events(response, 2)
+    assert block[1] == "report" and block[2]["text"] == "hi"
+    assert block[2]["metrics"]["blocks_received"] == 1
+    assert block[2]["metrics"]["snr"] == 30
+    assert block[2]["metrics"]["packet_error_rate"] == pytest.approx(0.5)
+    assert data[1] == "data" and data[2]["text"] == "ab" and data[2]["metrics"]["bytes_received"] == 2
+    connection.close()
+
+    # A browser reconnecting with Last-Event-ID only gets what it missed
+    dashboard.on_packet(report(TX_COMPLETE=1, PACKET_VALID=11, PACKET_INVALID=1))
+    connection, response = open_events(dashboard, str(data[0]))
+    [(number, _, sent)] = read_events(response, 1)
+    assert number == data[0] + 1
+    assert sent["metrics"]["blocks_sent"] == 1
+    connection.close()
+
+
+def test_packet_counters_wrap(dashboard):
+    dashboard.on_packet(report(PACKET_VALID=100, PACKET_INVALID=250))
+    # PACKET_INVALID is 8 bits, 10 invalid packets take it from 250 to 4
+    dashboard.on_packet(report(PACKET_VALID=110, PACKET_INVALID=4))
+    assert dashboard.metrics["packet_error_rate"] == pytest.approx(0.5)
+    dashboard.on_packet(report(PACKET_VALID=130, PACKET_INVALID=4))
+    assert dashboard.metrics["packet_error_rate"] == pytest.approx(0.25)
+    # A restarted modem counts from 0 again
+    dashboard.on_packet(report(PACKET_VALID=0, PACKET_INVALID=0))
+    assert dashboard.metrics["packet_error_rate"] is None
+    dashboard.on_packet(report(PACKET_VALID=9, PACKET_INVALID=1))
+    assert dashboard.metrics["packet_error_rate"] == pytest.approx(0.1)
+
+
+def test_state_follows_reports(dashboard):
+    dashboard.on_packet(report(CHANNEL=7, LEVEL=0, DIAGNOSTIC_MODE=0))
+    with urllib.request.urlopen(dashboard.url + "api/state", timeout=5) as response:
+        state = json.load(response)
+    assert (state["channel"], state["level"], state["diagnostic"]) == (7, 4, False)
+
+
+def test_pages(dashboard):
+    dashboard.on_packet(report(TB_VALID=1, TR_BLOCK=b"ok"))
+    for page in ("", "link", "history"):
+        with urllib.request.urlopen(dashboard.url + page, timeout=5) as response:
+            assert response.headers.get_content_type() == "text/html"
+            assert b"new EventSource" in response.read()
+    with urllib.request.urlopen(dashboard.url + "api/state", timeout=5) as response:
+        state = json.load(response)
+    assert (state["channel"], state["level"], state["diagnostic"]) == (3, 2, True)
+    assert state["metrics"]["blocks_received"] == 1
+    assert state["report"]["TR_BLOCK"] == b"ok".hex()
+    with urllib.request.urlopen(dashboard.url + "api/history", timeout=5) as response:
+        assert [message["text"] for message in json.load(response)] == ["ok"]
+
+
+def test_broadcast_buffer():
+    buffer = BroadcastBuffer(3)
+    for i in range(5):
+        buffer.publish("data", {"n": i})
+    # A viewer that fell behind continues with the oldest event kept
+    assert [number for number, _ in buffer.read(0, 0)] == [3, 4, 5]
+    assert buffer.read(5, 0) == []
+    assert buffer.read(4, 0)[0][1] == b'id: 5\nevent: data\ndata: {"n": 4, "id": 5}\n\n'
+    assert [message["n"] for message in buffer.messages()] == [2, 3, 4]
@@ -0,0 +1,23 @@
+# This pytest runs without hardware, the ports are transports to an emulated modem and to nothing
+
+from m16_emulator import M16Emulator
+from m16_transport import MemoryTransport
+from m16_discovery import probe_port, discover_modems
+
+
+def test_probe_port():
+    modem = M16Emulator(channel=3)
+    found = probe_port(modem.transport(), timeout=2.0)
+    assert found is not None
+    assert (found["CHIP_ID"], found["channel"], found["diagnostic"]) == (39040, 3, False)
+    assert found["GIT_REV"] == "56"
+    # Probing does not change the configuration
+    assert (modem.channel, modem.level, modem.diagnostic) == (3, 4, False)
+
+
+def test_discover_modems():
+    answering = M16Emulator().transport()
+    silent, _ = MemoryTransport.pair()
+    found = discover_modems([answering, silent, "/dev/does-not-exist"], timeout=2.0)
+    assert [modem["port"] for modem in found] == [answering]
+    assert discover_modems([]) == []
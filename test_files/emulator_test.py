@@ -0,0 +1,157 @@
+# This pytest runs without hardware, the modems are emulated and run in simulated time
+
+import time
+import threading
+import pytest
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, Medium, encode_report
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+@pytest.fixture
+def modems(clock):
+    """Create two drivers connected to emulated modems in the same water."""
+    medium = Medium()
+    emulators = [M16Emulator(clock, medium=medium), M16Emulator(clock, medium=medium)]
+    drivers = [M16(emulator.transport(), channel=1, level=4, diagnostic=False, clock=clock)
+               for emulator in emulators]
+    return drivers, emulators
+
+
+def test_encode_report_round_trip():
+    report = M16Emulator().report()
+    report["TIME"] = 583563
+    assert M16.decode_packet(encode_report(report)) == report
+
+
+def test_configure(clock):
+    emulator = M16Emulator(clock)
+    start = time.monotonic()
+    modem = M16(emulator.transport(), channel=12, level=2, diagnostic=True, clock=clock)
+    assert time.monotonic() - start < 1, "Configuration did not run in simulated time"
+    assert clock.time() >= 6, "Configuration should take 6 simulated seconds"
+    assert (emulator.channel, emulator.level, emulator.diagnostic) == (12, 2, True)
+
+    report = modem.request_report()
+    assert report is not None
+    assert report["CHANNEL"] == 12
+    assert modem.level == 2
+
+
+def test_request_report_timeout(clock):
+    emulator = M16Emulator(clock)
+    modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+    emulator.REPORT_DELAY = 10
+    start = clock.time()
+    assert modem.request_report(overall_timeout=3) is None
+    assert clock.time() - start == pytest.approx(3, abs=0.01)
+
+
+def test_request_report_returns_early(clock):
+    emulator = M16Emulator(clock)
+    modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+    start = clock.time()
+    # The report follows the second 'r' after REPORT_DELAY, the gap after the command is left to the next one
+    assert modem.request_report(overall_timeout=1.5) is not None
+    assert clock.time() - start == pytest.approx(M16.COMMAND_GAP + emulator.REPORT_DELAY, abs=0.15)
+    written = recording(emulator)
+    modem.send_data("x")
+    assert clock.time() - start >= 2 * M16.COMMAND_GAP
+    assert written == b"x"
+
+
+def test_request_report_short_timeout(clock):
+    emulator = M16Emulator(clock)
+    modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+    written = recording(emulator)
+    for timeout in (0.5, 0.1):
+        start = clock.time()
+        # Both characters of the command do not fit, nothing is sent
+        assert modem.request_report(overall_timeout=timeout) is None
+        assert clock.time() - start == pytest.approx(timeout, abs=0.01)
+    # In diagnostic mode the reports the modem sends on its own every second are used
+    emulator.diagnostic = True
+    assert modem.request_report(overall_timeout=0.9) is not None
+    assert written == b""
+
+
+def recording(emulator):
+    """Keep everything the driver writes to the emulated modem."""
+    written = bytearray()
+    receive = emulator.receive
+    emulator.receive = lambda data: (written.extend(data), receive(data))[1]
+    return written
+
+
+def test_request_report_max_age(clock):
+    emulator = M16Emulator(clock)
+    modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+    written = recording(emulator)
+    report = modem.request_report()
+    assert written == b"rr"
+    # A recent report is returned without a request
+    clock.sleep(5)
+    assert modem.request_report(max_age=10) is report
+    assert written == b"rr"
+    clock.sleep(10)
+    assert modem.request_report(max_age=10) is not report
+    assert written == b"rrrr"
+
+
+def test_request_report_coalescing():
+    clock = VirtualClock(actors=0)
+    emulator = M16Emulator(clock)
+    modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+    written = recording(emulator)
+    registered = threading.Barrier(3)
+    reports = []
+
+    def request():
+        with clock.actor():
+            registered.wait()
+            reports.append(modem.request_report())
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    # The three callers share one request
+    assert written == b"rr"
+    assert len(reports) == 3 and reports[0] is not None
+    assert reports[0] is reports[1] is reports[2]
+
+
+def test_request_report_completes_command(modems, clock):
+    (sender, receiver), _ = modems
+    sender.set_diagnostic_mode()
+    # A report streamed in diagnostic mode arrives between the two characters of the request,
+    # the second 'r' must still be sent or it is paired with the first character of the message
+    assert sender.request_report() is not None
+    sender.send_msg("Hi")
+    assert receiver.read_packet(timeout=5) == b"Hi"
+
+
+def test_send_msg_transparent(modems, clock):
+    (sender, receiver), _ = modems
+    message = "This is a forty character long message."
+    start = time.monotonic()
+    sender.send_msg(message)
+    assert time.monotonic() - start < 2, "Sending did not run in simulated time"
+    packet = receiver.read_packet(timeout=5)
+    assert packet.decode("ascii") == message + " "
+
+
+def test_send_msg_diagnostic(modems, clock):
+    (sender, receiver), emulators = modems
+    sender.set_diagnostic_mode()
+    start = clock.time()
+    sender.send_msg("Hello!")
+    # Each block waits for TX_COMPLETE instead of the timeout
+    assert clock.time() - start < 3 * (1 + M16Emulator.BLOCK_AIRTIME + 0.5)
+    emulators[1].update()
+    assert emulators[1].packet_valid == 3
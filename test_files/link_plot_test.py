@@ -0,0 +1,66 @@
+# This pytest runs without hardware
+
+import tkinter as tk
+import pytest
+from link_plot import DecimatingBuffer, LinkPlot
+
+
+@pytest.fixture
+def root():
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("Tk needs a display")
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+def test_buffer_keeps_every_sample_until_full():
+    buffer = DecimatingBuffer(capacity=8)
+    for i in range(8):
+        buffer.append(float(i), float(i))
+    assert buffer.samples_per_bucket == 1
+    assert buffer.buckets() == [(float(i), float(i), float(i)) for i in range(8)]
+
+
+def test_buffer_size_is_bounded_and_keeps_extremes():
+    buffer = DecimatingBuffer(capacity=8)
+    for i in range(10000):
+        buffer.append(float(i), float(i % 7) if i != 4321 else 100.0)
+    buckets = buffer.buckets()
+    assert len(buckets) <= 9, f"Buffer grew to {len(buckets)} buckets"
+    assert max(b[2] for b in buckets) == 100.0, "Decimation lost the maximum value"
+    assert min(b[1] for b in buckets) == 0.0, "Decimation lost the minimum value"
+    times = [b[0] for b in buckets]
+    assert times == sorted(times), "Bucket times are not increasing"
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        DecimatingBuffer(capacity=7)
+
+
+def test_buffer_last_time():
+    buffer = DecimatingBuffer(capacity=4)
+    for i in range(8):
+        buffer.append(float(i), 0.0)
+    # The plot ends at the last sample, not at the start of the last bucket
+    assert buffer.buckets()[-1][0] == 6.0
+    assert buffer.last_time == 7.0
+    buffer.clear()
+    assert buffer.last_time is None
+
+
+def test_plot_destroyed_before_redraw(root):
+    errors = []
+    root.report_callback_exception = lambda *args: errors.append(args)
+    window = tk.Toplevel(root)
+    plot = LinkPlot(window)
+    plot.pack()
+    plot.add_report({"SIGNAL_POWER": 70, "NOISE_POWER": 40, "BER": 3}, 0.0)
+    window.destroy()
+    # The redraw scheduled by the report does not run on the destroyed canvas
+    root.after(2 * LinkPlot.REDRAW_INTERVAL_MS, root.quit)
+    root.mainloop()
+    assert errors == []
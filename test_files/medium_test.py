@@ -0,0 +1,130 @@
+# This pytest runs without hardware, the modems are emulated in an acoustic medium and run in simulated time
+
+import time
+import pytest
+from m16_clock import VirtualClock
+from m16_emulator import M16Emulator
+from m16_medium import AcousticMedium
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+def place(clock, medium, *positions, **settings):
+    """Create emulated modems at the given positions."""
+    modems = []
+    for position in positions:
+        modem = M16Emulator(clock, **settings)
+        medium.attach(modem, position)
+        modems.append(modem)
+    return modems
+
+
+def run(clock, modems, seconds):
+    """Let the simulated time pass and have every modem handle what happened."""
+    clock.advance(seconds)
+    for modem in modems:
+        modem.update()
+
+
+def test_propagation_delay(clock):
+    medium = AcousticMedium(seed=1)
+    sender, receiver = place(clock, medium, (0, 0, 0), (1500, 0, 0), diagnostic=True)
+    sender.receive(b"Hi")
+    run(clock, [sender, receiver], M16Emulator.BLOCK_AIRTIME + 0.99)
+    assert receiver.packet_valid == 0
+    run(clock, [sender, receiver], 0.02)
+    assert receiver.packet_valid == 1
+    assert b"Hi" in receiver.output
+
+
+def test_channel_isolation(clock):
+    medium = AcousticMedium(seed=1)
+    sender, same, other = place(clock, medium, (0, 0, 0), (100, 0, 0), (0, 100, 0))
+    other.channel = 2
+    sender.receive(b"Hi")
+    run(clock, [sender, same, other], 3)
+    assert same.output == b"Hi"
+    assert other.output == b""
+    assert other.packet_valid == other.packet_invalid == 0
+
+
+def test_collision(clock):
+    medium = AcousticMedium(seed=1)
+    first, second, receiver = place(clock, medium, (-200, 0, 0), (200, 0, 0), (0, 0, 0))
+    first.receive(b"AA")
+    run(clock, [first, second, receiver], 1)
+    second.receive(b"BB")
+    run(clock, [first, second, receiver], 3)
+    assert receiver.packet_valid == 0
+    assert receiver.packet_invalid == 2
+    assert medium.collisions == 2
+
+
+def test_capture(clock):
+    # A much closer sender is received despite the collision
+    medium = AcousticMedium(seed=1)
+    near, far, receiver = place(clock, medium, (10, 0, 0), (1000, 0, 0), (0, 0, 0))
+    near.receive(b"AA")
+    far.receive(b"BB")
+    run(clock, [near, far, receiver], 3)
+    assert receiver.output == b"AA"
+
+
+def test_half_duplex(clock):
+    medium = AcousticMedium(seed=1)
+    first, second = place(clock, medium, (0, 0, 0), (100, 0, 0))
+    first.receive(b"AA")
+    second.receive(b"BB")
+    run(clock, [first, second], 3)
+    assert first.output == second.output == b""
+    assert medium.missed == 2
+
+
+def test_power_level(clock):
+    medium = AcousticMedium(seed=1)
+    receiver, low, high = place(clock, medium, (0, 0, 0), (1500, 0, 0), (0, 1500, 0))
+    low.level, high.level = 1, 4
+    for _ in range(20):
+        low.receive(b"LL")
+        run(clock, [low, high, receiver], 3)
+        high.receive(b"HH")
+        run(clock, [low, high, receiver], 3)
+    assert receiver.output.count(b"HH") == 20
+    assert receiver.output.count(b"LL") < 20
+    assert medium.collisions == 0
+
+
+def test_diagnostic_report_counters(clock):
+    medium = AcousticMedium(seed=1)
+    sender, receiver = place(clock, medium, (0, 0, 0), (2300, 0, 0))
+    receiver.diagnostic = True
+    receiver._next_report = float("inf")
+    sender.level = 3
+    for _ in range(10):
+        sender.receive(b"Hi")
+        run(clock, [sender, receiver], 3)
+    statistics = medium.statistics()
+    assert statistics["transmissions"] == 10
+    assert receiver.packet_valid == statistics["delivered"]
+    assert receiver.packet_invalid == statistics["corrupted"]
+    assert receiver.packet_valid + receiver.packet_invalid > 0
+    # One report per detected block, TB_VALID for those decoded
+    assert receiver.output.count(b"$") == receiver.packet_valid + receiver.packet_invalid
+
+
+def test_scale(clock):
+    medium = AcousticMedium(seed=1)
+    modems = place(clock, medium, *[(100 * (i % 5), 100 * (i // 5), 10) for i in range(30)])
+    for i, modem in enumerate(modems):
+        modem.channel = i % 12 + 1
+    start = time.monotonic()
+    for _ in range(100):
+        for modem in modems:
+            modem.receive(b"ab")
+        run(clock, modems, M16Emulator.BLOCK_AIRTIME + 1)
+    elapsed = time.monotonic() - start
+    assert medium.transmissions == 3000
+    assert elapsed < 3, f"{medium.transmissions / elapsed:.0f} blocks per second is too slow"
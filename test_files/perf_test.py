@@ -0,0 +1,51 @@
+# This pytest runs without hardware, the modems are emulated in an acoustic medium and run in simulated time
+
+import pytest
+from m16_perf import Reflector, emulated_pair, run_test, sequence_character, STREAM, STREAM_END
+
+
+def test_ping():
+    clock, modem, peer = emulated_pair(distance=750, seed=1)
+    results = run_test(lambda client: client.ping(3), modem, peer)
+    ping = results["client"]
+    assert ping["sent"] == ping["received"] == 3
+    assert ping["loss"] == 0
+    # Two blocks of 2 s and twice 0.5 s of propagation, plus the time the reflector needs to read the ping,
+    # measured with the 1 ms resolution of the modem clocks
+    assert 4.99 <= ping["rtt_min"] <= ping["rtt_max"] < 5.6
+    assert ping["signal_power"] > ping["noise_power"]
+
+
+def test_stream():
+    clock, modem, peer = emulated_pair(distance=750, seed=1)
+    results = run_test(lambda client: client.stream(duration=30), modem, peer)
+    sent = results["client"]["sent"]
+    assert sent > 10
+    [stream] = results["reflector"]
+    assert stream["received"] == stream["expected"] == sent
+    assert stream["loss"] == 0
+    assert stream["goodput_bps"] == pytest.approx(16 / stream["interarrival_mean"])
+    assert stream["jitter"] < 0.1
+
+
+def test_stream_loss():
+    clock, modem, _ = emulated_pair()
+    reflector = Reflector(modem)
+    report = {"SIGNAL_POWER": 60, "NOISE_POWER": 40, "BER": 0}
+    # Blocks 1, 3 and 4 of 6 are lost
+    for number, time in ((0, 0.0), (2, 4.0), (5, 10.0)):
+        reflector.handle((STREAM + sequence_character(number)).encode("ascii"), time, report)
+    reflector.handle((STREAM_END + sequence_character(6)).encode("ascii"), 12.0, report)
+    [stream] = reflector.streams
+    assert (stream["received"], stream["expected"], stream["lost"]) == (3, 6, 3)
+    assert stream["loss"] == pytest.approx(0.5)
+    assert stream["interarrival_mean"] == pytest.approx(5.0)
+
+
+def test_sweep():
+    clock, modem, peer = emulated_pair(distance=750, seed=1)
+    results = run_test(lambda client: client.sweep([1, 5], [2, 4], count=1), modem, peer)
+    points = [(point["channel"], point["level"], point["received"]) for point in results["client"]]
+    assert points == [(1, 2, 1), (1, 4, 1), (5, 2, 1), (5, 4, 1)]
+    assert modem.channel == peer.channel == 5
+    assert modem.ser.modem.channel == peer.ser.modem.channel == 5
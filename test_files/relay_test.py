@@ -0,0 +1,123 @@
+# This pytest runs without hardware, the modems are emulated and run in simulated time
+
+import threading
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, Medium
+from m16_frame import Frame, FrameDecoder
+from m16_relay import RelayEngine
+from m16_transport import LoopbackTransport
+
+
+def test_frame_round_trip():
+    frame = Frame(3, 1, 7, b"Hello relay", next_hop=2)
+    decoder = FrameDecoder()
+    events = [decoder.feed(block) for block in frame.blocks()]
+    assert events[:3] == [None, None, "header"]
+    assert events[-1] == "frame"
+    assert set(events[3:-1]) == {"payload"}
+    assert decoder.frame.payload == b"Hello relay"
+    assert (decoder.frame.destination, decoder.frame.origin, decoder.frame.next_hop) == (3, 1, 2)
+
+
+def test_frame_corrupt():
+    blocks = Frame(3, 1, 7, b"Hello").blocks()
+    blocks[3] = b"XX"
+    decoder = FrameDecoder()
+    assert [decoder.feed(block) for block in blocks][-1] == "corrupt"
+
+
+def test_frame_gap_resynchronises():
+    decoder = FrameDecoder(max_gap=10)
+    blocks = Frame(3, 1, 7, b"Hello").blocks()
+    for block in blocks[:4]:
+        decoder.feed(block, time=0)
+    # The rest of the frame was lost, the next frame starts after a pause
+    events = [decoder.feed(block, time=20) for block in blocks]
+    assert events[-1] == "frame"
+
+
+def test_store_and_forward_and_dedup():
+    modem = M16(LoopbackTransport(), channel=None, level=None, diagnostic=None)
+    relay = RelayEngine(2, modem, routes={3: 3})
+    frame = Frame(3, 1, 7, b"Hi", next_hop=2)
+    for _ in range(2):
+        for block in frame.blocks():
+            relay.on_block(block)
+    assert relay.forwarded == 1
+    assert relay.duplicates == 1
+    forwarded = b"".join(relay._outbox)
+    assert forwarded == Frame(3, 1, 7, b"Hi", next_hop=3, sender=2).encode()
+
+    # Frames for this node are delivered once
+    for _ in range(2):
+        for block in Frame(2, 1, 8, b"Me").blocks():
+            relay.on_block(block)
+    assert relay.messages.get_nowait().payload == b"Me"
+    assert relay.messages.empty()
+
+
+def test_dedup_reuses_message_ids():
+    clock = VirtualClock()
+    modem = M16(LoopbackTransport(), channel=None, level=None, diagnostic=None, clock=clock)
+    relay = RelayEngine(2, modem)
+    # More messages from one origin than there are message ids
+    for number in range(200):
+        for block in Frame(2, 1, number % 128, b"Hi").blocks():
+            relay.on_block(block)
+    assert (relay.delivered, relay.duplicates) == (200, 0)
+    # A recent message is still recognised as a copy
+    for block in Frame(2, 1, 199 % 128, b"Hi").blocks():
+        relay.on_block(block)
+    assert relay.duplicates == 1
+    # and an old one is forgotten, e.g. after the origin was restarted
+    clock.advance(RelayEngine.DEDUP_AGE + 1)
+    for block in Frame(2, 1, 199 % 128, b"Hi").blocks():
+        relay.on_block(block)
+    assert (relay.delivered, relay.duplicates) == (201, 1)
+
+
+def test_pipelined_relay():
+    """Node 1 on channel 1 sends to node 3 on channel 2 through relay 2, which has a modem on each channel."""
+    clock = VirtualClock(actors=0)
+    medium = Medium()
+    emulators = {
+        "origin": M16Emulator(clock, channel=1, medium=medium),
+        "relay_rx": M16Emulator(clock, channel=1, diagnostic=True, medium=medium),
+        "relay_tx": M16Emulator(clock, channel=2, medium=medium),
+        "destination": M16Emulator(clock, channel=2, diagnostic=True, medium=medium),
+    }
+    modems = {name: M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+              for name, emulator in emulators.items()}
+    modems["relay_rx"].diagnostic = modems["destination"].diagnostic = True
+
+    received = []
+    origin = RelayEngine(1, modems["origin"], routes={3: 2})
+    relay = RelayEngine(2, modems["relay_rx"], modems["relay_tx"], routes={3: 3})
+    destination = RelayEngine(3, modems["destination"], on_message=lambda f: received.append(clock.time()))
+    frame = origin.send(3, b"Hello relay")
+    message_time = len(frame.blocks()) * 3  # send_msg needs 3 seconds per block in transparent mode
+
+    def stop_when_received():
+        while not received and clock.time() < 4 * message_time:
+            clock.sleep(1)
+        for engine in (origin, relay, destination):
+            engine.stop()
+
+    tasks = [origin.send_loop, relay.read_loop, relay.send_loop, destination.read_loop, stop_when_received]
+    registered = threading.Barrier(len(tasks))
+
+    def actor(task):
+        with clock.actor():
+            registered.wait()
+            task()
+    threads = [threading.Thread(target=actor, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    assert destination.messages.get_nowait().payload == b"Hello relay"
+    assert relay.forwarded == 1
+    # Forwarding starts when the header (3 blocks) has arrived, store-and-forward would take twice the message time
+    assert received[0] < message_time + 3 * 3
@@ -0,0 +1,162 @@
+# This pytest runs without hardware, the modem is emulated on a virtual clock and unplugged by the test
+
+import threading
+import serial
+import pytest
+import m16_supervisor
+from m16_clock import VirtualClock
+from m16_emulator import M16Emulator, Medium
+from m16_driver import M16
+from m16_transport import Transport
+from m16_supervisor import SupervisedM16
+
+
+class UnpluggedPort(Transport):
+    """
+    Port to an emulated modem that is unplugged on a chosen write: the write fails and the modem is
+    power cycled, so it has forgotten the characters it was sent and is back to its power on settings.
+    """
+
+    def __init__(self, clock, medium=None):
+        self.clock = clock
+        self.medium = medium
+        self.is_open = True
+        self.writes = []
+        self.fail_at = None
+        self.replug = True
+        self.on_read = None
+        self._connect()
+
+    def _connect(self):
+        self.modem = M16Emulator(clock=self.clock, medium=self.medium)
+        self.link = self.modem.transport()
+
+    def unplug_after(self, writes, replug=True):
+        self.fail_at = len(self.writes) + writes
+        self.replug = replug
+
+    def write(self, data):
+        if len(self.writes) == self.fail_at:
+            self.fail_at = None
+            self.is_open = self.replug
+            self._connect()
+            raise serial.SerialException("Device disconnected")
+        self.writes.append(data)
+        return self.link.write(data)
+
+    def read(self, size=1):
+        if self.on_read is not None:
+            self.on_read()
+        return self.link.read(size)
+
+    @property
+    def in_waiting(self):
+        return self.link.in_waiting
+
+    def close(self):
+        pass
+
+
+class CountingScheduler:
+    """Stands in for m16_tdma.TdmaScheduler, counts the blocks waiting for a slot."""
+
+    def __init__(self):
+        self.waits = 0
+
+    def wait_for_slot(self):
+        self.waits += 1
+
+
+def test_command_restarted():
+    clock = VirtualClock()
+    port = UnpluggedPort(clock)
+    modem = SupervisedM16(port, channel=None, level=None, diagnostic=None, clock=clock)
+
+    port.unplug_after(2)  # The channel value after "cc" fails
+    assert modem.set_channel(5)
+    assert modem.reconnects == 1
+    assert port.modem.channel == modem.channel == 5
+    # The whole command was sent again, not the value on its own
+    assert port.writes[-3:] == [b"c", b"c", b"5"]
+    clock.advance(5)
+    port.modem.update()
+    assert port.modem.blocks_sent == 0
+
+
+def test_message_resumed():
+    clock = VirtualClock()
+    medium = Medium()
+    port = UnpluggedPort(clock, medium)
+    modem = SupervisedM16(port, channel=None, level=None, diagnostic=None, clock=clock)
+    peer = M16(M16Emulator(clock=clock, medium=medium).transport(), channel=None, level=None, diagnostic=None,
+               clock=clock)
+    changes = []
+    modem.on_connection_change = changes.append
+    modem.tdma = CountingScheduler()
+
+    port.unplug_after(1)  # The second block fails
+    modem.send_msg("Hello!")
+    assert changes == [False, True]
+    assert not modem.pending_blocks
+    # The block sent again waits for a slot again, the reconnection took time
+    assert modem.tdma.waits == 4
+    assert peer.read_packet(timeout=1) == b"Hello!"
+
+
+def test_reconnect_path_vanished(monkeypatch):
+    clock = VirtualClock()
+    port = UnpluggedPort(clock)
+    modem = SupervisedM16(port, channel=None, level=None, diagnostic=None, clock=clock)
+
+    # The device path disappears again between checking for it and opening it
+    opened = []
+    def open_transport(port, baudrate, timeout):
+        opened.append(port)
+        if len(opened) == 1:
+            raise ValueError(f"Port {port} does not exist")
+        return port
+    monkeypatch.setattr(m16_supervisor, "open_transport", open_transport)
+
+    port.unplug_after(0)
+    modem.get_report()
+    assert len(opened) == 2 and modem.reconnects == 1
+    assert port.writes[-2:] == [b"r", b"r"]
+
+
+def test_probe_reads_alone():
+    clock = VirtualClock()
+    port = UnpluggedPort(clock)
+    modem = SupervisedM16(port, channel=None, level=None, diagnostic=None, clock=clock)
+    modem.background_reader = True
+
+    def other_thread_reads():
+        result = []
+        thread = threading.Thread(target=lambda: result.append(modem._reader_elsewhere()))
+        thread.start()
+        thread.join()
+        return not result[0]
+    observed = []
+    port.on_read = lambda: observed.append((modem.background_reader, modem._reader_elsewhere(),
+                                            other_thread_reads()))
+
+    port.unplug_after(0)
+    modem.get_report()
+    # While probing only the reconnecting thread reads, without changing background_reader for the others
+    assert observed and set(observed) == {(True, False, False)}
+    port.on_read = None
+    assert modem._reader_elsewhere()
+
+
+def test_failed_reconnect_drops_message():
+    clock = VirtualClock()
+    port = UnpluggedPort(clock)
+    modem = SupervisedM16(port, channel=None, level=None, diagnostic=None, clock=clock, reconnect_timeout=1)
+
+    port.unplug_after(1, replug=False)
+    with pytest.raises(serial.SerialException):
+        modem.send_msg("Hello!")
+    assert not modem.pending_blocks
+
+    port.is_open = True
+    modem.send_msg("Bye")
+    assert port.writes == [b"He", b"By", b"e "]
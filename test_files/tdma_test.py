@@ -0,0 +1,138 @@
+# This pytest runs without hardware, the modems are emulated in an acoustic medium and run in simulated time
+
+import threading
+import pytest
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, encode_report
+from m16_medium import AcousticMedium
+from m16_tdma import TdmaScheduler
+from m16_transport import MemoryTransport
+
+POSITIONS = [(0, 0, 10), (300, 0, 10), (0, 300, 10), (300, 300, 10)]
+
+
+def network(clock, diagnostic=False):
+    """Create drivers for emulated modems sharing channel 1."""
+    medium = AcousticMedium(seed=1)
+    emulators = []
+    for position in POSITIONS:
+        emulator = M16Emulator(clock, diagnostic=diagnostic)
+        medium.attach(emulator, position)
+        emulators.append(emulator)
+    modems = [M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+              for emulator in emulators]
+    return medium, modems
+
+
+def run_all(clock, tasks):
+    """Run one task per thread, each thread is an actor of the simulated clock."""
+    registered = threading.Barrier(len(tasks))
+
+    def actor(task):
+        with clock.actor():
+            # Time must not move on before every thread is registered
+            registered.wait()
+            task()
+    threads = [threading.Thread(target=actor, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+
+def test_schedule():
+    tdma = TdmaScheduler(slot=2, slots=4, max_range=750, guard=0.5)
+    assert tdma.slot_length == pytest.approx(3.0)
+    assert tdma.frame_length == pytest.approx(12.0)
+    assert tdma.next_transmit_time(0.0) == pytest.approx(6.0)
+    assert tdma.next_transmit_time(6.0) == pytest.approx(6.0)
+    assert tdma.next_transmit_time(6.1) == pytest.approx(18.0)
+    assert tdma.slot_at(7.0) == 2
+    with pytest.raises(ValueError):
+        TdmaScheduler(slot=4, slots=4)
+
+
+def test_without_tdma_blocks_collide():
+    clock = VirtualClock(actors=0)
+    medium, modems = network(clock)
+    run_all(clock, [lambda modem=modem: modem.send_msg("abcd") for modem in modems])
+    for emulator in medium.modems:
+        emulator.update()
+    assert medium.collisions + medium.missed > 0
+    assert medium.delivered < 2 * 3 * len(modems)
+
+
+def test_tdma_is_collision_free():
+    clock = VirtualClock(actors=0)
+    medium, modems = network(clock)
+    schedulers = [TdmaScheduler(slot=i, slots=len(modems), max_range=500) for i in range(len(modems))]
+    for scheduler, modem in zip(schedulers, modems):
+        scheduler.attach(modem)
+    run_all(clock, [lambda modem=modem: modem.send_msg("abcd") for modem in modems])
+    for emulator in medium.modems:
+        emulator.update()
+    assert medium.transmissions == 2 * len(modems)
+    assert medium.collisions == medium.missed == 0
+    assert medium.delivered == 2 * 3 * len(modems)
+    statistics = schedulers[1].statistics()
+    assert statistics["blocks_sent"] == 2
+    assert statistics["own_slots_used"] == 2
+
+
+def test_beacon_sync():
+    clock = VirtualClock(actors=0)
+    medium, modems = network(clock, diagnostic=True)
+    beacon = TdmaScheduler(slot=0, slots=4, beacon=True)
+    follower = TdmaScheduler(slot=1, slots=4, epoch=1.7, beacon_range=300)
+    beacon.attach(modems[0])
+    follower.attach(modems[1])
+    done = threading.Event()
+
+    def send_beacons():
+        for _ in range(2):
+            beacon.send_beacon()
+        clock.sleep(beacon.slot_length)
+        done.set()
+
+    def listen():
+        while not done.is_set():
+            modems[1].read_packet(timeout=0.5)
+
+    run_all(clock, [send_beacons, listen])
+    assert follower.beacons_received == 2
+    offset = (follower.epoch - beacon.epoch) % follower.frame_length
+    assert min(offset, follower.frame_length - offset) < 0.2
+    assert follower.statistics()["blocks_per_slot"][0] == 2
+
+
+def test_beacon_time_from_its_report():
+    clock = VirtualClock()
+    host, modem_end = MemoryTransport.pair(timeout=0.1)
+    modem = M16(host, channel=None, level=None, diagnostic=None, clock=clock)
+    follower = TdmaScheduler(slot=1, slots=4)
+    follower.attach(modem)
+    modem.remove_listener(follower.on_packet)
+    beacon = encode_report(M16Emulator().report(block=TdmaScheduler.BEACON_BLOCK.encode("ascii")))
+    clock.advance(10)
+    modem_end.write(beacon)
+    assert modem.read_packet(timeout=0.1) == beacon
+    # Another report is read before the listener sees the beacon
+    clock.advance(5)
+    modem_end.write(encode_report(M16Emulator().report()))
+    modem.read_packet(timeout=0.1)
+    follower.on_packet(beacon)
+    assert follower.epoch == pytest.approx(10 - follower.BLOCK_AIRTIME)
+
+
+def test_used_frames_bounded():
+    clock = VirtualClock()
+    tdma = TdmaScheduler(slot=1, slots=4, clock=clock)
+    for _ in range(3 * tdma.USED_FRAMES_KEPT):
+        tdma.wait_for_slot()
+        tdma.wait_for_slot()  # Sent in the same slot, the frame is counted once
+        clock.advance(tdma.frame_length)
+    assert len(tdma.used_frames) == tdma.USED_FRAMES_KEPT
+    statistics = tdma.statistics()
+    assert statistics["blocks_sent"] == 6 * tdma.USED_FRAMES_KEPT
+    assert statistics["own_slots_used"] == 3 * tdma.USED_FRAMES_KEPT
@@ -0,0 +1,83 @@
+# This pytest runs without hardware, the modems are emulated in an acoustic medium and run in simulated time
+
+import random
+import threading
+import pytest
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator
+from m16_medium import AcousticMedium
+from m16_timesync import TimeSync, one_way_latency
+
+
+def run_all(clock, tasks):
+    """Run one task per thread, each thread is an actor of the simulated clock."""
+    registered = threading.Barrier(len(tasks))
+
+    def actor(task):
+        with clock.actor():
+            registered.wait()
+            task()
+    threads = [threading.Thread(target=actor, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+
+def test_unwrap_and_drift():
+    sync = TimeSync()
+    rng = random.Random(1)
+    start = (1 << 24) - 100000  # wraps after 100 s
+    for second in range(600):
+        ticks = int(start + second * 1000 * (1 + 100e-6)) & 0xFFFFFF
+        sync.add(ticks, 50.0 + second + rng.uniform(0, 0.1))
+    assert sync.wraps == 1
+    assert sync.restarts == 0
+    assert sync.drift_ppm == pytest.approx(100, abs=10)
+    # TIME of the report at second 550, after the wraparound
+    assert sync.host_time(int(start + 550 * 1000 * (1 + 100e-6)) & 0xFFFFFF) == pytest.approx(600.0, abs=0.005)
+    statistics = sync.statistics()
+    assert 0.03 < statistics["read_delay_mean"] < 0.07
+
+    # A restarted modem counts from 0 again
+    sync.add(0, 650.0)
+    assert sync.restarts == 1
+    assert sync.host_time(1000) == pytest.approx(651.0)
+
+
+def test_one_way_latency():
+    clock = VirtualClock(actors=0)
+    medium = AcousticMedium(seed=1)
+    sender = M16Emulator(clock, diagnostic=True, drift=200, initial_time=(1 << 24) - 40000)
+    receiver = M16Emulator(clock, diagnostic=True, drift=-50)
+    medium.attach(sender, (0, 0, 10))
+    medium.attach(receiver, (750, 0, 10))
+    modems = [M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+              for emulator in (sender, receiver)]
+    syncs = [TimeSync(), TimeSync()]
+    for sync, modem in zip(syncs, modems):
+        modem.diagnostic = True
+        sync.attach(modem)
+
+    def send():
+        # Reports for the mapping before and after the message
+        while clock.time() < 60:
+            modems[0].read_packet(0.5)
+        modems[0].send_msg("abcdef")
+        while clock.time() < 100:
+            modems[0].read_packet(0.5)
+
+    def receive():
+        while clock.time() < 100:
+            modems[1].read_packet(0.5)
+
+    run_all(clock, [send, receive])
+    assert syncs[0].wraps == 1
+    latencies = one_way_latency(*syncs)
+    assert len(latencies) == 3
+    # 750 m at 1500 m/s, measured at the resolution of the modems rather than of the polling
+    for latency in latencies:
+        assert latency == pytest.approx(0.5, abs=0.005)
+    transmit_delay = syncs[0].statistics()["transmit_delay_mean"]
+    assert transmit_delay == pytest.approx(M16Emulator.BLOCK_AIRTIME, abs=0.005)
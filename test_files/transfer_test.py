@@ -0,0 +1,155 @@
+# This pytest runs without hardware, the modems are emulated and run in simulated time
+
+import os
+import threading
+import pytest
+from m16_clock import VirtualClock
+from m16_driver import M16
+from m16_emulator import M16Emulator, Medium
+from m16_frame import Frame
+from m16_relay import RelayEngine
+from m16_transfer import send_file, receive_file, pack7, unpack7, WINDOW, CHUNK_SIZE
+
+
+def run_all(clock, tasks):
+    """Run one task per thread, each thread is an actor of the simulated clock."""
+    registered = threading.Barrier(len(tasks))
+
+    def actor(task):
+        with clock.actor():
+            registered.wait()
+            task()
+    threads = [threading.Thread(target=actor, args=(task,)) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(120)
+
+
+@pytest.fixture
+def engines():
+    """Engines of node 1 and node 2 on emulated modems in diagnostic mode."""
+    clock = VirtualClock(actors=0)
+    medium = Medium()
+    engines = []
+    for node in (1, 2):
+        emulator = M16Emulator(clock, diagnostic=True, medium=medium)
+        modem = M16(emulator.transport(), channel=None, level=None, diagnostic=None, clock=clock)
+        modem.diagnostic = True
+        engines.append(RelayEngine(node, modem))
+    return clock, engines
+
+
+def transfer(clock, engines, source, output, progress=None, cancel=None):
+    """Send a file from node 1 to node 2, returns the results of send_file() and receive_file()."""
+    results = {}
+
+    def send():
+        results["sent"] = send_file(engines[0], 2, source, progress=progress, cancel=cancel)
+
+    def receive():
+        results["received"] = receive_file(engines[1], output, timeout=300)
+        # Let the last acknowledgement reach the sender before stopping
+        while "sent" not in results:
+            clock.sleep(1)
+        for engine in engines:
+            engine.stop()
+
+    tasks = [send, receive] + [loop for engine in engines for loop in (engine.read_loop, engine.send_loop)]
+    run_all(clock, tasks)
+    return results
+
+
+def test_pack7():
+    data = bytes(range(256))
+    packed = pack7(data)
+    assert max(packed) < 128
+    assert unpack7(packed) == data
+
+
+def test_send_file(engines, tmp_path):
+    clock, engines = engines
+    source = tmp_path / "log.bin"
+    source.write_bytes(os.urandom(2 * CHUNK_SIZE + 17))
+    output = tmp_path / "received"
+    output.mkdir()
+    progress = []
+    results = transfer(clock, engines, str(source), str(output), lambda *args: progress.append(args))
+    assert results == {"sent": True, "received": str(output / "log.bin")}
+    assert (output / "log.bin").read_bytes() == source.read_bytes()
+    assert progress[-1][:2] == (source.stat().st_size, source.stat().st_size)
+    assert not os.path.exists(str(source) + ".m16send")
+    assert os.listdir(output) == ["log.bin"]
+
+
+def test_resume(engines, tmp_path):
+    clock, engines = engines
+    source = tmp_path / "log.txt"
+    source.write_bytes(b"0123456789" * (WINDOW * CHUNK_SIZE // 10 + 5))
+    output = tmp_path / "log_received.txt"
+
+    # The transfer is interrupted after the first window
+    cancel = threading.Event()
+    results = transfer(clock, engines, str(source), str(output), lambda done, *_: done and cancel.set(), cancel)
+    assert results == {"sent": False, "received": None}
+    assert not output.exists()
+    assert os.path.getsize(str(output) + ".part") == WINDOW * CHUNK_SIZE
+
+    # Both ends continue from their checkpoints
+    clock, engines = engines_after_reboot(clock, engines)
+    progress = []
+    results = transfer(clock, engines, str(source), str(output), lambda *args: progress.append(args))
+    assert results == {"sent": True, "received": str(output)}
+    assert progress[0][0] == WINDOW * CHUNK_SIZE
+    assert output.read_bytes() == source.read_bytes()
+
+
+def test_large_file(engines, tmp_path):
+    clock, engines = engines
+    # More frames than there are message ids
+    source = tmp_path / "large.bin"
+    source.write_bytes(os.urandom(130 * CHUNK_SIZE))
+    output = tmp_path / "large_received.bin"
+    results = transfer(clock, engines, str(source), str(output))
+    assert results == {"sent": True, "received": str(output)}
+    assert output.read_bytes() == source.read_bytes()
+    assert engines[1].duplicates == 0
+
+
+def test_resume_after_sender_restart(engines, tmp_path):
+    clock, engines = engines
+    source = tmp_path / "log.txt"
+    source.write_bytes(b"0123456789" * (3 * WINDOW * CHUNK_SIZE // 10))
+    output = tmp_path / "log_received.txt"
+    cancel = threading.Event()
+    transfer(clock, engines, str(source), str(output), lambda done, *_: done and cancel.set(), cancel)
+
+    # Only the sender restarts, the receiver still has its message ids in the duplicate cache
+    clock, engines = engines_after_reboot(clock, engines, keep_cache=(2,))
+    engines[1].DEDUP_AGE = 24 * 3600  # The sender restarted before the ids expired
+    results = transfer(clock, engines, str(source), str(output))
+    assert results == {"sent": True, "received": str(output)}
+    assert output.read_bytes() == source.read_bytes()
+    assert engines[1].duplicates == 0
+
+
+def test_malformed_offer(engines, tmp_path):
+    clock, engines = engines
+    receiver = engines[1]
+    for payload in (b"O", b"Ox:0123456789abcdef:a.txt", b"O12:not a hash:a.txt", b"O12:0123456789abcdef:..",
+                    b"Dx:data"):
+        receiver.messages.put(Frame(2, 1, 0, payload))
+    assert receive_file(receiver, str(tmp_path), timeout=10) is None
+    assert os.listdir(tmp_path) == []
+
+
+def engines_after_reboot(clock, engines, keep_cache=()):
+    """New engines on the same modems, the nodes in keep_cache were not restarted and keep their duplicate cache."""
+    new_engines = []
+    for engine in engines:
+        engine.rx_modem.remove_listener(engine.on_packet)
+        new_engine = RelayEngine(engine.node_id, engine.rx_modem)
+        if engine.node_id in keep_cache:
+            new_engine.delivered_keys = engine.delivered_keys
+        new_engines.append(new_engine)
+    return clock, new_engines
@@ -0,0 +1,100 @@
+# This pytest runs without hardware
+
+import socket
+import struct
+import threading
+import time
+import pytest
+from m16_driver import M16
+from m16_transport import (MemoryTransport, LoopbackTransport, SocketTransport, SerialTransport,
+                           open_transport)
+
+
+def make_report(channel: int = 3) -> bytes:
+    """Helper function to create a valid 18 byte report."""
+    data = struct.pack("<HBBBHBBBBBHBB", 0, 12, 100, 40, 5, 1, 0x56, 1, 2, 3, 39040, (channel << 2) | 2, 0)
+    return b"$" + data + b"\n"
+
+
+@pytest.fixture
+def tcp_echo():
+    """Start a TCP server echoing everything back and count the segments it receives."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    segments = []
+
+    def serve():
+        conn, _ = server.accept()
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            segments.append(data)
+            conn.sendall(data)
+        conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname(), segments
+    server.close()
+
+
+def test_memory_pair():
+    a, b = MemoryTransport.pair(timeout=0.1)
+    assert a.write(b"Hi") == 2
+    assert b.in_waiting == 2
+    assert b.read(2) == b"Hi"
+    assert b.read(1) == b"", "Read did not time out on an empty transport"
+
+
+def test_loopback():
+    loop = LoopbackTransport(timeout=0.1)
+    loop.write(b"abc")
+    assert loop.read(3) == b"abc"
+
+
+def test_socket_transport_coalesces_writes(tcp_echo):
+    (host, port), segments = tcp_echo
+    transport = open_transport(f"tcp://{host}:{port}", timeout=1.0)
+    assert isinstance(transport, SocketTransport)
+    transport.write(b"c")
+    transport.write(b"5")
+    transport.flush()
+    assert transport.read(2) == b"c5"
+    assert segments == [b"c5"], f"Writes were not coalesced: {segments}"
+    transport.close()
+
+
+def test_socket_transport_coalesce_delay(tcp_echo):
+    (host, port), segments = tcp_echo
+    transport = SocketTransport(host, port, timeout=1.0, coalesce_delay=0.5)
+    # Each write wakes the writer thread, it still waits the whole delay from the first one
+    for data in (b"c", b"c", b"5"):
+        transport.write(data)
+        time.sleep(0.05)
+    transport.flush()
+    assert transport.read(3) == b"cc5"
+    assert segments == [b"cc5"], f"Writes were not coalesced: {segments}"
+    transport.close()
+
+
+def test_open_transport():
+    assert isinstance(open_transport("loop://"), SerialTransport)
+    transport = LoopbackTransport()
+    assert open_transport(transport) is transport
+    with pytest.raises(ValueError):
+        open_transport("/dev/does-not-exist")
+
+
+def test_driver_over_memory_transport():
+    host, modem_end = MemoryTransport.pair(timeout=0.1)
+    modem = M16(host, channel=None, level=None, diagnostic=None)
+    modem.send_data("Hi")
+    assert modem_end.read(2) == b"Hi"
+
+    modem_end.write(make_report(channel=3))
+    packet = modem.read_packet(timeout=0.5)
+    assert packet == make_report(channel=3)
+    report = modem.decode_packet(packet)
+    assert report["CHANNEL"] == 3
+    assert modem.latest_report() == report